@@ -1,10 +1,21 @@
 from pathlib import Path
-import pandas as pd
+import argparse
 import sys
-import re
+import time
+import tracemalloc
+
+import pandas as pd
 
 DATA_DIR = Path(__file__).parent
 
+INCOME_FILE = DATA_DIR / "Total_Anual_Income.csv"
+POSTCODE_REF_FILE = DATA_DIR / "Postcode_Ref.csv"
+OUTPUT_FILE = DATA_DIR / "Postcode_Income_Filtered.parquet"
+
+# Only the columns we join on / plot are read from the national postcode file.
+POSTCODE_COLUMNS = ["pcd", "lat", "long", "msoa11"]
+CHUNK_SIZE = 500_000
+
 # -----------------------------------------
 # Postcode prefix mapping
 # -----------------------------------------
@@ -19,73 +30,90 @@ postcode_mapping = {
 # Turn into a flat list of unique prefixes
 ALLOWED_PREFIXES = sorted({p for lst in postcode_mapping.values() for p in lst})
 
+# Postcode area = leading letters up to the first digit, so 'E' must not match 'EC1A 1BB'.
+PREFIX_PATTERN = r"^\s*(?:" + "|".join(ALLOWED_PREFIXES) + r")\d"
+
+
+def parse_money(values: pd.Series) -> pd.Series:
+    """Turn strings such as ' 30,500 ' or '£30,500' into floats (NaN when unparsable)."""
+    return pd.to_numeric(values.astype(str).str.replace(r"[£,\s]", "", regex=True), errors="coerce")
+
 
-def load_csv(filename: str) -> pd.DataFrame:
-    path = DATA_DIR / filename
+def load_income(path: Path = INCOME_FILE) -> pd.DataFrame:
+    """Read the ONS MSOA income table, skipping the title rows above the real header."""
     if not path.exists():
         raise FileNotFoundError(f"CSV file not found: {path}")
-    try:
-        return pd.read_csv(path)
-    except Exception as e:
-        raise RuntimeError(f"Failed to read {path}: {e}") from e
-
-
-def extract_prefix(postcode: str) -> str:
-    """
-    Extract the outward code prefix, e.g.:
-    'BR1 3AB' → 'BR'
-    'EC1A 1BB' → 'EC'
-    'W1A 0AX' → 'W'
-    """
-    if not isinstance(postcode, str):
-        return None
-    pc = postcode.strip().upper()
-    # outward code = letters at start until digit
-    m = re.match(r"^[A-Z]+", pc)
-    return m.group(0) if m else None  # type: ignore
+    with path.open(encoding="utf-8-sig") as handle:
+        header_row = next((i for i, line in enumerate(handle) if line.startswith("MSOA code")), 0)
 
+    income_df = pd.read_csv(path, skiprows=header_row, encoding="utf-8-sig", dtype=str)
+    income_df = income_df.iloc[:, [0, 1, 2, 3, 6]]
+    income_df.columns = ["msoa11", "msoa_name", "la_code", "la_name", "total_income"]
+    income_df = income_df[income_df["msoa11"].notna()].copy()
+    income_df["msoa11"] = income_df["msoa11"].str.strip()
+    income_df["total_income"] = parse_money(income_df["total_income"])
+    return income_df.drop_duplicates(subset=["msoa11"]).reset_index(drop=True)
 
-if __name__ == "__main__":
-    try:
-        income_df = load_csv("Total_Anual_Income.csv")
-        postcode_df = load_csv("Postcode_Ref.csv")
-    except Exception as exc:
-        print(exc, file=sys.stderr)
-        sys.exit(1)
 
-    # ---------------------------------------------------
-    # Prepare postcode dataframe
-    # ---------------------------------------------------
-    postcode_df["prefix"] = postcode_df["pcd"].apply(extract_prefix)
-    filtered_pc = postcode_df[postcode_df["prefix"].isin(ALLOWED_PREFIXES)].copy()
+def iter_filtered_postcodes(path: Path = POSTCODE_REF_FILE, chunk_size: int = CHUNK_SIZE):
+    """Stream the national postcode file and yield only rows in ALLOWED_PREFIXES."""
+    if not path.exists():
+        raise FileNotFoundError(f"CSV file not found: {path}")
+    reader = pd.read_csv(
+        path,
+        usecols=POSTCODE_COLUMNS,
+        dtype={"pcd": str, "msoa11": str, "lat": "float64", "long": "float64"},
+        chunksize=chunk_size,
+    )
+    for chunk in reader:
+        keep = chunk["pcd"].str.upper().str.match(PREFIX_PATTERN, na=False)
+        if keep.any():
+            yield chunk[keep]
 
-    # Keep only useful columns
-    filtered_pc = filtered_pc[["pcd", "lat", "long", "msoa11"]]
 
-    # ---------------------------------------------------
-    # Prepare income dataframe
-    # ---------------------------------------------------
-    income_df.rename(
-        columns={
-            income_df.columns[0]: "msoa11",  # MSOA code
-            income_df.columns[1]: "msoa_name",
-            income_df.columns[2]: "la_code",
-            income_df.columns[3]: "la_name",
-            income_df.columns[6]: "total_income",
-        },
-        inplace=True,
-    )
+def build_area_income(
+    output_path: Path = OUTPUT_FILE,
+    postcode_path: Path = POSTCODE_REF_FILE,
+    income_path: Path = INCOME_FILE,
+) -> pd.DataFrame:
+    income_df = load_income(income_path)
+    chunks = list(iter_filtered_postcodes(postcode_path))
+    if not chunks:
+        raise ValueError(f"No postcodes in {postcode_path} start with any of the prefixes {', '.join(ALLOWED_PREFIXES)}")
+    filtered_pc = pd.concat(chunks, ignore_index=True)
 
     # ---------------------------------------------------
     # Merge postcode-level location data with MSOA income
     # ---------------------------------------------------
-    merged = filtered_pc.merge(income_df, on="msoa11", how="left")
+    # Both sides share one categorical vocabulary, so the join is an integer take.
+    msoa_type = pd.CategoricalDtype(income_df["msoa11"])
+    merged = filtered_pc.reset_index(drop=True)
+    merged["msoa11"] = merged["msoa11"].str.strip().astype(msoa_type)
+    codes = merged["msoa11"].cat.codes.to_numpy()
+    for col in ["msoa_name", "la_code", "la_name", "total_income"]:
+        merged[col] = pd.Series(income_df[col].to_numpy()[codes]).where(codes >= 0)
 
-    # ---------------------------------------------------
-    # Save final CSV
-    # ---------------------------------------------------
-    output_path = DATA_DIR / "Postcode_Income_Filtered.csv"
-    merged.to_csv(output_path, index=False)
+    merged.to_parquet(output_path, index=False)
+    return merged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build postcode-level income data for data_pipeline.")
+    parser.add_argument("--output", type=Path, default=OUTPUT_FILE, help="Parquet file to write.")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        merged = build_area_income(args.output)
+    except Exception as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(1)
+    elapsed = time.perf_counter() - started
+    peak_mb = tracemalloc.get_traced_memory()[1] / 1024**2
+    tracemalloc.stop()
 
-    print(f"\nCreated: {output_path}")
+    print(f"\nCreated: {args.output}")
+    # Runtime includes tracemalloc's overhead, which can slow the build noticeably.
+    print(f"Rows: {len(merged):,} | runtime (under tracemalloc): {elapsed:.1f}s | peak memory: {peak_mb:,.0f} MB")
     print(merged.head())
@@ -1,26 +1,7 @@
 import streamlit as st
-import streamlit.components.v1 as components
-import pandas as pd
-import numpy as np
-import pydeck as pdk
-from pathlib import Path
 
-from data_pipeline import load_processed_data
-
-# Keep imports lean; heavy GIS libs slow Streamlit boot time.
-
-
-def _metric_to_color(value, min_value, max_value):
-    if pd.isna(value):
-        return [180, 180, 180, 60]
-    if max_value == min_value:
-        ratio = 0.5
-    else:
-        ratio = (value - min_value) / (max_value - min_value)
-        ratio = max(0.0, min(1.0, float(ratio)))
-    red = int(255 * ratio)
-    blue = int(255 * (1 - ratio))
-    return [red, 80, blue, 160]
+# Only streamlit is imported before login: the data stack (pandas, pyarrow,
+# pydeck, altair) and every dataset wait until someone has signed in.
 
 
 # ----------------------------
@@ -30,134 +11,140 @@ st.set_page_config(page_title="Postcode Coverage Map", layout="wide")
 st.title("ellenor Data Map Explorer")
 st.subheader("Long Loading Time are expected on First Load due to large data processing")
 
-OVERLAY_HTML_FILE = Path(__file__).with_name("uk_income_map_mapbox_2.html")
-
-CATCHMENT_EAST = ["DA3", "DA11", "DA12", "DA13", "TN15"]
-
-CATCHMENT_WEST = ["DA1", "DA2", "DA4", "DA5", "DA6", "DA7", "DA8", "DA9", "DA10", "DA14", "DA15", "DA16", "DA17", "DA18", "BR8"]
-
-CATCHMENT_ALL = CATCHMENT_EAST + CATCHMENT_WEST
-CATCHMENT_PREFIXES = tuple(p.upper().replace(" ", "") for p in CATCHMENT_ALL)
-
-# ----------------------------------------------------
-# 🎨 FIXED COLOUR MAP FOR DONATION SOURCES
-# ----------------------------------------------------
-DONATION_SOURCE_LABELS = {
-    "LSPSWP": "Lottery Play money",
-    "LSPRDD": "Lottery Play money",
-    "REGSOL": "Regular Giving (campaign solicited)",
-    "REGOLD": "Regular Giving (legacy agreement)",
-    "IMOGEN": "In Memory (general donation)",
-    "LSPLDD": "Lottery Play money",
-    "LSPBBP": "Lottery Play money",
-    "IMOMTR": "Memory Tree",
-    "LOTDON": "Lottery donation",
-    "GDRTKT": "Grand Prize Draw ticket sales",
-    "LOLSOL": "Lights of Love campaign",
-    "CFADON": "Community fundraising donations",
-    "TWIREG": "Twilight registration fee",
-    "APLSOL": "Appeal donations",
-    "TWISPO": "Twilight sponsorship money",
-    "APLXMS": "Christmas Appeal donations",
-}
-
-DONATION_SOURCE_COLORS = {
-    "LSPSWP": [255, 165, 0, 220],  # Lottery Play money
-    "LSPRDD": [255, 140, 0, 220],  # Lottery play (variation)
-    "REGSOL": [0, 128, 255, 220],  # Regular Giving (solicited)
-    "REGOLD": [0, 102, 204, 220],  # Regular Giving (old)
-    "IMOGEN": [255, 105, 180, 220],  # In Memory General
-    "LSPLDD": [255, 165, 0, 220],  # Lottery play money
-    "LSPBBP": [255, 165, 0, 220],  # Lottery play money
-    "IMOMTR": [219, 112, 147, 220],  # Memory Tree
-    "LOTDON": [255, 165, 0, 220],  # Lottery donation
-    "GDRTKT": [50, 205, 50, 220],  # Prize Draw Tickets
-    "LOLSOL": [255, 215, 0, 220],  # Lights of Love
-    "CFADON": [30, 144, 255, 220],  # Community fundraising
-    "TWIREG": [138, 43, 226, 220],  # Twilight registration
-    "APLSOL": [0, 191, 255, 220],  # Appeal donations
-    "TWISPO": [148, 0, 211, 220],  # Twilight sponsorship
-    "APLXMS": [0, 255, 255, 220],  # Christmas Appeal
-}
-
-DEFAULT_SOURCE_COLOR = [200, 200, 200, 220]  # grey fallback
 
+# ----------------------------
+# Login
+# ----------------------------
+def login():
+    st.title("🔐 Login")
+    username = st.text_input("Username")
+    password = st.text_input("Password", type="password")
+    if st.button("Login"):
+        if username in st.secrets["users"] and st.secrets["users"][username] == password:
+            st.session_state["logged_in"] = True
+            st.rerun()
+        else:
+            st.error("Invalid username or password")
 
-def _unique_join(values):
-    cleaned = sorted({str(v).strip() for v in values if pd.notna(v) and str(v).strip()})
-    return ", ".join(cleaned) if cleaned else "Unknown"
 
+if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
+    login()
+    st.stop()
 
-def _collect_sources(values):
-    flattened = []
-    for item in values:
-        if isinstance(item, (list, tuple)):
-            flattened.extend(item)
-        elif isinstance(item, np.ndarray):
-            flattened.extend(item.tolist())
-        else:
-            if pd.notna(item) and str(item).strip():
-                flattened.append(str(item).strip())
-    return sorted({code for code in flattened if code})
+import tempfile  # noqa: E402
+from pathlib import Path  # noqa: E402
+
+import altair as alt  # noqa: E402
+import pandas as pd  # noqa: E402
+import streamlit.components.v1 as components  # noqa: E402
+
+from backend_client import BackendClient, Selection  # noqa: E402
+from catchment import CATCHMENTS  # noqa: E402
+from cohort import ALL_SOURCES, lifecycle_status, month_index, retention_matrix, update_cohorts  # noqa: E402
+from data_pipeline import (  # noqa: E402
+    cache_version,
+    ensure_overlay_data,
+    load_cohorts,
+    load_donation_tensor,
+    load_event_index,
+    load_kpi_rollups,
+    load_patient_areas,
+    load_postcode_msoa,
+    load_processed_data,
+    load_ui_manifest,
+    rebuild_status,
+    start_background_rebuild,
+)
+from event_index import DRILLDOWN_LABELS, EventIndex  # noqa: E402
+from export import EXPORT_FORMATS, export_key, write_export  # noqa: E402
+from filters import REGION_GROUPS, FilterSpec, apply_filters  # noqa: E402
+from hexgrid import HEX_RESOLUTIONS, aggregate_hex  # noqa: E402
+from instrumentation import Profiler  # noqa: E402
+from kpi import ROLLUP_DRILLDOWNS, build_rollups, filter_rollups, summarise  # noqa: E402
+from map_compute import area_metric_median, build_map_spec, deck_from_spec, donor_points_for_map  # noqa: E402
+from overlay import overlay_html, overlay_url  # noqa: E402
+from patient_areas import ROUND_TO, SUPPRESS_BELOW, patient_cells  # noqa: E402
+from penetration import PENETRATION_METRICS, build_penetration  # noqa: E402
+from shop_catchment import add_nearest_shop_columns, shop_rollups, with_hypothetical_shop  # noqa: E402
+from site_selection import build_demand, candidate_sites, select_sites  # noqa: E402
+from timeseries import TENSOR_METRICS, DonationTensor, rolling_sum, seasonal_decomposition, yoy_change  # noqa: E402
+
+# With ELLENOR_BACKEND_URL set (see compute_backend.py), summaries, map layers,
+# trends and shop rollups come from the shared worker pool, and this session
+# only loads the datasets for exports, shop what-ifs, the site finder and cohorts.
+backend = BackendClient.from_env()
+
+# Opt-in via the "Performance panel" checkbox at the bottom of the sidebar.
+profiler = Profiler(enabled=st.session_state.get("perf_panel", False), track_memory=st.session_state.get("perf_memory", False))
 
 
 # ----------------------------
 # Data loading
 # ----------------------------
-@st.cache_data(show_spinner=True)
-def load_data():
+# Every loader is keyed by the cache version, so once a background rebuild
+# switches versions each session picks the new files up on its next rerun.
+data_version = cache_version()
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_manifest(version: str) -> dict:
+    return load_ui_manifest()
+
+
+@st.cache_data(show_spinner=True, max_entries=2)
+def load_data(version: str):
     """Load pre-processed Parquet files (fallback to CSV processing if needed)."""
     return load_processed_data()
 
 
-@st.cache_data(show_spinner=False)
-def load_overlay_html(path: Path) -> str:
-    if not path.exists():
-        return ""
-    return path.read_text(encoding="utf-8")
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_rollups(version: str):
+    return load_kpi_rollups()
 
 
-patients, donors_unique, donor_events, shops, area_income = load_data()
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_cohort_state(version: str):
+    return load_cohorts()
 
-all_months = sorted(donor_events["month"].unique())
 
-# ----------------------------
-# Region mapping
-# ----------------------------
-REGION_GROUPS = {
-    "London": ["EC", "WC", "E", "N", "NW", "SE", "SW", "W"],
-    "South East": ["BN", "BR", "CR", "CT", "DA", "GU", "HP", "KT", "ME", "OX", "PO", "RG", "RH", "SL", "SM", "SO", "TN", "TW"],
-    "South West": ["BA", "BH", "BS", "EX", "GL", "PL", "SN", "SP", "TA", "TQ", "TR"],
-    "East of England": ["AL", "CB", "CM", "CO", "EN", "IP", "LU", "NR", "PE", "SG"],
-    "West Midlands": ["B", "CV", "DY", "HR", "ST", "SY", "TF", "WR", "WS", "WV"],
-    "East Midlands": ["DE", "DN", "LE", "LN", "NG", "NN", "SK", "S"],
-    "North West": ["BB", "BL", "CA", "CH", "CW", "FY", "LA", "L", "M", "OL", "PR", "SK", "WA", "WN"],
-    "Yorkshire & Humber": ["BD", "DN", "HD", "HG", "HU", "HX", "LS", "S", "WF", "YO"],
-    "North East": ["DH", "DL", "NE", "SR", "TS"],
-    "Wales": ["CF", "LD", "LL", "NP", "SA", "SY"],
-    "Scotland": ["AB", "DD", "DG", "EH", "FK", "G", "HS", "IV", "KA", "KW", "KY", "ML", "PA", "PH", "TD", "ZE"],
-    "Northern Ireland": ["BT"],
-}
+# A resource, not data: the arrays are only ever sliced, so sessions can share one copy.
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_tensor(version: str) -> DonationTensor:
+    return load_donation_tensor()
 
 
-# ----------------------------
-# Login
-# ----------------------------
-def login():
-    st.title("🔐 Login")
-    username = st.text_input("Username")
-    password = st.text_input("Password", type="password")
-    if st.button("Login"):
-        if username in st.secrets["users"] and st.secrets["users"][username] == password:
-            st.session_state["logged_in"] = True
-            st.rerun()
-        else:
-            st.error("Invalid username or password")
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_index(version: str) -> EventIndex:
+    return load_event_index()
 
 
-if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
-    login()
-    st.stop()
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_patient_area_table(version: str):
+    return load_patient_areas()
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_postcode_lookup(version: str):
+    return load_postcode_msoa()
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def postcode_locations(version: str):
+    """Coordinates of every postcode we have, keyed by space-free upper-case postcode."""
+    patients, _, donor_events, shops, _ = load_data(version)
+    frames = [df[["postcode_clean", "latitude", "longitude"]] for df in (patients, donor_events, shops)]
+    return pd.concat(frames).dropna().drop_duplicates(subset=["postcode_clean"]).set_index("postcode_clean")
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def overlay_page(version: str) -> str:
+    """HTML shell for the overlay; the data itself is a static file the browser fetches (and caches)."""
+    return overlay_html(overlay_url(ensure_overlay_data()))
+
+
+# The sidebar is drawn from the manifest; the datasets are loaded below it.
+manifest = load_manifest(data_version)
+all_months = manifest["months"]
 
 if "map_style" not in st.session_state:
     st.session_state["map_style"] = "mapbox://styles/mapbox/light-v11"
@@ -176,6 +163,17 @@ show_patients = st.sidebar.checkbox("Show Patients", value=True)
 show_donors = st.sidebar.checkbox("Show Donors", value=True)
 show_shops = st.sidebar.checkbox("Show Shops", value=True)
 
+# Aggregated by default: exact patient postcodes should not leave the server when the app is shared.
+patient_level_names = {"sector": "Postcode sectors", "msoa": "MSOAs"}
+patient_options = {
+    **{patient_level_names[level]: level for level in patient_level_names if level in manifest["patient_levels"]},
+    "Exact postcodes (internal use only)": None,
+}
+patient_level = patient_options[st.sidebar.selectbox("Draw patients as:", list(patient_options), disabled=not show_patients)]
+
+hex_options = {"Postcode points": None, **{f"Hexagons ({size / 1000:g} km)": res for res, size in HEX_RESOLUTIONS.items()}}
+hex_resolution = hex_options[st.sidebar.selectbox("Draw donors as:", list(hex_options), disabled=not show_donors)]
+
 
 st.sidebar.subheader("📅 Date Range")
 
@@ -183,14 +181,38 @@ start_month, end_month = st.sidebar.select_slider("Select month range:", options
 
 st.sidebar.subheader("📍 Catchment Filter")
 use_catchment = st.sidebar.checkbox("Show ONLY ellenor catchment area", value=False)
+selected_catchments = list(CATCHMENTS)
+if use_catchment:
+    selected_catchments = st.sidebar.multiselect("Catchment:", list(CATCHMENTS), default=list(CATCHMENTS))
 
 st.sidebar.subheader("📊 Differentiate Donor Sources")
 Differentiate_Donor_Sources = st.sidebar.checkbox("Differentiate Donor Sources on Map", value=False)
 
+st.sidebar.subheader("📈 Patient / Donor Penetration")
+penetration_options = {"Off": None, **{label: metric for metric, (label, _) in PENETRATION_METRICS.items()}}
+penetration_metric = penetration_options[st.sidebar.selectbox("Colour areas by:", list(penetration_options))]
+# MSOAs need the postcode-level income data; districts only need postcodes.
+penetration_level = "district"
+if penetration_metric and manifest["area_income"]:
+    penetration_level = st.sidebar.radio("Area level:", ["district", "msoa"], format_func=lambda v: "Postcode district" if v == "district" else "MSOA", horizontal=True)
+
+st.sidebar.subheader("🏪 Shop Catchments")
+colour_by_shop = st.sidebar.checkbox("Colour points by nearest shop", value=False)
+shop_radius_km = st.sidebar.number_input("Only count within (km, 0 = no limit)", min_value=0.0, value=0.0, step=1.0)
+show_shop_rollups = st.sidebar.checkbox("Show shop catchment rollups", value=False)
+new_shop_postcode = st.sidebar.text_input("Try a new shop at postcode:", help="Reassigns patients and donors as if a shop opened here.")
+# Filled once the datasets are loaded, if the postcode is unknown.
+new_shop_warning = st.sidebar.empty()
+
+st.sidebar.subheader("🔁 Donor Retention")
+colour_by_lifecycle = st.sidebar.checkbox("Colour donors as new / active / lapsed", value=False)
+show_cohorts = st.sidebar.checkbox("Show cohort retention heatmap", value=False)
+show_trends = st.sidebar.checkbox("Show donation trends", value=False)
+
 # Donation range
 st.sidebar.subheader("💷 Donation Amount Filter")
-if not donor_events.empty:
-    min_d, max_d = float(donor_events["Donation Amount"].min()), float(donor_events["Donation Amount"].max())
+if manifest["donation_range"]:
+    min_d, max_d = manifest["donation_range"]
     min_input = st.sidebar.number_input("Min (£)", min_value=min_d, max_value=max_d, value=min_d)
     max_input = st.sidebar.number_input("Max (£)", min_value=min_input, max_value=max_d, value=max_d)
     donation_filter = (min_input, max_input)
@@ -214,105 +236,157 @@ selected_style = st.sidebar.selectbox("Choose map style:", options=list(map_styl
 map_style_url = map_styles[selected_style]
 
 # Country
-income_countries = set(area_income["country"].dropna()) if (not area_income.empty and "country" in area_income.columns) else {"England"}
-country_all = sorted(set(patients["country"].dropna()) | set(donors_unique["country"].dropna()) | set(donor_events["country"].dropna()) | income_countries)
+country_all = manifest["countries"]
 country_filter = st.sidebar.multiselect("Country:", country_all, default=country_all)
 
 # Region → postcode areas
 region_filter = st.sidebar.multiselect("UK Region:", list(REGION_GROUPS.keys()), default=list(REGION_GROUPS.keys()))
-allowed_postcode_areas = [x for r in region_filter for x in REGION_GROUPS[r]]
 
-area_layer_available = not area_income.empty
+st.sidebar.subheader("🎯 Donor Drill-down")
+# Left empty, a drill-down keeps every donor; a postcode-month is kept if any of its gifts matches.
+donor_filters = {}
+for dimension, values in manifest.get("donor_filters", {}).items():
+    if len(values) > 1:
+        chosen = st.sidebar.multiselect(f"{DRILLDOWN_LABELS[dimension]}:", values, placeholder="All")
+        if chosen:
+            donor_filters[dimension] = chosen
+
+area_layer_available = manifest["area_income"]
 show_area_layer = False
 area_metric = None
 area_metric_label = ""
 area_metric_unit = ""
 
 
-# Allow manual rebuild when CSVs change
-if st.sidebar.button("♻️ Rebuild data cache"):
-    load_data.clear()
-    load_processed_data(force_rebuild=True)
-    st.sidebar.success("Cache rebuilt — reloading app.")
-    st.rerun()
-
-
-def apply_filters(df):
-    base = df[(df["country"].isin(country_filter)) & (df["postcode_area"].isin(allowed_postcode_areas))].copy()
-
-    # Apply catchment toggle using precomputed clean prefixes
-    if use_catchment and "postcode_clean" in base.columns:
-        base = base[base["postcode_clean"].str.startswith(CATCHMENT_PREFIXES)].copy()
-
-    # Donation filter
-    if "Donation Amount" in base.columns:
-        base = base[(base["Donation Amount"] >= donation_filter[0]) & (base["Donation Amount"] <= donation_filter[1])].copy()
-
-    # 📌 NEW: Month range filter
-    if "month" in base.columns:
-        base = base[(base["month"] >= start_month) & (base["month"] <= end_month)].copy()
-
-    return base
-
-
-pf = apply_filters(patients)
-de = apply_filters(donor_events)
-shops = apply_filters(shops)
-area_filtered = apply_filters(area_income)
-
-
-# ---- Aggregation for tooltip ----
-# Group donor events by postcode for the filtered time period
-def _format_source_names(codes):
-    readable = [DONATION_SOURCE_LABELS.get(code, code) for code in codes if pd.notna(code) and str(code).strip()]
-    return ", ".join(readable) if readable else "Unknown"
-
-
-def aggregate_donors_for_map(df: pd.DataFrame) -> pd.DataFrame:
-    """Collapse multiple donation events down to one row per postcode."""
-    if df.empty:
-        return df
-
-    working = df.sort_values("month_dt").copy()
-
-    latest = (
-        working.groupby("postcode", as_index=False)
-        .last()[["postcode", "month", "Donation Amount"]]
-        .rename(
-            columns={
-                "month": "latest_month",
-                "Donation Amount": "latest_donation",
-            }
-        )
-    )
-
-    def _unique_join(values):
-        cleaned = sorted({str(v) for v in values if pd.notna(v) and str(v).strip()})
-        return ", ".join(cleaned) if cleaned else "Unknown"
-
-    grouped = working.groupby("postcode", as_index=False).agg(
-        latitude=("latitude", "first"),
-        longitude=("longitude", "first"),
-        country=("country", "first"),
-        postcode_area=("postcode_area", "first"),
-        donor_type=("donor_type", "last"),
-        source_list=("source_list", _collect_sources),
-        total_donation=("Donation Amount", "sum"),
-        max_donation=("max_single_donation", "max"),
-        total_events=("events_in_month", "sum"),
-    )
-
-    grouped = grouped.merge(latest, on="postcode", how="left")
-    grouped["latest_month"] = grouped["latest_month"].fillna("Unknown")
-    grouped["latest_donation"] = grouped["latest_donation"].fillna(0.0)
-
-    grouped["sources_display"] = grouped["source_list"].apply(_format_source_names)
-    grouped["primary_source"] = grouped["source_list"].apply(lambda vals: vals[0] if len(vals) == 1 else ("Multiple" if vals else "Unknown"))
+# Allow manual rebuild when CSVs change. The build runs in a separate process;
+# while it does, this panel polls its progress without rerunning the whole app.
+def rebuild_panel(polling: bool):
+    status = rebuild_status() or {}
+    running = status.get("state") == "running"
+    if polling and not running:
+        # Finished or failed: a full rerun stops polling and loads the new version.
+        st.rerun()
+    if running:
+        st.progress(float(status.get("fraction", 0.0)), text=f"Rebuilding data cache: {status.get('step', '')}")
+    elif status.get("state") == "failed":
+        st.error(f"Cache rebuild failed: {status.get('error', 'unknown error')}")
+    if st.button("♻️ Rebuild data cache", disabled=running):
+        start_background_rebuild()
+        st.rerun()
+
+
+with st.sidebar:
+    polling = (rebuild_status() or {}).get("state") == "running"
+    st.fragment(run_every=2 if polling else None)(rebuild_panel)(polling)
+
+
+new_shop = None
+if new_shop_postcode.strip():
+    new_shop_key = new_shop_postcode.upper().replace(" ", "")
+    locations = postcode_locations(data_version)
+    if new_shop_key in locations.index:
+        location = locations.loc[new_shop_key]
+        new_shop = (f"New shop ({new_shop_postcode.upper().strip()})", float(location["latitude"]), float(location["longitude"]), new_shop_postcode.upper().strip())
+    else:
+        new_shop_warning.warning("Postcode not found in the patient, donor or shop data.")
+what_if_shop = new_shop is not None
+
+filter_spec = FilterSpec.from_regions(
+    country_filter,
+    region_filter,
+    start_month,
+    end_month,
+    donation_filter,
+    catchments=selected_catchments if use_catchment else None,
+    donor_filters=donor_filters,
+)
+selection = Selection(
+    country_filter,
+    region_filter,
+    start_month,
+    end_month,
+    donation_filter,
+    catchments=selected_catchments if use_catchment else None,
+    donor_filters=donor_filters,
+)
+# Amount bounds and drill-downs drop individual postcode-months, so tables
+# precomputed over every event no longer apply as they are.
+amount_restricted = bool(manifest["donation_range"]) and donation_filter != (min_d, max_d)
+events_restricted = amount_restricted or bool(filter_spec.donor_filters)
+
+# The datasets as filtered in this session: every panel uses them without a
+# backend, and with one only the panels it has no endpoint for load them.
+local = {}
+
+
+def local_data() -> dict:
+    """Filtered patients (pf), donor events (de), shops and area income (area_filtered), plus all_shops; loaded on first use."""
+    if local:
+        return local
+    with profiler.span("load_data") as span:
+        patients, _, donor_events, shops, area_income = load_data(data_version)
+        span.rows = len(donor_events)
+    all_shops = with_hypothetical_shop(shops, *new_shop) if what_if_shop else shops
+
+    with profiler.span("apply_filters[patients]") as span:
+        pf = apply_filters(patients, filter_spec)
+        span.rows = len(pf)
+    with profiler.span("apply_filters[donor_events]") as span:
+        de = apply_filters(donor_events, filter_spec, load_index(data_version) if filter_spec.donor_filters else None)
+        span.rows = len(de)
+    with profiler.span("apply_filters[shops]") as span:
+        shops = apply_filters(shops, filter_spec)
+        span.rows = len(shops)
+    with profiler.span("apply_filters[area_income]") as span:
+        area_filtered = apply_filters(area_income, filter_spec)
+        span.rows = len(area_filtered)
+
+    if what_if_shop:
+        # Nearest shops were precomputed for the real shops only; redo them with the new one.
+        with profiler.span("assign nearest shop (what-if)") as span:
+            pf = add_nearest_shop_columns(pf, all_shops)
+            de = add_nearest_shop_columns(de, all_shops)
+            shops = pd.concat([shops, all_shops[all_shops["hypothetical"]]], ignore_index=True)
+            span.rows = len(pf) + len(de)
+
+    local.update(pf=pf, de=de, shops=shops, area_filtered=area_filtered, all_shops=all_shops, event_rows=len(donor_events))
+    return local
+
+
+# Frames the map layers are drawn from. The backend only knows the real shops,
+# so what-if reassignments stay local.
+if backend and not what_if_shop:
+    pf = backend.patients(selection) if show_patients and patient_level is None else pd.DataFrame()
+    shops = backend.shops(selection) if show_shops else pd.DataFrame()
+    area_filtered = pd.DataFrame()
+else:
+    pf, shops, area_filtered = (local_data()[key] for key in ("pf", "shops", "area_filtered"))
 
-    grouped["Source"] = grouped["primary_source"]
-    grouped["Donation Amount"] = grouped["total_donation"]
 
-    return grouped.drop(columns=["source_list"])
+penetration_table = None
+if penetration_metric:
+    with profiler.span("build_penetration") as span:
+        if backend:
+            penetration_table = backend.penetration(selection, penetration_level)
+        else:
+            penetration_table = build_penetration(pf, local_data()["de"], area_filtered, load_postcode_lookup(data_version), penetration_level)
+        span.rows = len(penetration_table)
+
+cohort_state = None
+lifecycle = None
+if colour_by_lifecycle or show_cohorts:
+    # A postcode's lifecycle only depends on which of its months survive the
+    # filters, so without a month or amount restriction the incrementally
+    # maintained cache answers it; cohort matrices also need the same postcodes.
+    all_history = (start_month, end_month) == (all_months[0], all_months[-1]) and not events_restricted
+    with profiler.span("build_cohorts") as span:
+        if all_history and (not show_cohorts or len(local_data()["de"]) == local["event_rows"]):
+            cohort_state = load_cohort_state(data_version)
+        else:
+            cohort_state = update_cohorts(None, local_data()["de"])
+        span.rows = len(cohort_state[0])
+    if colour_by_lifecycle:
+        lifecycle = lifecycle_status(cohort_state[0], as_of=int(month_index(pd.Series([end_month]))[0]))
 
 
 # ----------------------------
@@ -322,236 +396,287 @@ st.sidebar.subheader("🎞 Donor display mode")
 show_timeline = not st.sidebar.checkbox("Show all donors at once (hide timeline)", value=True)
 
 # ----------------------------
-# Metrics
+# Site finder (what-if)
 # ----------------------------
-st.markdown("### 📊 Donation Summary")
-st.metric("Total Donations", f"£{de['Donation Amount'].sum():,.2f}")
-
-if show_area_layer and area_metric and not area_filtered.empty and area_metric in area_filtered.columns:
-    metric_vals = pd.to_numeric(area_filtered[area_metric], errors="coerce").dropna()
-    if not metric_vals.empty:
-        if area_metric_unit == "£":
-            formatted = f"£{metric_vals.median():,.0f}"
-        elif area_metric_unit == "%":
-            formatted = f"{metric_vals.median():.1f}%"
-        else:
-            formatted = f"{metric_vals.median():,.0f}"
-        st.metric(f"{area_metric_label} (median in filters)", formatted)
-
-
-def create_pydeck_map(
-    df_pat,
-    df_don,
-    df_shop,
-    df_area,
-    timeline_month=None,
-    show_patients=True,
-    show_donors=True,
-    show_shops=True,
-    show_area_layer=False,
-    area_metric=None,
-    area_metric_label="",
-    area_metric_unit="",
-    map_style="mapbox://styles/mapbox/satellite-v9",
-    differentiate_donor_sources=False,
-):
-
-    # Timeline filtering
-    if timeline_month is not None:
-        df_don = df_don[df_don["month"] == timeline_month].copy()
-
-    # Work on copies so we don't mutate original dataframes
-    df_pat = df_pat.copy()
-    df_don = df_don.copy()
-    df_shop = df_shop.copy()
-    df_area = df_area.copy()
-
-    if show_donors and not df_don.empty:
-        df_don = aggregate_donors_for_map(df_don)
-
-    # Patients
-    if show_patients and not df_pat.empty:
-        df_pat["kind"] = "Patient"
-        df_pat["extra"] = ""  # nothing more to show (you can add more if you like)
-
-    # Donors
-    if show_donors and not df_don.empty:
-        df_don["kind"] = "Donor"
-        df_don["extra"] = (
-            "Donor Type: "
-            + df_don["donor_type"].astype(str)
-            + "<br/>Sources: "
-            + df_don["sources_display"].astype(str)
-            + "<br/>Total Donation Amount: £"
-            + df_don["total_donation"].round(2).astype(str)
-            + "<br/>Max Single Donation: £"
-            + df_don["max_donation"].round(2).astype(str)
-            + "<br/>Number of Donations: "
-            + df_don["total_events"].astype(int).astype(str)
-            + "<br/>Latest Month: "
-            + df_don["latest_month"].astype(str)
-            + "<br/>Latest Donation: £"
-            + df_don["latest_donation"].round(2).astype(str)
+st.sidebar.subheader("🧭 New Shop Site Finder")
+with st.sidebar.form("site_finder"):
+    site_radius_km = st.slider("Catchment radius (km)", min_value=1.0, max_value=15.0, value=5.0, step=0.5)
+    site_count = st.number_input("Sites to propose", min_value=1, max_value=20, value=5)
+    site_weights = {
+        "donor_value": st.slider("Weight: donor value", 0.0, 1.0, 1.0, 0.1),
+        "patients": st.slider("Weight: patients", 0.0, 1.0, 1.0, 0.1),
+        "income": st.slider("Weight: area income", 0.0, 1.0, 0.0, 0.1, disabled=not manifest["area_income"]),
+    }
+    find_sites = st.form_submit_button("Find sites")
+
+# Results are kept until the filters change; candidates come from the filtered MSOAs (or postcodes).
+site_key = (filter_spec, new_shop_postcode.strip().upper(), site_radius_km)
+if find_sites:
+    with profiler.span("select_sites") as span, st.spinner("Scoring candidate sites..."):
+        data = local_data()
+        candidates = candidate_sites(data["area_filtered"], data["de"], data["pf"])
+        proposed = select_sites(
+            candidates, build_demand(data["de"], data["pf"], data["area_filtered"]), data["all_shops"], site_radius_km, int(site_count), site_weights
         )
+        span.rows = len(candidates)
+    st.session_state["proposed_sites"] = {"key": site_key, "sites": proposed, "candidates": len(candidates)}
+site_result = st.session_state.get("proposed_sites")
+if site_result and site_result["key"] != site_key:
+    site_result = st.session_state["proposed_sites"] = None
+proposed_sites = site_result["sites"] if site_result else None
 
-    if differentiate_donor_sources:
-        # map sources to colours
-        df_don["color"] = df_don["Source"].map(DONATION_SOURCE_COLORS)
-
-        # fallback for unknown or missing sources
-        df_don["color"] = df_don["color"].apply(lambda x: x if isinstance(x, list) else DEFAULT_SOURCE_COLOR)
+# ----------------------------
+# Metrics
+# ----------------------------
+st.markdown("### 📊 Donation Summary")
+if backend:
+    summary = backend.summary(selection)
+else:
+    if not amount_restricted and all(dimension in ROLLUP_DRILLDOWNS for dimension, _ in filter_spec.donor_filters):
+        # Nothing the rollup grain cannot express, so the precomputed rollups answer every KPI.
+        summary_rows = filter_rollups(load_rollups(data_version), filter_spec)
     else:
-        # simple default colour (blue)
-        df_don["color"] = [[0, 128, 255, 200]] * len(df_don)
-
-    # Shops
-    if show_shops and not df_shop.empty:
-        df_shop["kind"] = "Shop"
-        df_shop["extra"] = "Name: " + df_shop["name"].astype(str)
-
-    if show_area_layer and area_metric and not df_area.empty and area_metric in df_area.columns:
-        df_area = df_area[df_area["latitude"].notna() & df_area["longitude"].notna()].copy()
-        if not df_area.empty:
-            df_area["metric_value"] = pd.to_numeric(df_area[area_metric], errors="coerce")
-            if df_area["metric_value"].notna().sum() == 0:
-                show_area_layer = False
-            else:
-                min_val = float(df_area["metric_value"].min())
-                max_val = float(df_area["metric_value"].max())
-                df_area["color"] = df_area["metric_value"].apply(lambda v: _metric_to_color(v, min_val, max_val))
-                metric_prefix = area_metric_label or area_metric
-                unit_prefix = area_metric_unit if area_metric_unit and area_metric_unit not in ("people", "count") else ""
-                df_area["kind"] = "Area demographics"
-                df_area["extra"] = metric_prefix + ": " + (unit_prefix if unit_prefix and unit_prefix != "%" else "") + df_area["metric_value"].round(2).astype(str)
-                if unit_prefix == "%":
-                    df_area["extra"] = metric_prefix + ": " + df_area["metric_value"].round(2).astype(str) + "%"
-                df_area["extra"] = df_area["extra"] + "<br/>Area: " + df_area.get("area_label", df_area.get("postcode_area", "Unknown")).astype(str)
-
-    # Combine coords to find centre (only include visible layers)
-    coord_frames = []
-    if show_patients and not df_pat.empty:
-        coord_frames.append(df_pat[["latitude", "longitude"]])
-    if show_donors and not df_don.empty:
-        coord_frames.append(df_don[["latitude", "longitude"]])
-    if show_shops and not df_shop.empty:
-        coord_frames.append(df_shop[["latitude", "longitude"]])
-    if show_area_layer and not df_area.empty and area_metric:
-        coord_frames.append(df_area[["latitude", "longitude"]])
-
-    if not coord_frames:
-        return None
-
-    combined = pd.concat(coord_frames).dropna()
-    if combined.empty:
-        return None
-
-    center = [combined["latitude"].mean(), combined["longitude"].mean()]
-
-    layers = []
-
-    # Patients
-    if show_patients and not df_pat.empty:
-        layers.append(pdk.Layer("ScatterplotLayer", data=df_pat, get_position="[longitude, latitude]", get_radius=80, get_fill_color=[255, 0, 0, 180], pickable=True))
-
-    # Donors
-    if show_donors and not df_don.empty:
-        layers.append(pdk.Layer("ScatterplotLayer", data=df_don, get_position="[longitude, latitude]", get_radius=80, get_fill_color="color", pickable=True))
-
-    # Shops
-    if show_shops and not df_shop.empty:
-        layers.append(pdk.Layer("ScatterplotLayer", data=df_shop, get_position="[longitude, latitude]", get_radius=100, get_fill_color=[0, 255, 0, 180], pickable=True))
-
-    if show_area_layer and not df_area.empty and area_metric:
-        layers.append(
-            pdk.Layer(
-                "ScatterplotLayer",
-                data=df_area,
-                get_position="[longitude, latitude]",
-                get_radius=200,
-                get_fill_color="color",
-                pickable=True,
-                opacity=0.5,
-            )
-        )
+        summary_rows = build_rollups(local_data()["de"])
+    summary = summarise(summary_rows)
+
+col_total, col_count, col_avg, col_active, col_latest = st.columns(5)
+col_total.metric("Total Donations", f"£{summary['total_donations']:,.2f}")
+col_count.metric("Number of Donations", f"{summary['donation_count']:,}")
+col_avg.metric("Average Gift", f"£{summary['average_gift']:,.2f}")
+latest_label = summary["latest_month"] or "n/a"
+col_active.metric(f"Donor Postcodes ({latest_label})", f"{summary['active_donors']:,}")
+col_latest.metric(
+    f"Donations ({latest_label})",
+    f"£{summary['latest_total']:,.2f}",
+    delta=f"{summary['mom_change']:+.1f}% vs previous month" if summary["mom_change"] is not None else None,
+)
 
-    # Heatmap (donors)
-    if show_donors and not df_don.empty:
-        layers.append(
-            pdk.Layer(
-                "HeatmapLayer",
-                data=df_don,
-                get_position="[longitude, latitude]",
-                get_weight="Donation Amount",
-                radiusPixels=60,
-            )
+area_median = area_metric_median(area_filtered, area_metric) if show_area_layer and area_metric else None
+if area_median is not None:
+    if area_metric_unit == "£":
+        formatted = f"£{area_median:,.0f}"
+    elif area_metric_unit == "%":
+        formatted = f"{area_median:.1f}%"
+    else:
+        formatted = f"{area_median:,.0f}"
+    st.metric(f"{area_metric_label} (median in filters)", formatted)
+
+if penetration_table is not None and not penetration_table.empty:
+    with st.expander("Areas where we serve patients but raise comparatively little"):
+        st.dataframe(
+            penetration_table.sort_values("penetration_gap", ascending=False).head(20)[
+                ["area", "patient_count", "donor_postcodes", "donation_sum", *PENETRATION_METRICS]
+            ],
+            hide_index=True,
+            width="stretch",
         )
 
-    view_state = pdk.ViewState(
-        latitude=center[0],
-        longitude=center[1],
-        zoom=6,
-        pitch=0,
-    )
 
-    # ---- Global tooltip template (works for all layers) ----
-    tooltip = {"html": "<b>{kind}</b><br/>Postcode: {postcode}<br/>{extra}", "style": {"color": "white", "backgroundColor": "rgba(0, 0, 0, 0.7)"}}
+if show_shop_rollups:
+    with st.expander("🏪 Shop catchment rollups", expanded=True):
+        with profiler.span("shop_rollups") as span:
+            if backend and not what_if_shop:
+                rollups_by_shop = backend.shop_rollups(selection, shop_radius_km)
+            else:
+                data = local_data()
+                rollups_by_shop = shop_rollups(data["pf"], data["de"], data["all_shops"], max_km=shop_radius_km or None)
+            span.rows = len(rollups_by_shop)
+        st.dataframe(rollups_by_shop, hide_index=True, width="stretch")
+
+if show_cohorts and cohort_state is not None:
+    with st.expander("🔁 Donor cohort retention", expanded=True):
+        sources = [ALL_SOURCES, *sorted(set(cohort_state[0]["source"]) - {ALL_SOURCES})]
+        cohort_source = st.selectbox("Source:", sources)
+        matrix = retention_matrix(cohort_state[1], cohort_source, max_offset=24)
+        if matrix.empty:
+            st.info("No donor cohorts for the current filters.")
+        else:
+            st.caption("Share of each first-gift cohort still giving N months later (postcode level).")
+            cells = matrix.drop(columns="cohort_size").reset_index().melt(id_vars="cohort", var_name="months_since_first", value_name="retention")
+            chart = (
+                alt.Chart(cells)
+                .mark_rect()
+                .encode(
+                    x=alt.X("months_since_first:O", title="Months since first gift"),
+                    y=alt.Y("cohort:O", title="First-gift cohort"),
+                    color=alt.Color("retention:Q", scale=alt.Scale(scheme="viridis", domain=[0, 1]), title="Retained"),
+                    tooltip=["cohort", "months_since_first", alt.Tooltip("retention:Q", format=".0%")],
+                )
+            )
+            st.altair_chart(chart, width="stretch")
+            st.dataframe(matrix.rename(columns=str), width="stretch")
+
+if show_trends:
+    with st.expander("📈 Donation trends", expanded=True):
+        trend_cols = st.columns(3)
+        trend_metric = trend_cols[0].selectbox("Metric:", TENSOR_METRICS, format_func=lambda m: m.replace("_", " ").capitalize())
+        trend_by = trend_cols[1].selectbox("Break down by:", ["total", "source", "region"])
+        trend_view = trend_cols[2].selectbox("View:", ["Monthly", "Rolling 12 months", "Year-on-year %", "Seasonal decomposition"])
+        with profiler.span("donation_trends") as span:
+            trend_breakdown = "total" if trend_view == "Seasonal decomposition" else trend_by
+            if backend:
+                trend = backend.trend(selection, trend_metric, trend_breakdown)
+            else:
+                # Amount bounds and drill-downs are per row, so only unrestricted events can use the cached tensor.
+                tensor = DonationTensor.build(local_data()["de"]) if events_restricted else load_tensor(data_version)
+                trend = tensor.series(filter_spec, trend_metric, by=trend_breakdown)
+            if trend_by == "source" and trend_view != "Seasonal decomposition":
+                trend = trend[trend.sum().nlargest(8).index]
+            if trend_view == "Rolling 12 months":
+                trend = rolling_sum(trend)
+            elif trend_view == "Year-on-year %":
+                trend = yoy_change(trend)
+            elif trend_view == "Seasonal decomposition":
+                trend = seasonal_decomposition(trend["total"])
+            span.rows = trend.size
+        if trend.empty:
+            st.info("No donations for the current filters.")
+        elif trend_view == "Seasonal decomposition":
+            st.caption("Additive decomposition: 12-month centred moving-average trend plus the average deviation for each calendar month.")
+            st.line_chart(trend[["observed", "trend"]])
+            st.bar_chart(trend[["seasonal", "residual"]])
+        else:
+            st.line_chart(trend)
 
-    return pdk.Deck(
-        layers=layers,
-        initial_view_state=view_state,
-        map_style=map_style,
-        api_keys={"mapbox": st.secrets["MAPBOX_TOKEN"]["MAPBOX_TOKEN"]},
-        tooltip=tooltip,
-        parameters={"clearColor": [1.0, 1.0, 1.0, 1.0]},
-    )
+if site_result:
+    with st.expander(f"🧭 Proposed new shop sites ({site_result['candidates']:,} candidates scored)", expanded=True):
+        if proposed_sites.empty:
+            st.info("No candidate reaches demand that existing shops do not already cover.")
+        else:
+            st.caption("Score: weighted % of filtered donor value / patients / income newly within the radius, counting each site after the ones above it.")
+            st.dataframe(proposed_sites, hide_index=True, width="stretch")
 
 
 # ----------------------------
 # Timeline UI
 # ----------------------------
 timeline_month = None
-month_options = sorted(de["month"].unique())
 if show_timeline:
+    if backend:
+        month_options = backend.donations_by_month(selection)["month"].tolist()
+    else:
+        month_options = sorted(local_data()["de"]["month"].unique())
     if month_options:
         timeline_month = st.select_slider("Select month", options=month_options, value=month_options[0])
     else:
         st.info("No donor months available for the current filters.")
 
 
-deck_map = create_pydeck_map(
-    pf,
-    de,
-    shops,
-    area_filtered,
-    timeline_month,
-    show_donors=show_donors,
-    show_patients=show_patients,
-    show_shops=show_shops,
-    show_area_layer=show_area_layer,
-    area_metric=area_metric,
-    area_metric_label=area_metric_label,
-    area_metric_unit=area_metric_unit,
-    map_style=map_style_url,
-    differentiate_donor_sources=Differentiate_Donor_Sources,
-)
+hex_cells = None
+with profiler.span("aggregate_donors_for_map") as span:
+    if show_donors and hex_resolution is not None:
+        if backend and not what_if_shop:
+            hex_cells = backend.hex_cells(selection, hex_resolution, timeline_month)
+        else:
+            de = local_data()["de"]
+            month_rows = de[de["month"] == timeline_month] if timeline_month is not None else de
+            hex_cells = aggregate_hex(pf, month_rows, shops, hex_resolution)
+        donor_points = pd.DataFrame()
+        span.rows = len(hex_cells)
+    else:
+        if not show_donors:
+            donor_points = pd.DataFrame()
+        elif backend and not what_if_shop:
+            donor_points = backend.donor_points(selection, timeline_month)
+        else:
+            donor_points = donor_points_for_map(local_data()["de"], timeline_month)
+        span.rows = len(donor_points)
+
+patient_layer, hidden_patients = None, 0
+if show_patients and patient_level is not None:
+    with profiler.span("patient_cells") as span:
+        patient_layer, hidden_patients = patient_cells(apply_filters(load_patient_area_table(data_version), filter_spec), patient_level)
+        span.rows = len(patient_layer)
+
+with profiler.span("build_map_spec"):
+    map_spec = build_map_spec(
+        pf,
+        donor_points,
+        shops,
+        area_filtered,
+        timeline_month,
+        show_donors=show_donors,
+        show_patients=show_patients,
+        show_shops=show_shops,
+        show_area_layer=show_area_layer,
+        area_metric=area_metric,
+        area_metric_label=area_metric_label,
+        area_metric_unit=area_metric_unit,
+        differentiate_donor_sources=Differentiate_Donor_Sources,
+        donors_aggregated=True,
+        hex_cells=hex_cells,
+        penetration=penetration_table,
+        penetration_metric=penetration_metric,
+        colour_by_shop=colour_by_shop,
+        proposed_sites=proposed_sites,
+        site_radius_km=site_radius_km,
+        lifecycle=lifecycle,
+        patient_cells=patient_layer,
+    )
 
 # ----------------------------
 # UI + map
 # ----------------------------
-if deck_map:
-    st.pydeck_chart(deck_map, height=800)
+if map_spec:
+    with profiler.span("create_pydeck_map"):
+        deck_map = deck_from_spec(map_spec, map_style=map_style_url, mapbox_token=st.secrets["MAPBOX_TOKEN"]["MAPBOX_TOKEN"])
+    with profiler.span("st.pydeck_chart (serialise deck)"):
+        st.pydeck_chart(deck_map, height=800)
+    if hidden_patients:
+        st.caption(f"About {hidden_patients:,} patients in areas with fewer than {SUPPRESS_BELOW} patients are not shown; counts are rounded to {ROUND_TO}.")
 else:
     st.warning("No data to show — adjust filters.")
 
-overlay_html = load_overlay_html(OVERLAY_HTML_FILE)
-if overlay_html:
-    st.subheader("Income & Age Overlay")
-    components.html(overlay_html, height=900, scrolling=True)
-else:
-    st.warning(f"Overlay file not found at {OVERLAY_HTML_FILE}.")
+# Nothing is sent to the browser until the overlay is switched on.
+st.subheader("Income & Age Overlay")
+if st.toggle("Show income & age overlay", value=False):
+    components.html(overlay_page(data_version), height=900, scrolling=False)
 
 # ----------------------------
 # Download section
 # ----------------------------
 st.subheader("⬇️ Download filtered donor data")
-st.download_button("Download donor events (filtered)", data=de.to_csv(index=False), file_name="donor_events_filtered.csv", mime="text/csv")
+export_format = st.selectbox("Export format:", list(EXPORT_FORMATS.keys()))
+current_export_key = export_key(export_format, filter_spec)
+# Exports go to one directory per session, deleted with the session state when the session ends.
+if "export_dir" not in st.session_state:
+    st.session_state["export_dir"] = tempfile.TemporaryDirectory(prefix="ellenor_export_")
+
+# The file is only written when asked for, and reused until the filters change.
+prepared = st.session_state.get("donor_export")
+if prepared and (prepared["key"] != current_export_key or not prepared["path"].exists()):
+    prepared["path"].unlink(missing_ok=True)
+    prepared = st.session_state["donor_export"] = None
+
+if prepared is None:
+    # The row count is only known once this session has the filtered events.
+    if st.button(f"Prepare export ({len(local['de']):,} rows)" if local else "Prepare export"):
+        try:
+            with st.spinner("Writing export..."):
+                export_path = write_export(local_data()["de"], export_format, Path(st.session_state["export_dir"].name))
+        except ValueError as exc:
+            st.error(str(exc))
+        else:
+            st.session_state["donor_export"] = {"key": current_export_key, "path": export_path}
+            st.rerun()
+else:
+    extension, mime = EXPORT_FORMATS[export_format]
+    with prepared["path"].open("rb") as handle:
+        st.download_button(
+            "Download donor events (filtered)",
+            data=handle,
+            file_name=f"donor_events_filtered.{extension}",
+            mime=mime,
+        )
+
+# ----------------------------
+# Performance panel (opt-in)
+# ----------------------------
+st.sidebar.subheader("⏱ Diagnostics")
+st.sidebar.checkbox("Performance panel", key="perf_panel", help="Time each stage of this rerun and append it to logs/perf.log.")
+if profiler.enabled:
+    st.sidebar.checkbox("Track memory (slower)", key="perf_memory")
+    with st.expander(f"⏱ Performance breakdown — {profiler.total_seconds():.2f}s in timed stages", expanded=False):
+        st.dataframe(profiler.frame(), hide_index=True, width="stretch")
+        st.caption("Includes Streamlit cache hits; each rerun is also appended to logs/perf.log.")
+    profiler.log(filters=filter_spec, timeline_month=timeline_month)
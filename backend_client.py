@@ -0,0 +1,98 @@
+"""Thin client for query_api.py / compute_backend.py, used by app2.py when ELLENOR_BACKEND_URL is set."""
+import json
+import os
+from typing import Iterable, List, Mapping, Optional, Tuple
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import pandas as pd
+import pyarrow as pa
+
+BACKEND_URL_ENV = "ELLENOR_BACKEND_URL"
+
+
+class Selection:
+    """The sidebar filter choices, sent as query parameters (region names, not expanded postcode areas)."""
+
+    def __init__(
+        self,
+        countries: Iterable[str],
+        regions: Iterable[str],
+        start_month: str,
+        end_month: str,
+        donation_range: Tuple[float, float] = (float("-inf"), float("inf")),
+        catchments: Optional[Iterable[str]] = None,
+        donor_filters: Optional[Mapping[str, Iterable[str]]] = None,
+    ):
+        self.params: List[Tuple[str, str]] = [("start", start_month), ("end", end_month)]
+        # An empty selection is sent as one blank value, which the server reads as "nothing".
+        for key, values in (("country", list(countries)), ("region", list(regions)), ("catchment", catchments)):
+            if values is not None:
+                self.params += [(key, value) for value in values] or [(key, "")]
+        low, high = donation_range
+        if low != float("-inf"):
+            self.params.append(("min_amount", repr(float(low))))
+        if high != float("inf"):
+            self.params.append(("max_amount", repr(float(high))))
+        # Drill-down dimensions are also the query parameter names (donor_type, source, application).
+        for dimension, values in (donor_filters or {}).items():
+            self.params += [(dimension, value) for value in values] or [(dimension, "")]
+
+    def for_month(self, month: Optional[str]) -> "Selection":
+        """Copy narrowed to a single month (the timeline slider); ``None`` keeps the range."""
+        if month is None:
+            return self
+        narrowed = Selection.__new__(Selection)
+        narrowed.params = [(k, v) for k, v in self.params if k not in ("start", "end")] + [("start", month), ("end", month)]
+        return narrowed
+
+
+class BackendClient:
+    def __init__(self, url: str, timeout: float = 120.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls) -> Optional["BackendClient"]:
+        url = os.environ.get(BACKEND_URL_ENV)
+        return cls(url) if url else None
+
+    def _get(self, path: str, selection: Selection, **extra: str) -> bytes:
+        query = urlencode(selection.params + list(extra.items()))
+        with urlopen(f"{self.url}{path}?{query}", timeout=self.timeout) as response:
+            return response.read()
+
+    def _frame(self, path: str, selection: Selection, **extra: str) -> pd.DataFrame:
+        return pa.ipc.open_stream(self._get(path, selection, format="arrow", **extra)).read_all().to_pandas()
+
+    def summary(self, selection: Selection) -> dict:
+        return json.loads(self._get("/summary", selection))
+
+    def patients(self, selection: Selection) -> pd.DataFrame:
+        """Filtered patient postcodes (only needed when exact postcodes are drawn)."""
+        return self._frame("/patients", selection)
+
+    def shops(self, selection: Selection) -> pd.DataFrame:
+        return self._frame("/shops", selection)
+
+    def shop_rollups(self, selection: Selection, max_km: Optional[float] = None) -> pd.DataFrame:
+        """Same frame as shop_catchment.shop_rollups over the real shops (0 or None: no distance limit)."""
+        return self._frame("/shops/rollups", selection, max_km=repr(float(max_km or 0)))
+
+    def donations_by_month(self, selection: Selection) -> pd.DataFrame:
+        """Donation sum, count and donor postcodes for every month with donations."""
+        return self._frame("/donors/by-month", selection)
+
+    def trend(self, selection: Selection, metric: str, by: str) -> pd.DataFrame:
+        """Same frame as timeseries.DonationTensor.series on the filtered events."""
+        return self._frame("/donors/trend", selection, metric=metric, by=by).set_index("month")
+
+    def donor_points(self, selection: Selection, timeline_month: Optional[str] = None) -> pd.DataFrame:
+        """Same rows as map_compute.donor_points_for_map on the filtered events."""
+        return self._frame("/donors/by-postcode", selection.for_month(timeline_month))
+
+    def hex_cells(self, selection: Selection, resolution: int, timeline_month: Optional[str] = None) -> pd.DataFrame:
+        return self._frame("/hex", selection.for_month(timeline_month), resolution=str(resolution))
+
+    def penetration(self, selection: Selection, level: str) -> pd.DataFrame:
+        return self._frame("/penetration", selection, level=level)
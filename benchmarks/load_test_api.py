@@ -0,0 +1,85 @@
+"""Measure requests/sec and latency of query_api.py from one machine.
+
+    python query_api.py --port 8765 &
+    python benchmarks/load_test_api.py --url http://127.0.0.1:8765 --connections 32 --duration 10
+
+Each connection is a persistent HTTP/1.1 keep-alive socket cycling through
+``--paths``; the first pass over each path fills the server's response cache,
+so the steady state measures cache hits plus transport overhead. Use
+``--unique`` to append a counter to every query and measure cold computes.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = [
+    "/summary",
+    "/summary?catchment=East&catchment=West",
+    "/donors/by-month?start=2024-01&end=2024-12",
+    "/donors/by-postcode?start=2025-01&end=2025-03&format=arrow",
+    "/donors?source=REGSOL&start=2024-06&end=2024-06",
+]
+
+
+async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, path: str) -> int:
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+    status = int(head.split(" ", 2)[1])
+    length = next(int(line.split(":", 1)[1]) for line in head.split("\r\n") if line.lower().startswith("content-length"))
+    await reader.readexactly(length)
+    return status
+
+
+async def _worker(host: str, port: int, paths: List[str], deadline: float, unique: bool, latencies: List[float], errors: List[int]) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            if unique:
+                path += ("&" if "?" in path else "?") + f"nonce={id(latencies)}-{i}"
+            started = time.perf_counter()
+            status = await _request(reader, writer, host, path)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors.append(status)
+            i += 1
+    finally:
+        writer.close()
+
+
+async def run(url: str, connections: int, duration: float, paths: List[str], unique: bool) -> None:
+    target = urlsplit(url)
+    host, port = target.hostname or "127.0.0.1", target.port or 80
+    latencies: List[float] = []
+    errors: List[int] = []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(_worker(host, port, paths, deadline, unique, latencies, errors) for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    if not latencies:
+        print("No requests completed.")
+        return
+    ordered = sorted(latencies)
+    pct = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000  # noqa: E731
+    print(f"{len(latencies):,} requests over {connections} connections in {elapsed:.1f}s")
+    print(f"  throughput   {len(latencies) / elapsed:,.0f} req/s")
+    print(f"  latency ms   mean {statistics.mean(ordered) * 1000:.2f}  p50 {pct(0.50):.2f}  p95 {pct(0.95):.2f}  p99 {pct(0.99):.2f}  max {ordered[-1] * 1000:.2f}")
+    print(f"  non-200      {len(errors)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the local query API.")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run.")
+    parser.add_argument("--path", dest="paths", action="append", help="Request path incl. query (repeatable).")
+    parser.add_argument("--unique", action="store_true", help="Defeat the response cache with a per-request nonce.")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.url, args.connections, args.duration, args.paths or DEFAULT_PATHS, args.unique))
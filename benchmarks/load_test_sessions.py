@@ -0,0 +1,86 @@
+"""Simulate N concurrent app2.py sessions against the query API or the compute backend.
+
+    python compute_backend.py --workers 4 --port 8765 &
+    python benchmarks/load_test_sessions.py --url http://127.0.0.1:8765 --sessions 8 --duration 30
+
+Each session loops over "reruns": it picks a random month range and catchment
+choice (as a user moving the sidebar would) and issues the requests app2.py
+makes for one rerun, one after the other as the script thread does, then
+pauses for ``--think`` seconds. Reported latency is per rerun, i.e. what a
+user waits for. Run it once against ``query_api.py`` (one process) and once
+against ``compute_backend.py --workers N`` to compare.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import List
+from urllib.parse import urlencode, urlsplit
+
+from load_test_api import _request
+
+CATCHMENTS = ["East", "West"]
+MONTHS = [f"{year}-{month:02d}" for year in range(2022, 2026) for month in range(1, 13)]
+
+
+def _rerun_paths(rng: random.Random, hex_share: float) -> List[str]:
+    start, end = sorted(rng.sample(MONTHS, 2))
+    params = [("start", start), ("end", end)]
+    if rng.random() < 0.5:
+        params += [("catchment", name) for name in rng.sample(CATCHMENTS, rng.randint(1, len(CATCHMENTS)))]
+    query = urlencode(params)
+    donors = f"/hex?{query}&resolution={rng.randint(0, 2)}&format=arrow" if rng.random() < hex_share else f"/donors/by-postcode?{query}&format=arrow"
+    return [f"/summary?{query}", donors, f"/penetration?{query}&level=district&format=arrow"]
+
+
+async def _session(
+    host: str, port: int, seed: int, deadline: float, think: float, hex_share: float, latencies: List[float], errors: List[int]
+) -> None:
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            for path in _rerun_paths(rng, hex_share):
+                status = await _request(reader, writer, host, path)
+                if status != 200:
+                    errors.append(status)
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(think)
+    finally:
+        writer.close()
+
+
+async def run(url: str, sessions: int, duration: float, think: float, hex_share: float, seed: int) -> None:
+    target = urlsplit(url)
+    host, port = target.hostname or "127.0.0.1", target.port or 80
+    latencies: List[float] = []
+    errors: List[int] = []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(_session(host, port, seed + i, deadline, think, hex_share, latencies, errors) for i in range(sessions)))
+    elapsed = time.perf_counter() - started
+
+    if not latencies:
+        print("No reruns completed.")
+        return
+    ordered = sorted(latencies)
+    pct = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]  # noqa: E731
+    print(f"{len(latencies):,} reruns from {sessions} sessions in {elapsed:.1f}s")
+    print(f"  throughput   {len(latencies) / elapsed:,.2f} reruns/s")
+    print(f"  rerun s      mean {statistics.mean(ordered):.2f}  p50 {pct(0.50):.2f}  p95 {pct(0.95):.2f}  max {ordered[-1]:.2f}")
+    print(f"  non-200      {len(errors)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate concurrent dashboard sessions against the query API.")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run.")
+    parser.add_argument("--think", type=float, default=1.0, help="Pause between a session's reruns, in seconds.")
+    parser.add_argument("--hex-share", type=float, default=0.3, help="Fraction of reruns drawing donors as hexagons.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.url, args.sessions, args.duration, args.think, args.hex_share, args.seed))
@@ -0,0 +1,173 @@
+"""Time the pipeline build and the app's filter → aggregate → map path on synthetic data.
+
+    python benchmarks/run_benchmarks.py --scales 1,10 --output bench.json
+    python benchmarks/run_benchmarks.py --scales 1 --compare bench.json
+
+Every stage is timed (best of ``--repeat`` runs) and then run once more under
+tracemalloc for its peak Python/NumPy allocation. Results are written as JSON
+so two commits can be compared with ``--compare``.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+import pandas as pd  # noqa: E402
+
+import data_pipeline  # noqa: E402
+from event_index import EventIndex  # noqa: E402
+from filters import REGION_GROUPS, FilterSpec, apply_filters  # noqa: E402
+from map_compute import aggregate_donors_for_map, create_pydeck_map  # noqa: E402
+from site_selection import build_demand, select_sites  # noqa: E402
+from timeseries import DonationTensor, seasonal_decomposition  # noqa: E402
+
+from synthetic import write_raw_inputs  # noqa: E402
+
+
+def point_pipeline_at(directory: Path) -> None:
+    """Redirect data_pipeline's raw inputs and cache files into ``directory``."""
+    cache_dir = directory / "data_cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    data_pipeline.RAW_FILES = {key: directory / path.name for key, path in data_pipeline.RAW_FILES.items()}
+    data_pipeline.AREA_INCOME_FILE = directory / data_pipeline.AREA_INCOME_FILE.name
+    data_pipeline.AREA_INCOME_CSV = directory / data_pipeline.AREA_INCOME_CSV.name
+    data_pipeline.CACHE_DIR = cache_dir
+    data_pipeline.CACHE_FILES = {key: cache_dir / path.name for key, path in data_pipeline.CACHE_FILES.items()}
+    for name in dir(data_pipeline):
+        value = getattr(data_pipeline, name)
+        if name.endswith("_CACHE") and isinstance(value, Path):
+            setattr(data_pipeline, name, cache_dir / value.name)
+
+
+def measure(fn, repeat: int):
+    """Return (result, best seconds, peak MB) for ``fn()``."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1] / 1024**2
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def run_scale(scale: float, repeat: int, workdir: Path) -> list:
+    counts = write_raw_inputs(workdir, scale)
+    point_pipeline_at(workdir)
+    results = []
+
+    def record(stage, fn, rows=None):
+        value, seconds, peak = measure(fn, repeat)
+        n_rows = rows(value) if rows else None
+        results.append({"stage": stage, "scale": scale, "seconds": round(seconds, 4), "peak_mb": round(peak, 1), "rows": n_rows})
+        print(f"  {stage:<28} {seconds:>9.3f}s {peak:>9.1f} MB  rows={n_rows}")
+        return value
+
+    print(f"scale {scale}: {counts}")
+    record("write_cache", data_pipeline.write_cache, rows=lambda out: len(out[2]))
+    patients, _, donor_events, shops, area_income = record(
+        "load_processed_data", data_pipeline.load_processed_data, rows=lambda out: len(out[2])
+    )
+
+    months = sorted(donor_events["month"].unique())
+    everything = FilterSpec.from_regions(sorted(donor_events["country"].unique()), REGION_GROUPS, months[0], months[-1])
+    catchment_only = FilterSpec.from_regions(everything.countries, REGION_GROUPS, months[0], months[-1], catchments=["East", "West"])
+
+    de = record("apply_filters[all]", lambda: apply_filters(donor_events, everything), rows=len)
+    record("apply_filters[catchment]", lambda: apply_filters(donor_events, catchment_only), rows=len)
+    # Donor events are month-sorted, so a narrow window should cost a fraction of the full history.
+    quarter = FilterSpec.from_regions(everything.countries, REGION_GROUPS, months[-3], months[-1])
+    record("apply_filters[3 months]", lambda: apply_filters(donor_events, quarter), rows=len)
+    record("load_donor_events[3 months]", lambda: data_pipeline.load_donor_events(months[-3], months[-1]), rows=len)
+    # Drill-down by a minority donor type and source: row lists from the index vs scanning the list columns.
+    index = record("EventIndex.build", lambda: EventIndex.build(donor_events), rows=lambda _: len(donor_events))
+    drill = FilterSpec.from_regions(
+        everything.countries, REGION_GROUPS, months[0], months[-1], donor_filters={"donor_type": ["Company"], "source": ["REGSOL", "REGOLD"]}
+    )
+    record("apply_filters[drill, index]", lambda: apply_filters(donor_events, drill, index), rows=len)
+    record("apply_filters[drill, scan]", lambda: apply_filters(donor_events, drill), rows=len)
+    pf = apply_filters(patients, everything)
+    shops_filtered = apply_filters(shops, everything)
+    area_filtered = apply_filters(area_income, everything)
+
+    record("aggregate_donors_for_map", lambda: aggregate_donors_for_map(de), rows=len)
+
+    tensor = record("DonationTensor.build", lambda: DonationTensor.build(donor_events), rows=lambda _: len(donor_events))
+    record("tensor.series[by source]", lambda: tensor.series(catchment_only, by="source"), rows=lambda out: out.size)
+    record("seasonal_decomposition", lambda: seasonal_decomposition(tensor.series(everything)["total"]), rows=len)
+
+    # Every raw income postcode is a candidate site (20k per unit of scale).
+    candidates = pd.read_parquet(data_pipeline.AREA_INCOME_FILE, columns=["pcd", "lat", "long"]).rename(
+        columns={"pcd": "label", "lat": "latitude", "long": "longitude"}
+    )
+    demand = build_demand(de, pf, area_filtered)
+    record("select_sites", lambda: select_sites(candidates, demand, shops_filtered, radius_km=5.0, n_sites=10), rows=lambda _: len(candidates))
+
+    deck = record(
+        "create_pydeck_map",
+        lambda: create_pydeck_map(pf, de, shops_filtered, area_filtered, None, differentiate_donor_sources=True),
+    )
+    if deck is not None:
+        record("deck.to_json", deck.to_json, rows=lambda out: len(out))
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: list, baseline_path: Path, threshold: float) -> int:
+    baseline = {(r["stage"], r["scale"]): r for r in json.loads(baseline_path.read_text())["results"]}
+    regressions = 0
+    print(f"\nvs {baseline_path} (flagging slower than {threshold:.2f}x)")
+    for row in current:
+        old = baseline.get((row["stage"], row["scale"]))
+        if not old or not old["seconds"]:
+            continue
+        ratio = row["seconds"] / old["seconds"]
+        flag = "  <-- slower" if ratio > threshold else ""
+        regressions += bool(flag)
+        print(f"  {row['stage']:<28} x{row['scale']:<5} {old['seconds']:>9.3f}s -> {row['seconds']:>9.3f}s ({ratio:.2f}x){flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline and map compute path.")
+    parser.add_argument("--scales", default="1,10", help="Comma separated scale factors (1 ≈ real data size, up to 100).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage; the best is reported.")
+    parser.add_argument("--output", type=Path, help="Write JSON results here.")
+    parser.add_argument("--compare", type=Path, help="Previous JSON results to compare against.")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression.")
+    args = parser.parse_args()
+
+    results = []
+    for scale in [float(s) for s in args.scales.split(",")]:
+        with tempfile.TemporaryDirectory(prefix="ellenor_bench_") as tmp:
+            results.extend(run_scale(scale, args.repeat, Path(tmp)))
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        sys.exit(1 if compare(results, args.compare, args.threshold) else 0)
@@ -0,0 +1,107 @@
+"""Time app2.py from a cold interpreter to the login screen and to the first map.
+
+    python benchmarks/startup_benchmark.py                   # against the active data_cache
+    python benchmarks/startup_benchmark.py --synthetic 1     # against a synthetic cache (see synthetic.py)
+    python benchmarks/startup_benchmark.py --output startup.json
+
+Every measurement runs in a fresh Python process with empty Streamlit caches,
+which is what the first visitor after a deploy or restart sees. The app runs
+headless under streamlit.testing; "first map" is a logged-in run up to the
+pydeck chart, and "rerun" is the same session run again with warm caches.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+APP = BASE_DIR / "app2.py"
+# Imported by the data path only; none of them should load before login.
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow", "pydeck", "altair", "data_pipeline")
+
+
+def child(stage: str, data_dir: str) -> dict:
+    """One cold run of ``stage`` ("login" or "map") in this process."""
+    sys.path.insert(0, str(BASE_DIR))
+    sys.path.insert(0, str(BASE_DIR / "benchmarks"))
+    if data_dir and stage == "map":
+        from run_benchmarks import point_pipeline_at
+
+        point_pipeline_at(Path(data_dir))
+    from streamlit.testing.v1 import AppTest
+
+    before = set(sys.modules)
+    at = AppTest.from_file(str(APP), default_timeout=600)
+    at.secrets["MAPBOX_TOKEN"] = {"MAPBOX_TOKEN": "benchmark"}
+    if stage == "map":
+        at.session_state["logged_in"] = True
+    started = time.perf_counter()
+    at.run()
+    result = {"seconds": time.perf_counter() - started, "exception": [e.message for e in at.exception]}
+    result["heavy_imports"] = sorted(name for name in HEAVY_MODULES if name in sys.modules and name not in before)
+    if stage == "login":
+        result["ok"] = bool(at.text_input) and not at.get("deck_gl_json_chart")
+    else:
+        result["ok"] = bool(at.get("deck_gl_json_chart"))
+        started = time.perf_counter()
+        at.run()
+        result["rerun_seconds"] = time.perf_counter() - started
+    return result
+
+
+def run_cold(stage: str, data_dir: str) -> dict:
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", stage, "--data-dir", data_dir], capture_output=True, text=True, cwd=BASE_DIR, check=True
+    ).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result["process_seconds"] = time.perf_counter() - started
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Cold runs per stage; the best is reported.")
+    parser.add_argument("--synthetic", type=float, default=None, help="Build and use a synthetic cache at this scale (1 ≈ real data).")
+    parser.add_argument("--output", type=Path, default=None, help="Write the results as JSON.")
+    parser.add_argument("--child", choices=["login", "map"], help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child, args.data_dir)))
+        return
+
+    data_dir = ""
+    if args.synthetic is not None:
+        sys.path.insert(0, str(BASE_DIR))
+        import data_pipeline
+        from run_benchmarks import point_pipeline_at
+        from synthetic import write_raw_inputs
+
+        data_dir = tempfile.mkdtemp(prefix="ellenor_startup_")
+        write_raw_inputs(Path(data_dir), args.synthetic)
+        point_pipeline_at(Path(data_dir))
+        data_pipeline.write_cache()
+        print(f"Synthetic cache (scale {args.synthetic:g}) in {data_dir}")
+
+    results = {}
+    for stage, label in (("login", "time to login screen"), ("map", "time to first map")):
+        runs = [run_cold(stage, data_dir) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run["seconds"])
+        results[stage] = best
+        status = "ok" if best["ok"] and not best["exception"] else f"FAILED {best['exception']}"
+        print(f"{label:<22} {best['seconds']:7.3f}s in app  {best['process_seconds']:7.3f}s with interpreter start  [{status}]")
+        print(f"{'':<22} data-stack modules imported: {', '.join(best['heavy_imports']) or 'none'}")
+        if "rerun_seconds" in best:
+            print(f"{'warm rerun':<22} {best['rerun_seconds']:7.3f}s")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
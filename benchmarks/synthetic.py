@@ -0,0 +1,122 @@
+"""Synthetic stand-ins for the raw inputs of data_pipeline, sized by a scale factor.
+
+Scale 1 roughly matches the real data (about 2k patients, 10k donor postcodes
+and 200k raw donation rows); every count grows linearly with the factor.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BASE_PATIENTS = 2_200
+BASE_DONOR_POSTCODES = 10_000
+BASE_DONATION_ROWS = 200_000
+BASE_INCOME_POSTCODES = 20_000
+POSTCODES_PER_MSOA = 25
+SHOP_COUNT = 17
+
+# Weighted towards the catchment so filters and layers see realistic densities.
+AREAS = ["DA", "BR", "TN", "ME", "SE", "CT", "RM", "SS", "CR", "E", "N", "SW", "B", "M", "G", "CF"]
+AREA_WEIGHTS = np.array([30, 10, 10, 8, 6, 5, 5, 4, 4, 4, 3, 3, 2, 2, 2, 2], dtype=float)
+COUNTRY_BY_AREA = {"G": "Scotland", "CF": "Wales"}
+SOURCES = ["LSPSWP", "LSPRDD", "REGSOL", "REGOLD", "IMOGEN", "IMOMTR", "LOTDON", "GDRTKT", "APLXMS"]
+DONOR_TYPES = ["Individual", "Company", "Groups & Organisations"]
+APPLICATIONS = ["DON", "LOT", "REG", "EVT"]
+INWARD_LETTERS = list("ABDEFGHJLNPQRSTUWXYZ")
+
+
+def make_postcodes(n: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Distinct fake postcodes with coordinates scattered around north Kent."""
+    # Oversample then de-duplicate so the pool has (close to) n distinct codes.
+    draw = int(n * 1.3) + 10
+    areas = rng.choice(AREAS, size=draw, p=AREA_WEIGHTS / AREA_WEIGHTS.sum())
+    districts = rng.integers(1, 21, size=draw).astype(str)
+    inward = (
+        rng.integers(0, 10, size=draw).astype(str).astype(object)
+        + rng.choice(INWARD_LETTERS, size=draw).astype(object)
+        + rng.choice(INWARD_LETTERS, size=draw).astype(object)
+    )
+    postcodes = pd.Series(areas.astype(object) + districts.astype(object) + " " + inward).drop_duplicates().head(n)
+    area = postcodes.str.extract(r"^([A-Z]+)", expand=False)
+    count = len(postcodes)
+    return pd.DataFrame(
+        {
+            "postcode": postcodes.to_numpy(),
+            "latitude": 51.4 + rng.normal(0, 0.35, count),
+            "longitude": 0.3 + rng.normal(0, 0.6, count),
+            "country": area.map(COUNTRY_BY_AREA).fillna("England").to_numpy(),
+        }
+    )
+
+
+def write_raw_inputs(directory: Path, scale: float, seed: int = 0) -> dict:
+    """Write every raw input data_pipeline reads into ``directory``; returns row counts."""
+    rng = np.random.default_rng(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    pool = make_postcodes(int((BASE_DONOR_POSTCODES + BASE_PATIENTS + BASE_INCOME_POSTCODES) * scale), rng)
+
+    patients = pool.sample(n=min(len(pool), int(BASE_PATIENTS * scale)), random_state=seed).copy()
+    patients["admin_district"] = "Dartford"
+    patients["admin_county"] = "Kent"
+    patients[["postcode", "latitude", "longitude", "admin_district", "admin_county", "country"]].to_csv(
+        directory / "postcode_coordinates.csv", index=False
+    )
+
+    donor_pool = pool.sample(n=min(len(pool), int(BASE_DONOR_POSTCODES * scale)), random_state=seed + 1)
+    rows = int(BASE_DONATION_ROWS * scale)
+    picks = rng.integers(0, len(donor_pool), size=rows)
+    months = rng.integers(0, 48, size=rows)
+    donors = donor_pool.iloc[picks].reset_index(drop=True)
+    donors["Month_Year"] = [f"{m % 12 + 1:02d}/{2022 + m // 12}" for m in months]
+    donors["Donor_Type"] = rng.choice(DONOR_TYPES, size=rows, p=[0.97, 0.02, 0.01])
+    donors["Total_Amount"] = ["£{:,.2f}".format(v) for v in rng.lognormal(3.0, 1.0, size=rows)]
+    donors["Source"] = rng.choice(SOURCES, size=rows)
+    # Own stream, so the columns drawn above match earlier versions of this file.
+    donors["Application"] = np.random.default_rng(seed + 4).choice(APPLICATIONS, size=rows, p=[0.7, 0.15, 0.1, 0.05])
+    donors.rename(columns={"postcode": "Postcode"}).to_csv(directory / "donation_events_geocoded.csv", index=False)
+
+    shops = pool.sample(n=SHOP_COUNT, random_state=seed + 2).copy()
+    shops["admin_district"] = "Dartford"
+    shops["admin_county"] = "Kent"
+    shops["name"] = [f"Shop {i + 1}" for i in range(len(shops))]
+    shops.to_csv(directory / "shops_geocoded.csv", index=False)
+
+    income = pool.sample(n=min(len(pool), int(BASE_INCOME_POSTCODES * scale)), random_state=seed + 3).reset_index(drop=True)
+    msoa_ids = np.arange(len(income)) // POSTCODES_PER_MSOA
+    msoa_income = rng.normal(45_000, 8_000, int(msoa_ids.max()) + 1 if len(msoa_ids) else 0).round(-2)
+    area_income = pd.DataFrame(
+        {
+            "pcd": income["postcode"],
+            "lat": income["latitude"],
+            "long": income["longitude"],
+            "msoa11": [f"E02{i:06d}" for i in msoa_ids],
+            "msoa_name": [f"Synthetic {i:03d}" for i in msoa_ids],
+            "la_code": "E07000107",
+            "la_name": "Dartford",
+            "total_income": msoa_income[msoa_ids],
+        }
+    )
+    area_income.to_parquet(directory / "Postcode_Income_Filtered.parquet", index=False)
+
+    # EMIS export: a few records per patient postcode, MSOA from the income file where the postcode is in it.
+    records = patients.loc[patients.index.repeat(rng.poisson(1.6, len(patients)) + 1), ["postcode"]].reset_index(drop=True)
+    msoa_by_postcode = dict(zip(area_income["pcd"], area_income["msoa11"]))
+    fallback = rng.integers(0, int(msoa_ids.max()) + 1 if len(msoa_ids) else 1, len(records))
+    records["msoa11"] = [msoa_by_postcode.get(pc, f"E02{i:06d}") for pc, i in zip(records["postcode"], fallback)]
+    records["lsoa11"] = "E01" + records["msoa11"].str.slice(3)
+    pd.DataFrame(
+        {
+            "EMIS Number": np.arange(1, len(records) + 1),
+            "Postcode": records["postcode"],
+            "Lower Layer Area (2011)": records["lsoa11"],
+            "Middle Layer Area (2011)": records["msoa11"],
+        }
+    ).to_csv(directory / "EMIS Patient postcodes.csv", index=False)
+
+    return {
+        "patients": len(patients),
+        "patient_records": len(records),
+        "donation_rows": rows,
+        "donor_postcodes": len(donor_pool),
+        "income_postcodes": len(area_income),
+    }
@@ -1,14 +1,15 @@
 import pandas as pd
 import requests
-import time
 from pathlib import Path
 
+from postcodes import GEOCODE_COLUMNS, STORE_FILE, PostcodeStore
+
 # ----------------------------
 # CONFIG
 # ----------------------------
 INPUT_FILE = "donation_results_2.csv"
 OUTPUT_FILE = "donation_events_geocoded_2.csv"
-CACHE_FILE = "postcode_cache.csv"  # Stores all postcodes we've ever looked up
+CACHE_FILE = STORE_FILE  # Canonical geocode table shared with data_pipeline (see postcodes.py)
 
 def get_postcode_coordinates(postcode):
     """
@@ -26,7 +27,7 @@ def get_postcode_coordinates(postcode):
             if data.get("status") == 200 and data.get("result"):
                 res = data["result"]
                 return {
-                    "postcode": postcode,
+                    "postcode": res.get("postcode", postcode),
                     "latitude": res["latitude"],
                     "longitude": res["longitude"],
                     "admin_district": res.get("admin_district", ""),
@@ -37,48 +38,11 @@ def get_postcode_coordinates(postcode):
         print(f"⚠️ Error fetching {postcode}: {e}")
     return None
 
-def load_postcode_cache(cache_file):
-    """
-    Load existing postcode cache into a dictionary (hash map)
-    """
-    cache = {}
-    if Path(cache_file).exists():
-        df = pd.read_csv(cache_file)
-        for _, row in df.iterrows():
-            cache[row["postcode"]] = {
-                "latitude": row["latitude"],
-                "longitude": row["longitude"],
-                "admin_district": row.get("admin_district", ""),
-                "admin_county": row.get("admin_county", ""),
-                "country": row.get("country", "")
-            }
-        print(f"✅ Loaded {len(cache):,} postcodes from cache")
-    return cache
-
-
-def save_postcode_cache(cache, cache_file):
-    """
-    Save the postcode cache dictionary back to CSV
-    """
-    records = []
-    for pc, data in cache.items():
-        records.append({
-            "postcode": pc,
-            "latitude": data["latitude"],
-            "longitude": data["longitude"],
-            "admin_district": data.get("admin_district", ""),
-            "admin_county": data.get("admin_county", ""),
-            "country": data.get("country", "")
-        })
-    df = pd.DataFrame(records)
-    df.to_csv(cache_file, index=False)
-    print(f"✅ Saved {len(df):,} postcodes to cache")
-
-
 def geocode_donation_events(input_file, output_file, cache_file, polite_delay=0.08):
     """
     Main function: reads donation_events.csv, geocodes postcodes efficiently using cache,
-    and saves output with lat/lon columns added
+    and saves output with lat/lon columns added. Each postcode is only ever looked up once:
+    results go into the shared postcode store, not a per-script cache.
     """
     # Load the donation events
     print(f"📂 Reading {input_file}...")
@@ -100,54 +64,30 @@ def geocode_donation_events(input_file, output_file, cache_file, polite_delay=0.
     print(f"✅ Found postcode column: '{postcode_col}'")
     print(f"📊 Total rows: {len(df):,}")
     
-    # Clean postcodes
-    df["postcode_clean"] = df[postcode_col].astype(str).str.strip().str.upper()
-    df["postcode_clean"] = df["postcode_clean"].replace({"NAN": "", "": pd.NA})
-    
     # Count unique postcodes
-    unique_postcodes = df["postcode_clean"].dropna().unique()
+    store = PostcodeStore.load(Path(cache_file))
+    unique_postcodes = df[postcode_col].dropna().astype(str).str.strip().str.upper().unique()
+    postcodes_to_fetch = store.missing(unique_postcodes)
     print(f"🔍 Unique postcodes to geocode: {len(unique_postcodes):,}")
-    
-    # Load cache (hash map)
-    cache = load_postcode_cache(cache_file)
-    
-    # Find postcodes we need to fetch
-    postcodes_to_fetch = [pc for pc in unique_postcodes if pc not in cache]
+    print(f"✅ Loaded {len(store):,} postcodes from the store")
     print(f"🌐 Need to fetch from API: {len(postcodes_to_fetch):,}")
-    print(f"⚡ Already in cache: {len(unique_postcodes) - len(postcodes_to_fetch):,}")
-    
+    print(f"⚡ Already in store: {len(unique_postcodes) - len(postcodes_to_fetch):,}")
+
     # Fetch missing postcodes
-    if postcodes_to_fetch:
+    if len(postcodes_to_fetch):
         print(f"\n🔄 Fetching {len(postcodes_to_fetch):,} postcodes from postcodes.io...")
-        for i, pc in enumerate(postcodes_to_fetch):
-            if i % 50 == 0 and i > 0:
-                print(f"   Progress: {i}/{len(postcodes_to_fetch)} ({i*100//len(postcodes_to_fetch)}%)")
-            
-            result = get_postcode_coordinates(pc)
-            if result:
-                cache[pc] = {
-                    "latitude": result["latitude"],
-                    "longitude": result["longitude"],
-                    "admin_district": result.get("admin_district", ""),
-                    "admin_county": result.get("admin_county", ""),
-                    "country": result.get("country", "")
-                }
-            time.sleep(polite_delay)  # Be polite to the API
-        
-        # Save updated cache
-        save_postcode_cache(cache, cache_file)
-    
-    # Map coordinates to dataframe using the cache (hash map lookup - O(1))
+        store.geocode_missing(postcodes_to_fetch, get_postcode_coordinates, delay=polite_delay)
+        store.save(Path(cache_file))
+        print(f"✅ Saved {len(store):,} postcodes to the store")
+
+    # Attach coordinates by integer postcode_id (row number in the store)
     print(f"\n📍 Adding coordinates to all rows...")
-    df["latitude"] = df["postcode_clean"].map(lambda pc: cache.get(pc, {}).get("latitude"))
-    df["longitude"] = df["postcode_clean"].map(lambda pc: cache.get(pc, {}).get("longitude"))
-    df["admin_district"] = df["postcode_clean"].map(lambda pc: cache.get(pc, {}).get("admin_district", ""))
-    df["admin_county"] = df["postcode_clean"].map(lambda pc: cache.get(pc, {}).get("admin_county", ""))
-    df["country"] = df["postcode_clean"].map(lambda pc: cache.get(pc, {}).get("country", ""))
-    
-    # Drop the temporary clean column
-    df = df.drop(columns=["postcode_clean"])
-    
+    geocoded = store.geocode(store.ids(df[postcode_col]))
+    for col in GEOCODE_COLUMNS:
+        df[col] = geocoded[col].to_numpy()
+        if col not in ("latitude", "longitude"):
+            df[col] = df[col].fillna("")
+
     # Stats
     total_rows = len(df)
     geocoded_rows = df["latitude"].notna().sum()
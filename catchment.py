@@ -0,0 +1,52 @@
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Named catchments, expressed as exact postcode districts (outward codes).
+# Order matters: each catchment owns one bit of the ``catchment_mask`` column.
+CATCHMENTS: Dict[str, Tuple[str, ...]] = {
+    "East": ("DA3", "DA11", "DA12", "DA13", "TN15"),
+    "West": ("DA1", "DA2", "DA4", "DA5", "DA6", "DA7", "DA8", "DA9", "DA10", "DA14", "DA15", "DA16", "DA17", "DA18", "BR8"),
+}
+
+CATCHMENT_BITS: Dict[str, int] = {name: 1 << i for i, name in enumerate(CATCHMENTS)}
+
+# Full postcode without spaces: outward code followed by a 3 character inward code.
+_POSTCODE_RE = r"^([A-Z]{1,2}\d[A-Z\d]?)\d[A-Z]{2}$"
+
+
+def extract_district(postcode_clean: pd.Series) -> pd.Series:
+    """
+    Parse the outward code from upper-cased, space-free postcodes, e.g.:
+    'DA11DE' → 'DA1'
+    'DA110AA' → 'DA11'
+    'EC1A1BB' → 'EC1A'
+    """
+    return postcode_clean.astype(str).str.extract(_POSTCODE_RE, expand=False)
+
+
+def catchment_mask(districts: pd.Series, catchments: Dict[str, Iterable[str]] = CATCHMENTS) -> np.ndarray:
+    """Bitmask per row; bit ``i`` is set when the district belongs to the i-th catchment."""
+    codes, vocabulary = pd.factorize(districts)
+    lookup = np.zeros(len(vocabulary) + 1, dtype=np.uint8)
+    for bit, members in enumerate(catchments.values()):
+        lookup[:-1] |= np.isin(vocabulary, list(members)).astype(np.uint8) << bit
+    # factorize marks missing values as -1, which lands on the trailing zero slot.
+    return lookup[codes]
+
+
+def add_catchment_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Attach ``postcode_district`` and ``catchment_mask`` based on ``postcode_clean``."""
+    districts = extract_district(df["postcode_clean"])
+    df["postcode_district"] = districts.astype("category")
+    df["catchment_mask"] = catchment_mask(districts)
+    return df
+
+
+def catchment_bits(names: Iterable[str]) -> int:
+    """Combine catchment names into a single mask; unknown names are ignored."""
+    bits = 0
+    for name in names:
+        bits |= CATCHMENT_BITS.get(name, 0)
+    return bits
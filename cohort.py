@@ -0,0 +1,127 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# A donor postcode with no gift for this many months counts as lapsed; one
+# whose first gift falls within the last NEW_WITHIN_MONTHS counts as new.
+LAPSE_AFTER_MONTHS = 12
+NEW_WITHIN_MONTHS = 3
+ALL_SOURCES = "All"
+
+LIFECYCLE_COLUMNS = ["source", "postcode", "first_month", "last_month", "active_months", "donation_sum"]
+COUNT_COLUMNS = ["source", "cohort_month", "offset", "active_postcodes"]
+
+# Lifecycle state → colour for the donor layer.
+LIFECYCLE_COLORS = {
+    "new": [46, 204, 113, 220],
+    "active": [52, 152, 219, 200],
+    "lapsed": [231, 76, 60, 200],
+}
+
+CohortState = Tuple[pd.DataFrame, pd.DataFrame]
+
+
+def month_index(months: pd.Series) -> np.ndarray:
+    """'YYYY-MM' → months since year 0, so month arithmetic is integer subtraction."""
+    months = months.astype(str)
+    return (months.str.slice(0, 4).astype(np.int32) * 12 + months.str.slice(5, 7).astype(np.int32) - 1).to_numpy(np.int32)
+
+
+def month_label(index) -> np.ndarray:
+    index = np.asarray(index, dtype=np.int64)
+    return np.char.add(np.char.add((index // 12).astype(str), "-"), np.char.zfill((index % 12 + 1).astype(str), 2))
+
+
+def empty_state() -> CohortState:
+    lifecycle = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in zip(LIFECYCLE_COLUMNS, [str, str, "int32", "int32", "int32", float])})
+    counts = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in zip(COUNT_COLUMNS, [str, "int32", "int32", "int64"])})
+    return lifecycle, counts
+
+
+def _event_keys(donor_events: pd.DataFrame) -> pd.DataFrame:
+    """One row per (source, postcode, month): every postcode under "All" plus once per source it gave through.
+
+    A postcode-month with several sources is credited in full to each of them,
+    since donor_events does not split the amount by source.
+    """
+    months = month_index(donor_events["month"])
+    overall = pd.DataFrame(
+        {"source": ALL_SOURCES, "postcode": donor_events["postcode"].to_numpy(), "month": months, "donation": donor_events["Donation Amount"].to_numpy()}
+    )
+    per_source = (
+        pd.DataFrame({"source": donor_events["source_list"].to_numpy(), "postcode": overall["postcode"], "month": months, "donation": overall["donation"]})
+        .explode("source")
+        .dropna(subset=["source"])
+    )
+    return pd.concat([overall, per_source], ignore_index=True)
+
+
+def update_cohorts(state: Optional[CohortState], new_events: pd.DataFrame) -> CohortState:
+    """Fold donor events for months not yet in ``state`` into the lifecycle and cohort tables.
+
+    Everything is additive per (source, postcode, month), so appending a new
+    month only touches that month's rows. ``state=None`` builds from scratch.
+    """
+    lifecycle, counts = state if state is not None else empty_state()
+    if new_events.empty:
+        return lifecycle, counts
+    rows = _event_keys(new_events)
+
+    fresh = rows.groupby(["source", "postcode"], sort=False).agg(
+        first_month=("month", "min"), last_month=("month", "max"), active_months=("month", "size"), donation_sum=("donation", "sum")
+    )
+    merged = lifecycle.set_index(["source", "postcode"]).join(fresh, how="outer", rsuffix="_new")
+    for col, combine in (("first_month", np.fmin), ("last_month", np.fmax)):
+        merged[col] = combine(merged[col], merged[f"{col}_new"])
+    for col in ("active_months", "donation_sum"):
+        merged[col] = merged[col].fillna(0) + merged[f"{col}_new"].fillna(0)
+    lifecycle = merged[LIFECYCLE_COLUMNS[2:]].astype({"first_month": "int32", "last_month": "int32", "active_months": "int32"}).reset_index()
+
+    # Each new (source, postcode, month) row is one active postcode in its cohort at that offset.
+    cohorts = lifecycle.set_index(["source", "postcode"])["first_month"]
+    rows["cohort_month"] = cohorts.reindex(pd.MultiIndex.from_frame(rows[["source", "postcode"]])).to_numpy(np.int32)
+    rows["offset"] = rows["month"] - rows["cohort_month"]
+    added = rows.groupby(["source", "cohort_month", "offset"]).size().rename("active_postcodes").reset_index()
+    counts = (
+        pd.concat([counts, added], ignore_index=True)
+        .groupby(["source", "cohort_month", "offset"], as_index=False)["active_postcodes"]
+        .sum()
+        .astype({"cohort_month": "int32", "offset": "int32", "active_postcodes": "int64"})
+    )
+    return lifecycle[LIFECYCLE_COLUMNS], counts[COUNT_COLUMNS]
+
+
+def processed_through(state: CohortState) -> Optional[int]:
+    """Latest month index folded into ``state`` (None when empty)."""
+    lifecycle = state[0]
+    return int(lifecycle["last_month"].max()) if not lifecycle.empty else None
+
+
+def lifecycle_status(lifecycle: pd.DataFrame, as_of: Optional[int] = None, source: str = ALL_SOURCES) -> pd.DataFrame:
+    """Per-postcode lifecycle for one source with months since last gift, lapse flag and status."""
+    table = lifecycle[lifecycle["source"] == source].copy()
+    as_of = int(table["last_month"].max()) if as_of is None and not table.empty else as_of
+    table["months_since_last"] = as_of - table["last_month"] if as_of is not None else 0
+    table["lapsed"] = table["months_since_last"] >= LAPSE_AFTER_MONTHS
+    table["status"] = np.where(
+        table["lapsed"], "lapsed", np.where(as_of - table["first_month"] < NEW_WITHIN_MONTHS if as_of is not None else False, "new", "active")
+    )
+    table["first_month"] = month_label(table["first_month"])
+    table["last_month"] = month_label(table["last_month"])
+    return table.reset_index(drop=True)
+
+
+def retention_matrix(counts: pd.DataFrame, source: str = ALL_SOURCES, max_offset: Optional[int] = None) -> pd.DataFrame:
+    """Cohort (first-gift month) × months-since-first-gift share of the cohort still giving."""
+    table = counts[counts["source"] == source]
+    if max_offset is not None:
+        table = table[table["offset"] <= max_offset]
+    active = table.pivot_table(index="cohort_month", columns="offset", values="active_postcodes", aggfunc="sum", fill_value=0)
+    if active.empty:
+        return active
+    matrix = active.div(active[0], axis=0)
+    matrix.insert(0, "cohort_size", active[0])
+    matrix.index = month_label(matrix.index)
+    matrix.index.name = "cohort"
+    return matrix
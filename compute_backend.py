@@ -0,0 +1,175 @@
+"""Multi-process compute backend: datasets held once in shared memory, queries run on a worker pool.
+
+    python compute_backend.py --workers 4 --port 8765
+    ELLENOR_BACKEND_URL=http://127.0.0.1:8765 streamlit run app2.py
+
+The parent process publishes every processed dataset as an Arrow IPC stream
+in a ``multiprocessing.shared_memory`` block. Workers (spawned, so they do not
+inherit the parent's heap) map those blocks and rebuild DataFrames whose
+numeric columns point straight into shared memory; only string/object columns
+are materialised per worker. Each query is handled by a QueryService in one of
+the workers, while the parent keeps the shared response cache and the HTTP
+front end from query_api.py. When the active cache version changes the parent
+publishes the new datasets and starts a fresh pool on them.
+"""
+import argparse
+import asyncio
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+from data_pipeline import CACHE_FILES, load_processed_data
+from query_api import QueryService, Response, serve
+
+# name -> (shared memory block name, payload size in bytes)
+Manifest = Dict[str, Tuple[str, int]]
+
+
+class _Block(SharedMemory):
+    """Shared memory block that stays mapped while DataFrames still point into it."""
+
+    def close(self) -> None:
+        try:
+            super().close()
+        except BufferError:
+            # Zero-copy columns still reference the mapping; it goes away with the process.
+            pass
+
+
+class SharedDatasets:
+    """Named DataFrames stored as Arrow IPC streams in shared memory blocks."""
+
+    def __init__(self, manifest: Manifest, blocks: List[_Block], owner: bool):
+        self.manifest = manifest
+        self.blocks = blocks
+        self.owner = owner
+
+    @classmethod
+    def publish(cls, frames: Dict[str, pd.DataFrame]) -> "SharedDatasets":
+        shared = cls({}, [], owner=True)
+        try:
+            for name, df in frames.items():
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                # Size the block with a dry run, then serialise straight into it.
+                sizer = pa.MockOutputStream()
+                with pa.ipc.new_stream(sizer, table.schema) as writer:
+                    writer.write_table(table)
+                block = _Block(create=True, size=max(sizer.size(), 1))
+                shared.blocks.append(block)
+                with pa.ipc.new_stream(pa.FixedSizeBufferWriter(pa.py_buffer(block.buf)), table.schema) as writer:
+                    writer.write_table(table)
+                shared.manifest[name] = (block.name, sizer.size())
+        except Exception:
+            shared.unlink()
+            raise
+        return shared
+
+    @classmethod
+    def attach(cls, manifest: Manifest) -> "SharedDatasets":
+        blocks = []
+        for block_name, _ in manifest.values():
+            # Pool workers share the publisher's resource tracker, so attaching
+            # here does not make the block outlive (or die with) this process.
+            blocks.append(_Block(name=block_name))
+        return cls(manifest, blocks, owner=False)
+
+    def frames(self) -> Dict[str, pd.DataFrame]:
+        """DataFrames backed by the shared buffers (numeric columns are zero-copy and read-only)."""
+        frames = {}
+        for (name, (_, size)), block in zip(self.manifest.items(), self.blocks):
+            table = pa.ipc.open_stream(pa.py_buffer(block.buf)[:size]).read_all()
+            frames[name] = table.to_pandas(split_blocks=True)
+        return frames
+
+    def unlink(self) -> None:
+        """Remove the blocks once every process is done with them (publisher only)."""
+        if self.owner:
+            for block in self.blocks:
+                block.unlink()
+
+
+# ----------------------------
+# Worker side
+# ----------------------------
+_worker_shared: Optional[SharedDatasets] = None
+_worker_service: Optional[QueryService] = None
+
+
+def _init_worker(manifest: Manifest, directory: Path) -> None:
+    global _worker_shared, _worker_service
+    _worker_shared = SharedDatasets.attach(manifest)
+    frames = _worker_shared.frames()
+    # The parent caches responses; workers only compute, reading lazy tables from the parent's cache version.
+    _worker_service = QueryService(datasets=tuple(frames[name] for name in CACHE_FILES), cache_size=0, directory=directory)
+
+
+def _worker_respond(path: str, params: Dict[str, List[str]], fmt: str) -> Response:
+    assert _worker_service is not None, "worker not initialised"
+    return _worker_service.respond(path, params, fmt)
+
+
+# ----------------------------
+# Parent side
+# ----------------------------
+class PooledQueryService(QueryService):
+    """QueryService whose cache misses are computed on a pool of worker processes."""
+
+    def __init__(self, workers: int, datasets=None, cache_size: int = 256):
+        self.workers = workers
+        super().__init__(datasets=datasets, cache_size=cache_size)
+
+    def _load(self, datasets=None, rollups: Optional[pd.DataFrame] = None) -> None:
+        datasets = datasets or load_processed_data(directory=self.directory)
+        self.shared = SharedDatasets.publish(dict(zip(CACHE_FILES, datasets)))
+        # The parent reads the same shared copy (it only needs months and countries).
+        frames = self.shared.frames()
+        super()._load(tuple(frames[name] for name in CACHE_FILES), rollups)
+        self.pool = ProcessPoolExecutor(
+            self.workers, mp_context=get_context("spawn"), initializer=_init_worker, initargs=(self.shared.manifest, self.directory)
+        )
+
+    def reload(self) -> None:
+        pool, shared = self.pool, self.shared
+        super().reload()
+        # Misses already running on the old workers finish before their shared memory goes.
+        pool.shutdown()
+        shared.unlink()
+
+    def respond(self, path: str, params: Dict[str, List[str]], fmt: str) -> Response:
+        if path == "/health":
+            return super().respond(path, params, fmt)
+        return self.pool.submit(_worker_respond, path, params, fmt).result()
+
+    def _compute(self, path: str, params: Dict[str, List[str]]) -> object:
+        # Only /health is computed in the parent.
+        return {**super()._compute(path, params), "workers": self.workers}  # type: ignore[dict-item]
+
+    def close(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
+        self.shared.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve query_api.py endpoints from a pool of worker processes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes computing cache misses.")
+    parser.add_argument("--cache-size", type=int, default=256, help="Number of responses kept in the parent's LRU cache.")
+    args = parser.parse_args()
+
+    service = PooledQueryService(args.workers, cache_size=args.cache_size)
+    # Turn SIGTERM into a normal exit so the shared memory blocks get unlinked.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        asyncio.run(serve(args.host, args.port, service))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
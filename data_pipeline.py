@@ -1,20 +1,50 @@
 import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Callable, Dict, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from catchment import add_catchment_columns
+from cohort import CohortState, month_index, processed_through, update_cohorts
+from event_index import EventIndex
+from filters import MONTH_INDEX_COLUMN, in_any_region, month_rows
+from hexgrid import HEX_RESOLUTIONS, add_hex_columns, build_hex_aggregates, hex_column
+from kpi import build_rollups
+from overlay import OVERLAY_DATA_FILE, overlay_file, write_overlay
+from patient_areas import PATIENT_LEVELS, build_patient_areas
+from penetration import build_all_penetration
+from postcodes import GEOCODE_COLUMNS, PostcodeStore
+from postcodes import STORE_FILE as POSTCODE_STORE_FILE
+from shop_catchment import add_nearest_shop_columns, add_shop_ids
+from timeseries import DonationTensor
 
 BASE_DIR = Path(__file__).parent
 CACHE_DIR = BASE_DIR / "data_cache"
 CACHE_DIR.mkdir(exist_ok=True)
 
 RAW_FILES = {
+    # EMIS export: one row per patient with 2011 LSOA/MSOA codes but no coordinates.
+    "emis": BASE_DIR / "EMIS Patient postcodes.csv",
+    # Geocoded patient postcodes; used on its own when there is no EMIS export.
     "patients": BASE_DIR / "postcode_coordinates.csv",
     "donors": BASE_DIR / "donation_events_geocoded.csv",
     "shops": BASE_DIR / "shops_geocoded.csv",
 }
 
-AREA_INCOME_FILE = BASE_DIR / "Postcode_Income_Filtered.csv"
+EMIS_COLUMNS = {"Postcode": "postcode", "Lower Layer Area (2011)": "lsoa11", "Middle Layer Area (2011)": "msoa11"}
+
+# Written by Area_Income.py; the CSV is the legacy output of that script.
+AREA_INCOME_FILE = BASE_DIR / "Postcode_Income_Filtered.parquet"
+AREA_INCOME_CSV = BASE_DIR / "Postcode_Income_Filtered.csv"
 
 CACHE_FILES = {
     "patients": CACHE_DIR / "patients.parquet",
@@ -24,13 +54,145 @@ CACHE_FILES = {
     "area_income": CACHE_DIR / "area_income.parquet",
 }
 
+# Lookup tables that sit next to the main datasets but are not returned by load_processed_data.
+POSTCODE_MSOA_CACHE = CACHE_DIR / "postcode_msoa.parquet"
+KPI_ROLLUPS_CACHE = CACHE_DIR / "kpi_rollups.parquet"
+HEX_AGGREGATES_CACHE = CACHE_DIR / "hex_aggregates.parquet"
+PENETRATION_CACHE = CACHE_DIR / "penetration.parquet"
+DONOR_LIFECYCLE_CACHE = CACHE_DIR / "donor_lifecycle.parquet"
+COHORT_COUNTS_CACHE = CACHE_DIR / "cohort_counts.parquet"
+DONATION_TENSOR_CACHE = CACHE_DIR / "donation_tensor.npz"
+PATIENT_AREAS_CACHE = CACHE_DIR / "patient_areas.parquet"
+EVENT_INDEX_CACHE = CACHE_DIR / "event_index.npz"
+# Sidebar options (months, countries, amount range, ...), so the app can draw
+# its controls without reading any dataset.
+UI_MANIFEST_CACHE = CACHE_DIR / "ui_manifest.json"
+# Shared by every version (postcode IDs are only ever appended), so it is not versioned.
+POSTCODE_STORE_CACHE = CACHE_DIR / POSTCODE_STORE_FILE.name
+# Served to the browser as a static file, so it lives in ./static rather than the
+# cache; each version gets its own file named after it (see overlay.overlay_file).
+OVERLAY_DATA_CACHE = OVERLAY_DATA_FILE
+
+# Rebuilds are written to versions/<version>/ and switched in by rewriting the
+# CURRENT pointer, so readers never see a half-written cache. Without a pointer
+# the files directly in CACHE_DIR are the active version.
+VERSIONS_DIRNAME = "versions"
+CURRENT_POINTER = "CURRENT"
+REBUILD_STATUS = "rebuild_status.json"
+KEEP_VERSIONS = 3
+
+# (step description, fraction complete) callback for long builds.
+Progress = Callable[[str, float], None]
+
+# Datasets that carry per-row hex cell IDs (see hexgrid.py).
+HEX_DATASETS = ("patients", "donor_events", "shops")
+# Datasets whose rows are assigned to their nearest shop (see shop_catchment.py).
+SHOP_ASSIGNED_DATASETS = ("patients", "donors_unique", "donor_events", "area_income")
+
+
+def cache_version() -> str:
+    """Name of the active cache version ("" for the unversioned files in CACHE_DIR)."""
+    pointer = CACHE_DIR / CURRENT_POINTER
+    if pointer.exists():
+        version = pointer.read_text(encoding="utf-8").strip()
+        if version and (CACHE_DIR / VERSIONS_DIRNAME / version).is_dir():
+            return version
+    return ""
+
+
+def active_cache_dir() -> Path:
+    version = cache_version()
+    return CACHE_DIR / VERSIONS_DIRNAME / version if version else CACHE_DIR
+
+
+def _write_atomic(path: Path, write: Callable[[Path], None]) -> None:
+    """Write via a temporary file and rename it over ``path`` so readers see old or new, never partial."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _to_parquet(df: pd.DataFrame, path: Path) -> None:
+    _write_atomic(path, lambda tmp: df.to_parquet(tmp, index=False))
+
+
+def _write_json(payload: dict, path: Path) -> None:
+    _write_atomic(path, lambda tmp: tmp.write_text(json.dumps(payload, indent=1), encoding="utf-8"))
+
+
+def _sort_by_month(events: pd.DataFrame) -> pd.DataFrame:
+    """Add the integer month column and order rows by it (stable, so postcodes stay sorted within a month)."""
+    events[MONTH_INDEX_COLUMN] = month_index(events["month"])
+    return events.sort_values(MONTH_INDEX_COLUMN, kind="stable").reset_index(drop=True)
+
+
+def _to_month_partitioned_parquet(events: pd.DataFrame, path: Path) -> None:
+    """Write month-sorted events with one row group per month, so range reads skip other months."""
+    table = pa.Table.from_pandas(events, preserve_index=False)
+    starts = np.flatnonzero(np.diff(events[MONTH_INDEX_COLUMN].to_numpy(), prepend=-1)) if len(events) else np.array([0])
+    ends = np.append(starts[1:], len(events))
+
+    def write(tmp: Path) -> None:
+        with pq.ParquetWriter(tmp, table.schema) as writer:
+            for start, end in zip(starts, ends):
+                writer.write_table(table.slice(start, end - start))
+
+    _write_atomic(path, write)
+
+
+def _attach_geocodes(df: pd.DataFrame, postcode_column: str, store: PostcodeStore) -> pd.DataFrame:
+    """Add ``postcode_id`` and the store's coordinates / admin areas to ``df``."""
+    df["postcode_id"] = store.ids(df[postcode_column])
+    geocoded = store.geocode(df["postcode_id"].to_numpy())
+    for col in GEOCODE_COLUMNS:
+        df[col] = geocoded[col].to_numpy()
+    return df
+
 
-def _load_raw_csvs() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    """Load the source CSVs with only the columns we actually need."""
-    patients = pd.read_csv(
-        RAW_FILES["patients"],
-        usecols=["postcode", "latitude", "longitude", "admin_district", "admin_county", "country"],
+def _register_csv_geocodes(path: Path, postcode_column: str, postcodes: pd.Series, store: PostcodeStore) -> None:
+    """Copy ``path``'s own coordinates into the store, but only when it has postcodes the store lacks."""
+    if not path.exists() or not len(store.missing(postcodes)):
+        return
+    header = pd.read_csv(path, nrows=0).columns
+    if "latitude" in header:
+        store.add(pd.read_csv(path, usecols=[postcode_column, *(col for col in GEOCODE_COLUMNS if col in header)]), postcode_column)
+
+
+def _load_emis_patients() -> pd.DataFrame:
+    """One row per patient postcode from the EMIS export, with its record count and 2011 LSOA/MSOA codes."""
+    emis = pd.read_csv(RAW_FILES["emis"], usecols=list(EMIS_COLUMNS), dtype=str).rename(columns=EMIS_COLUMNS)
+    emis["postcode"] = emis["postcode"].str.strip().str.upper()
+    emis = emis[emis["postcode"].notna() & (emis["postcode"] != "")]
+    for col in ("lsoa11", "msoa11"):
+        emis[col] = emis[col].str.strip()
+    return emis.groupby("postcode", as_index=False, sort=False).agg(
+        patient_count=("postcode", "size"),
+        lsoa11=("lsoa11", "first"),
+        msoa11=("msoa11", "first"),
     )
+
+
+def _attach_msoa_ids(patients: pd.DataFrame, area_income: pd.DataFrame) -> pd.DataFrame:
+    """Integer ``msoa_id`` for each patient from its EMIS MSOA code (-1 when income has no such MSOA)."""
+    if "msoa11" not in patients.columns:
+        return patients
+    msoa_ids = np.full(len(patients), -1, dtype=np.int32)
+    if "msoa11" in area_income.columns and len(area_income):
+        hits = pd.Index(area_income["msoa11"].astype(str)).get_indexer(patients["msoa11"])
+        msoa_ids[hits >= 0] = area_income["msoa_id"].to_numpy()[hits[hits >= 0]]
+    patients["msoa_id"] = msoa_ids
+    return patients
+
+
+def _load_raw_csvs(store: PostcodeStore) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Load the source CSVs with only the columns we actually need; coordinates come from the postcode store."""
+    if RAW_FILES["emis"].exists():
+        patients = _load_emis_patients()
+    else:
+        patients = pd.read_csv(RAW_FILES["patients"], usecols=["postcode"])
     donors = pd.read_csv(
         RAW_FILES["donors"],
         usecols=[
@@ -40,21 +202,18 @@ def _load_raw_csvs() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
             "Total_Amount",
             "Source",
             "Application",
-            "latitude",
-            "longitude",
-            "country",
         ],
     )
-    shops = pd.read_csv(
-        RAW_FILES["shops"],
-        usecols=["postcode", "latitude", "longitude", "admin_district", "admin_county", "country", "name"],
-    )
+    shops = pd.read_csv(RAW_FILES["shops"], usecols=["postcode", "name"])
+    for key, df, column in (("patients", patients, "postcode"), ("donors", donors, "Postcode"), ("shops", shops, "postcode")):
+        _register_csv_geocodes(RAW_FILES[key], column, df[column], store)
+        _attach_geocodes(df, column, store)
     return patients, donors, shops
 
 
-def _normalise_dataframes() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def _normalise_dataframes(store: PostcodeStore) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """Re-usable transformation that mirrors the Streamlit data prep."""
-    patients, donors, shops = _load_raw_csvs()
+    patients, donors, shops = _load_raw_csvs(store)
 
     if "Postcode" in donors.columns and "postcode" not in donors.columns:
         donors.rename(columns={"Postcode": "postcode"}, inplace=True)
@@ -119,12 +278,14 @@ def _normalise_dataframes() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, p
         country=("country", "first"),
         postcode_area=("postcode_area", "first"),
         postcode_clean=("postcode_clean", "first"),
+        postcode_id=("postcode_id", "first"),
         month_dt=("month_dt", "max"),
         donation_sum=("Donation Amount", "sum"),
         max_single=("Donation Amount", "max"),
         events_in_month=("Donation Amount", "size"),
         donor_type=("Donor_Type", _unique_join),
         source_list=("Source", _collect_sources),
+        application_list=("Application", _collect_sources),
     )
 
     monthly["Donation Amount"] = monthly["donation_sum"].astype(float)
@@ -137,20 +298,25 @@ def _normalise_dataframes() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, p
     shops["latitude"] = shops["latitude"].astype(float)
     shops["longitude"] = shops["longitude"].astype(float)
 
+    shops = add_hex_columns(add_catchment_columns(add_shop_ids(shops)))
+    patients = add_nearest_shop_columns(add_hex_columns(add_catchment_columns(patients)), shops)
+    monthly = add_nearest_shop_columns(add_hex_columns(add_catchment_columns(monthly)), shops)
+
     donors_unique = (
-        monthly[["postcode", "latitude", "longitude", "country", "postcode_area"]]
+        monthly[["postcode", "postcode_id", "latitude", "longitude", "country", "postcode_area", "nearest_shop", "shop_distance_km"]]
         .dropna(subset=["latitude", "longitude"])
         .drop_duplicates(subset=["postcode"])
         .reset_index(drop=True)
     )
+    monthly = _sort_by_month(monthly)
 
     return patients, donors_unique, monthly, shops
 
 
-def _load_area_income() -> pd.DataFrame:
-    """Bring in postcode-level income/age data if provided."""
-    if not AREA_INCOME_FILE.exists():
-        return pd.DataFrame(
+def _load_area_income(store: Optional[PostcodeStore] = None) -> pd.DataFrame:
+    """Bring in postcode-level income/age data if provided (geocoded through ``store`` when given)."""
+    if not AREA_INCOME_FILE.exists() and not AREA_INCOME_CSV.exists():
+        empty = pd.DataFrame(
             columns=[
                 "postcode",
                 "latitude",
@@ -159,10 +325,15 @@ def _load_area_income() -> pd.DataFrame:
                 "postcode_clean",
                 "country",
                 "net_income",
+                "area_label",
             ]
         )
+        return add_catchment_columns(empty)
 
-    df = pd.read_csv(AREA_INCOME_FILE)
+    if AREA_INCOME_FILE.exists():
+        df = pd.read_parquet(AREA_INCOME_FILE)
+    else:
+        df = pd.read_csv(AREA_INCOME_CSV)
     rename_map = {}
     if "pcd" in df.columns:
         rename_map["pcd"] = "postcode"
@@ -178,11 +349,15 @@ def _load_area_income() -> pd.DataFrame:
         raise ValueError(f"Income dataset is missing required columns: {missing}")
 
     df["postcode"] = df["postcode"].astype(str).str.strip().str.upper()
+    if store is not None:
+        # Income rows carry their own coordinates; the store keeps whichever source came first.
+        store.add(df, "postcode")
+        _attach_geocodes(df, "postcode", store)
     df["postcode_area"] = df["postcode"].str.extract(r"^([A-Z]{1,2})")
     df["postcode_clean"] = df["postcode"].str.replace(r"\s+", "", regex=True)
     df["latitude"] = pd.to_numeric(df["latitude"], errors="coerce")
     df["longitude"] = pd.to_numeric(df["longitude"], errors="coerce")
-    df["country"] = df.get("country", "England").fillna("England")
+    df["country"] = df["country"].fillna("England") if "country" in df.columns else "England"
 
     income_col = None
     for candidate in ("net_income", "total_income", "Net annual income (£)"):
@@ -205,13 +380,64 @@ def _load_area_income() -> pd.DataFrame:
             df["area_label"] = df["area_label"].fillna(df[field].astype(str))
     df["area_label"] = df["area_label"].fillna(df["postcode_area"])
 
-    return df
+    return add_catchment_columns(df)
+
 
+def _split_area_income(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Collapse postcode-level income rows to one row per MSOA plus a postcode → MSOA lookup."""
+    if "area_label" not in df.columns:
+        df = df.assign(area_label=df["postcode_area"])
+    key = "msoa11" if "msoa11" in df.columns else "area_label"
+    df = df[df[key].notna()]
+    msoa_ids, msoa_codes = pd.factorize(df[key].astype(str), sort=True)
 
-def write_cache() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    """Build processed Parquet files so Streamlit can load them instantly."""
-    patients, donors_unique, monthly, shops = _normalise_dataframes()
-    area_income = _load_area_income()
+    postcode_msoa = pd.DataFrame({"postcode_clean": df["postcode_clean"].to_numpy(), "msoa_id": msoa_ids.astype("int32")})
+    if "postcode_id" in df.columns:
+        postcode_msoa.insert(0, "postcode_id", df["postcode_id"].to_numpy(np.int32))
+    postcode_msoa = postcode_msoa.drop_duplicates(subset=["postcode_clean"]).reset_index(drop=True)
+
+    skip = {"latitude", "longitude", "catchment_mask", "postcode_id", key}
+    metric_cols = [col for col in df.columns if col not in skip and pd.api.types.is_numeric_dtype(df[col])]
+    grouped = df.assign(msoa_id=msoa_ids).groupby("msoa_id", sort=True)
+    msoa = grouped.agg(
+        latitude=("latitude", "mean"),
+        longitude=("longitude", "mean"),
+        country=("country", "first"),
+        postcode_area=("postcode_area", "first"),
+        area_label=("area_label", "first"),
+        postcode_count=("postcode_clean", "size"),
+        **{col: (col, "mean") for col in metric_cols},
+    ).reset_index()
+    msoa.insert(1, "msoa11", np.asarray(msoa_codes)[msoa["msoa_id"]])
+    msoa["msoa_id"] = msoa["msoa_id"].astype("int32")
+
+    # An MSOA counts towards a catchment if any of its postcodes does.
+    order = np.argsort(msoa_ids, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(msoa_ids[order]) != 0])
+    masks = df["catchment_mask"].to_numpy()[order]
+    msoa["catchment_mask"] = np.bitwise_or.reduceat(masks, starts) if len(masks) else np.array([], dtype=np.uint8)
+
+    return msoa, postcode_msoa
+
+
+def write_cache(
+    directory: Optional[Path] = None, progress: Optional[Progress] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Build processed Parquet files so Streamlit can load them instantly.
+
+    Files go to ``directory`` (default: the active cache version).
+    """
+    directory = directory or active_cache_dir()
+    report = progress or (lambda step, fraction: None)
+
+    report("Normalising raw CSVs", 0.0)
+    store = PostcodeStore.load(POSTCODE_STORE_CACHE)
+    patients, donors_unique, monthly, shops = _normalise_dataframes(store)
+    report("Preparing area income", 0.4)
+    area_income, postcode_msoa = _split_area_income(_load_area_income(store))
+    store.save(POSTCODE_STORE_CACHE)
+    patients = _attach_msoa_ids(patients, area_income)
+    area_income = add_nearest_shop_columns(area_income, shops)
 
     datasets: Dict[str, pd.DataFrame] = {
         "patients": patients,
@@ -221,22 +447,355 @@ def write_cache() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFram
         "area_income": area_income,
     }
 
+    report("Writing datasets", 0.5)
     for key, df in datasets.items():
-        df.to_parquet(CACHE_FILES[key], index=False)
+        if key == "donor_events":
+            _to_month_partitioned_parquet(df, directory / CACHE_FILES[key].name)
+        else:
+            _to_parquet(df, directory / CACHE_FILES[key].name)
+    _to_parquet(postcode_msoa, directory / POSTCODE_MSOA_CACHE.name)
+    report("Building KPI rollups", 0.6)
+    _to_parquet(build_rollups(monthly), directory / KPI_ROLLUPS_CACHE.name)
+    report("Building hex aggregates", 0.7)
+    # The precomputed tables answer the default selection (see query_api), so they
+    # leave out rows outside every region just as that selection does.
+    _to_parquet(build_hex_aggregates(in_any_region(patients), in_any_region(monthly), in_any_region(shops)), directory / HEX_AGGREGATES_CACHE.name)
+    patient_areas = build_patient_areas(patients, area_income)
+    _to_parquet(patient_areas, directory / PATIENT_AREAS_CACHE.name)
+    report("Building penetration tables", 0.8)
+    _to_parquet(
+        build_all_penetration(in_any_region(patients), in_any_region(monthly), in_any_region(area_income), postcode_msoa),
+        directory / PENETRATION_CACHE.name,
+    )
+    report("Building donation time series", 0.85)
+    _write_atomic(directory / DONATION_TENSOR_CACHE.name, DonationTensor.build(monthly).save)
+    event_index = EventIndex.build(monthly)
+    _write_atomic(directory / EVENT_INDEX_CACHE.name, event_index.save)
+    _write_json(build_ui_manifest(datasets, patient_areas, event_index), directory / UI_MANIFEST_CACHE.name)
+    report("Updating donor cohorts", 0.9)
+    update_cohort_cache(monthly, directory)
+    report("Done", 1.0)
     return patients, donors_unique, monthly, shops, area_income
 
 
-def load_processed_data(force_rebuild: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    """Load pre-processed data, rebuilding if the cache is missing or requested."""
-    if not force_rebuild and all(path.exists() for path in CACHE_FILES.values()):
-        return tuple(pd.read_parquet(path) for path in CACHE_FILES.values())  # type: ignore
-    return write_cache()
+def build_ui_manifest(datasets: Dict[str, pd.DataFrame], patient_areas: pd.DataFrame, event_index: EventIndex) -> dict:
+    """What the sidebar needs to draw its controls, from the five datasets keyed as in CACHE_FILES."""
+    events, area_income = datasets["donor_events"], datasets["area_income"]
+    countries = set()
+    for key in ("patients", "donors_unique", "donor_events"):
+        countries |= set(datasets[key]["country"].dropna().astype(str))
+    countries |= set(area_income["country"].dropna().astype(str)) if not area_income.empty and "country" in area_income.columns else {"England"}
+    amounts = events["Donation Amount"]
+    # Drill-down options, most frequent first.
+    drilldowns = {}
+    for dimension in event_index.dimensions:
+        counts = event_index.counts(dimension)
+        drilldowns[dimension] = sorted(counts, key=counts.get, reverse=True)
+    return {
+        "months": sorted(str(month) for month in events["month"].unique()),
+        "countries": sorted(countries),
+        "donation_range": [float(amounts.min()), float(amounts.max())] if len(events) else None,
+        "patient_levels": [level for level in PATIENT_LEVELS if level in set(patient_areas["level"])],
+        "area_income": not area_income.empty,
+        "donor_filters": drilldowns,
+        "rows": {key: len(df) for key, df in datasets.items()},
+    }
+
+
+def load_processed_data(
+    force_rebuild: bool = False, directory: Optional[Path] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Load pre-processed data, rebuilding if the cache is missing or requested.
+
+    Files come from ``directory`` (default: the active cache version).
+    """
+    directory = directory or active_cache_dir()
+    paths = [directory / path.name for path in CACHE_FILES.values()]
+    if not force_rebuild and all(path.exists() for path in paths):
+        frames = [pd.read_parquet(path) for path in paths]
+        # Caches written before catchment or hex columns existed get them derived on load.
+        for key, df in zip(CACHE_FILES, frames):
+            if "postcode_clean" in df.columns and "catchment_mask" not in df.columns:
+                add_catchment_columns(df)
+            if key in HEX_DATASETS and any(hex_column(res) not in df.columns for res in HEX_RESOLUTIONS):
+                add_hex_columns(df)
+        # ... and area income written per postcode is collapsed to MSOAs.
+        if "msoa_id" not in frames[-1].columns:
+            frames[-1] = _split_area_income(frames[-1])[0]
+        # ... and rows get their nearest shop.
+        shops = frames[list(CACHE_FILES).index("shops")]
+        if "shop_id" not in shops.columns:
+            add_shop_ids(shops)
+        for key, df in zip(CACHE_FILES, frames):
+            if key in SHOP_ASSIGNED_DATASETS and "nearest_shop" not in df.columns:
+                add_nearest_shop_columns(df, shops)
+        # ... and donor events are put in month order.
+        events_at = list(CACHE_FILES).index("donor_events")
+        if MONTH_INDEX_COLUMN not in frames[events_at].columns:
+            frames[events_at] = _sort_by_month(frames[events_at])
+        return tuple(frames)  # type: ignore
+    return write_cache(directory)
+
+
+def load_donor_events(start_month: Optional[str] = None, end_month: Optional[str] = None) -> pd.DataFrame:
+    """Donor events for a month range, reading only that range's row groups from the cache."""
+    path = active_cache_dir() / CACHE_FILES["donor_events"].name
+    bounds = []
+    if start_month is not None:
+        bounds.append((MONTH_INDEX_COLUMN, ">=", int(month_index(pd.Series([start_month]))[0])))
+    if end_month is not None:
+        bounds.append((MONTH_INDEX_COLUMN, "<=", int(month_index(pd.Series([end_month]))[0])))
+    if path.exists() and MONTH_INDEX_COLUMN in pq.read_schema(path).names:
+        return pd.read_parquet(path, filters=bounds or None)
+    # Cache written before the month ordering: load (and upgrade) everything, then slice.
+    events = load_processed_data()[2]
+    rows = month_rows(events[MONTH_INDEX_COLUMN].to_numpy(), start_month or events["month"].min(), end_month or events["month"].max())
+    return events.iloc[rows].reset_index(drop=True)
+
+
+def load_patient_areas() -> pd.DataFrame:
+    """Patient counts per sector / MSOA and filter key, derived from the cached datasets if not yet written."""
+    path = active_cache_dir() / PATIENT_AREAS_CACHE.name
+    if path.exists():
+        areas = pd.read_parquet(path)
+        if "level" in areas.columns:
+            return areas
+    patients, _, _, _, area_income = load_processed_data()
+    return build_patient_areas(patients, area_income)
+
+
+def load_ui_manifest() -> dict:
+    """Sidebar metadata for the active cache; derived and written once if missing or older than the events."""
+    directory = active_cache_dir()
+    path, events_path = directory / UI_MANIFEST_CACHE.name, directory / CACHE_FILES["donor_events"].name
+    if path.exists() and not (events_path.exists() and events_path.stat().st_mtime > path.stat().st_mtime):
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+        # Manifests written before the drill-down filters are redone.
+        if "donor_filters" in manifest:
+            return manifest
+    manifest = build_ui_manifest(dict(zip(CACHE_FILES, load_processed_data())), load_patient_areas(), load_event_index())
+    _write_json(manifest, path)
+    return manifest
+
+
+def load_postcode_msoa(directory: Optional[Path] = None) -> pd.DataFrame:
+    """Postcode → integer ``msoa_id`` lookup matching the MSOA rows in ``area_income``."""
+    directory = directory or active_cache_dir()
+    if (directory / POSTCODE_MSOA_CACHE.name).exists():
+        return pd.read_parquet(directory / POSTCODE_MSOA_CACHE.name)
+    income_path = directory / CACHE_FILES["area_income"].name
+    area_income = pd.read_parquet(income_path) if income_path.exists() else _load_area_income()
+    if "msoa_id" in area_income.columns:
+        # MSOA table without its lookup; only a rebuild can restore the postcodes.
+        return pd.DataFrame({"postcode_clean": pd.Series(dtype=str), "msoa_id": pd.Series(dtype="int32")})
+    if "catchment_mask" not in area_income.columns:
+        add_catchment_columns(area_income)
+    return _split_area_income(area_income)[1]
+
+
+def load_kpi_rollups(directory: Optional[Path] = None) -> pd.DataFrame:
+    """Donation rollups for the summary panel, derived from the cached events if not yet written."""
+    path = (directory or active_cache_dir()) / KPI_ROLLUPS_CACHE.name
+    if path.exists():
+        return pd.read_parquet(path)
+    donor_events = load_processed_data(directory=directory)[2]
+    return build_rollups(donor_events)
+
+
+def load_hex_aggregates(directory: Optional[Path] = None) -> pd.DataFrame:
+    """All-time hex cell aggregates at every resolution, derived from the cached datasets if not yet written."""
+    path = (directory or active_cache_dir()) / HEX_AGGREGATES_CACHE.name
+    if path.exists():
+        return pd.read_parquet(path)
+    patients, _, donor_events, shops, _ = load_processed_data(directory=directory)
+    return build_hex_aggregates(patients, donor_events, shops)
+
+
+def load_penetration(directory: Optional[Path] = None) -> pd.DataFrame:
+    """All-time penetration table for every area level, derived from the cached datasets if not yet written."""
+    path = (directory or active_cache_dir()) / PENETRATION_CACHE.name
+    if path.exists():
+        return pd.read_parquet(path)
+    patients, _, donor_events, _, area_income = load_processed_data(directory=directory)
+    return build_all_penetration(patients, donor_events, area_income, load_postcode_msoa(directory))
+
+
+def load_donation_tensor(directory: Optional[Path] = None) -> DonationTensor:
+    """Area x month x source donation tensor, built from the cached donor events if not yet written."""
+    path = (directory or active_cache_dir()) / DONATION_TENSOR_CACHE.name
+    if path.exists():
+        return DonationTensor.load(path)
+    return DonationTensor.build(load_processed_data(directory=directory)[2])
+
+
+def load_event_index(directory: Optional[Path] = None) -> EventIndex:
+    """Drill-down row lists over the cached donor events, built from them if not yet written."""
+    path = (directory or active_cache_dir()) / EVENT_INDEX_CACHE.name
+    if path.exists():
+        return EventIndex.load(path)
+    return EventIndex.build(load_processed_data(directory=directory)[2])
+
+
+def ensure_overlay_data() -> Path:
+    """The active version's overlay data file, regenerated if it is missing or older than that version's area income."""
+    path = overlay_file(cache_version(), OVERLAY_DATA_CACHE)
+    source = active_cache_dir() / CACHE_FILES["area_income"].name
+    if not path.exists() or (source.exists() and source.stat().st_mtime > path.stat().st_mtime):
+        write_overlay(load_processed_data()[4], path)
+    return path
+
+
+def update_cohort_cache(donor_events: pd.DataFrame, directory: Optional[Path] = None) -> CohortState:
+    """Fold months newer than the cached cohort state into it and write it back.
+
+    The cached state is reused only while its per-month active postcode counts
+    still match ``donor_events``; a restated past month triggers a full rebuild.
+    """
+    directory = directory or active_cache_dir()
+    lifecycle_path, counts_path = directory / DONOR_LIFECYCLE_CACHE.name, directory / COHORT_COUNTS_CACHE.name
+    months = month_index(donor_events["month"])
+    state = None
+    if lifecycle_path.exists() and counts_path.exists():
+        state = (pd.read_parquet(lifecycle_path), pd.read_parquet(counts_path))
+        through = processed_through(state)
+        counts = state[1][state[1]["source"] == "All"]
+        cached = counts.groupby(counts["cohort_month"] + counts["offset"])["active_postcodes"].sum()
+        current = pd.Series(months[months <= through]).value_counts() if through is not None else pd.Series(dtype="int64")
+        if not cached.sort_index().equals(current.sort_index().astype("int64")):
+            state = None
+    through = processed_through(state) if state is not None else None
+    new_events = donor_events if through is None else donor_events[months > through]
+    if state is not None and new_events.empty:
+        return state
+    state = update_cohorts(state, new_events)
+    _to_parquet(state[0], lifecycle_path)
+    _to_parquet(state[1], counts_path)
+    return state
+
+
+def load_cohorts() -> CohortState:
+    """Donor lifecycle and cohort count tables, brought up to date with the cached donor events."""
+    return update_cohort_cache(load_processed_data()[2])
+
+
+# ----------------------------
+# Versioned rebuilds
+# ----------------------------
+_background: Optional[subprocess.Popen] = None
+# Win32 constants for _pid_alive.
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+ERROR_ACCESS_DENIED = 5
+STILL_ACTIVE = 259
+
+
+def build_cache_version(progress: Optional[Progress] = None) -> str:
+    """Build a complete new cache version beside the active one, then switch the pointer to it."""
+    versions = CACHE_DIR / VERSIONS_DIRNAME
+    version = time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+    staging = versions / f".{version}.partial"
+    staging.mkdir(parents=True)
+    overlay_path = overlay_file(version, OVERLAY_DATA_CACHE)
+    try:
+        # Seed the cohort state so only months newer than the last build are folded in.
+        for path in (DONOR_LIFECYCLE_CACHE, COHORT_COUNTS_CACHE):
+            if (active_cache_dir() / path.name).exists():
+                shutil.copy2(active_cache_dir() / path.name, staging / path.name)
+        area_income = write_cache(staging, progress)[4]
+        # Named after the version, so sessions still on the old one keep serving theirs.
+        write_overlay(area_income, overlay_path)
+        staging.rename(versions / version)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        overlay_path.unlink(missing_ok=True)
+        raise
+    _write_atomic(CACHE_DIR / CURRENT_POINTER, lambda tmp: tmp.write_text(version, encoding="utf-8"))
+
+    # Keep a few old versions for sessions that are still reading them.
+    finished = sorted(path for path in versions.iterdir() if path.is_dir() and not path.name.startswith("."))
+    for path in finished[:-KEEP_VERSIONS]:
+        shutil.rmtree(path, ignore_errors=True)
+        overlay_file(path.name, OVERLAY_DATA_CACHE).unlink(missing_ok=True)
+    return version
+
+
+def _write_status(**status) -> None:
+    _write_atomic(CACHE_DIR / REBUILD_STATUS, lambda tmp: tmp.write_text(json.dumps(status), encoding="utf-8"))
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows, so ask for its exit code instead.
+        import ctypes
+
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        kernel32.OpenProcess.restype = ctypes.c_void_p
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+        try:
+            code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(ctypes.c_void_p(handle), ctypes.byref(code))) and code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(ctypes.c_void_p(handle))
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def rebuild_status() -> Optional[dict]:
+    """Progress of the latest background rebuild: state (running/done/failed), step, fraction, version, error."""
+    path = CACHE_DIR / REBUILD_STATUS
+    if not path.exists():
+        return None
+    status = json.loads(path.read_text(encoding="utf-8"))
+    if status.get("state") == "running":
+        # A worker that died without reporting (killed, OOM) would otherwise look busy forever.
+        pid = status.get("pid")
+        ours_exited = _background is not None and _background.pid == pid and _background.poll() is not None
+        if ours_exited or (pid and not _pid_alive(pid)):
+            status.update(state="failed", error="Rebuild worker exited unexpectedly.")
+    return status
+
+
+def start_background_rebuild() -> bool:
+    """Start ``python data_pipeline.py --force`` as a background process; False if one is already running."""
+    global _background
+    status = rebuild_status()
+    if status and status.get("state") == "running":
+        return False
+    _background = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "--force"],
+        cwd=BASE_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    _write_status(state="running", step="Starting", fraction=0.0, pid=_background.pid, started=time.time())
+    return True
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Precompute Parquet datasets for the Streamlit app.")
-    parser.add_argument("--force", action="store_true", help="Force rebuilding the cache even if files exist.")
+    parser.add_argument("--force", action="store_true", help="Build a new cache version even if files exist, then switch to it.")
     args = parser.parse_args()
 
-    load_processed_data(force_rebuild=args.force)
-    print(f"Wrote processed datasets to {CACHE_DIR.resolve()}")
+    if args.force:
+        started = time.time()
+
+        def report(step: str, fraction: float) -> None:
+            _write_status(state="running", step=step, fraction=fraction, pid=os.getpid(), started=started)
+            print(f"[{fraction:4.0%}] {step}")
+
+        try:
+            version = build_cache_version(report)
+        except BaseException as exc:
+            _write_status(state="failed", error=f"{type(exc).__name__}: {exc}", pid=os.getpid(), started=started)
+            raise
+        _write_status(state="done", step="Done", fraction=1.0, version=version, pid=os.getpid(), started=started, finished=time.time())
+    else:
+        load_processed_data()
+    print(f"Wrote processed datasets to {active_cache_dir().resolve()}")
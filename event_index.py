@@ -0,0 +1,155 @@
+"""Inverted indexes over donor_events for the donor type, source and application drill-downs.
+
+For each dimension every value maps to the sorted positions of the donor_events
+rows (postcode-months) that include it. The index is built once per cache
+version (see data_pipeline.write_cache). A selection merges the chosen values'
+row lists within a dimension and intersects them across dimensions. Because
+donor_events is month-sorted, two binary searches then cut the result to the
+month range, so no string column is scanned.
+"""
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Drill-down dimension → donor_events column holding each row's values.
+DRILLDOWN_COLUMNS = {"donor_type": "donor_type", "source": "source_list", "application": "application_list"}
+DRILLDOWN_LABELS = {"donor_type": "Donor type", "source": "Source", "application": "Application"}
+# donor_type holds a postcode-month's types as one string joined with this (see data_pipeline).
+JOINED_SEPARATOR = ", "
+
+# (dimension, chosen values) pairs; a row matches a dimension if any of its
+# values is chosen, and must match every dimension listed.
+DonorFilters = Tuple[Tuple[str, Tuple[str, ...]], ...]
+# One dimension of the index: (sorted values, offsets into rows, row positions).
+Postings = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def row_values(events: pd.DataFrame, dimension: str) -> pd.Series:
+    """Each row's values for ``dimension`` as a list-like per row."""
+    column = events[DRILLDOWN_COLUMNS[dimension]]
+    if dimension == "donor_type":
+        return column.astype(str).str.split(JOINED_SEPARATOR, regex=False)
+    return column
+
+
+def split_joined(label: str) -> List[str]:
+    return label.split(JOINED_SEPARATOR)
+
+
+def row_mask(events: pd.DataFrame, filters: DonorFilters) -> np.ndarray:
+    """Rows matching ``filters`` by comparing values, for frames with no index (dimensions without a column are skipped)."""
+    keep = np.ones(len(events), dtype=bool)
+    for dimension, chosen in filters:
+        if DRILLDOWN_COLUMNS[dimension] not in events.columns or not len(events):
+            continue
+        exploded = row_values(events, dimension).reset_index(drop=True).explode()
+        keep &= exploded.isin(chosen).groupby(level=0).any().to_numpy()
+    return keep
+
+
+def _list_postings(column: pd.Series) -> Postings:
+    """(values, offsets, rows) for a column holding a list of values per row."""
+    lists = column.to_numpy()
+    lengths = np.fromiter((len(values) for values in lists), count=len(lists), dtype=np.int64)
+    flat = np.concatenate([np.asarray(values, dtype=object) for values in lists]) if len(lists) else np.array([], dtype=object)
+    rows = np.repeat(np.arange(len(lists), dtype=np.int32), lengths)
+    known = pd.notna(flat) & (pd.Series(flat, dtype=object).astype(str).str.strip() != "").to_numpy()
+    codes, values = pd.factorize(flat[known].astype(str), sort=True)
+    # A stable sort by value keeps each value's rows in row order.
+    order = np.argsort(codes, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(values)))]).astype(np.int64)
+    return np.asarray(values, dtype=str), offsets, rows[known][order]
+
+
+def _label_postings(column: pd.Series) -> Postings:
+    """(values, offsets, rows) for a column of joined labels: only the few distinct labels are split."""
+    label_codes, labels = pd.factorize(column.astype(str))
+    members = [set(split_joined(label)) for label in labels]
+    values = sorted(set().union(*members) - {""})
+    lists = [np.flatnonzero(np.isin(label_codes, [i for i, held in enumerate(members) if value in held])).astype(np.int32) for value in values]
+    offsets = np.concatenate([[0], np.cumsum([len(rows) for rows in lists])]).astype(np.int64)
+    rows = np.concatenate(lists) if lists else np.array([], dtype=np.int32)
+    return np.asarray(values, dtype=str), offsets, rows
+
+
+class EventIndex:
+    """Value → sorted row positions, per drill-down dimension, for one donor_events frame.
+
+    Each dimension is stored as its sorted distinct ``values``, the row lists
+    of all values concatenated in that order (``rows``) and the ``offsets``
+    where each value's list starts, so one value's rows are a slice.
+    """
+
+    def __init__(self, n_rows: int, postings: Dict[str, Postings]):
+        self.n_rows = n_rows
+        self.postings = postings
+
+    @classmethod
+    def build(cls, donor_events: pd.DataFrame) -> "EventIndex":
+        postings = {}
+        for dimension, column in DRILLDOWN_COLUMNS.items():
+            if column not in donor_events.columns:
+                continue
+            if dimension == "donor_type":
+                postings[dimension] = _label_postings(donor_events[column])
+            else:
+                postings[dimension] = _list_postings(donor_events[column])
+        return cls(len(donor_events), postings)
+
+    def save(self, path: Path) -> None:
+        # Through a file handle: given a path, numpy appends ".npz" to names without it.
+        with open(path, "wb") as handle:
+            arrays = {f"{dimension}_{part}": array for dimension, parts in self.postings.items() for part, array in zip(("values", "offsets", "rows"), parts)}
+            np.savez_compressed(handle, n_rows=self.n_rows, **arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> "EventIndex":
+        with np.load(path) as data:
+            postings = {
+                dimension: (data[f"{dimension}_values"], data[f"{dimension}_offsets"], data[f"{dimension}_rows"])
+                for dimension in DRILLDOWN_COLUMNS
+                if f"{dimension}_values" in data
+            }
+            return cls(int(data["n_rows"]), postings)
+
+    # ----------------------------
+    # Queries
+    # ----------------------------
+    @property
+    def dimensions(self) -> List[str]:
+        return list(self.postings)
+
+    def values(self, dimension: str) -> List[str]:
+        return self.postings[dimension][0].tolist() if dimension in self.postings else []
+
+    def counts(self, dimension: str) -> Dict[str, int]:
+        """Rows per value, e.g. for ordering or labelling the filter options."""
+        values, offsets, _ = self.postings[dimension]
+        return dict(zip(values.tolist(), np.diff(offsets).tolist()))
+
+    def _matching(self, dimension: str, chosen: Iterable[str]) -> np.ndarray:
+        values, offsets, rows = self.postings[dimension]
+        chosen = np.asarray(list(chosen), dtype=str)
+        at = np.searchsorted(values, chosen)
+        at = at[(at < len(values)) & (values[np.minimum(at, len(values) - 1)] == chosen)] if len(values) else at[:0]
+        lists = [rows[offsets[i] : offsets[i + 1]] for i in np.unique(at)]
+        if not lists:
+            return np.array([], dtype=np.int32)
+        return lists[0] if len(lists) == 1 else np.unique(np.concatenate(lists))
+
+    def rows(self, filters: DonorFilters) -> Optional[np.ndarray]:
+        """Sorted positions of the rows matching ``filters``; None when nothing indexed restricts them.
+
+        Dimensions the index has no column for are skipped, as in row_mask.
+        """
+        matched = [self._matching(dimension, chosen) for dimension, chosen in filters if dimension in self.postings]
+        if not matched:
+            return None
+        # Intersect from the shortest list so every step is at most that long.
+        matched.sort(key=len)
+        result = matched[0]
+        for other in matched[1:]:
+            result = np.intersect1d(result, other, assume_unique=True)
+        return result
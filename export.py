@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+EXPORT_CHUNK_ROWS = 50_000
+EXCEL_MAX_ROWS = 1_048_575  # sheet limit minus the header row
+
+# label → (file extension, mime type)
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+try:
+    import openpyxl  # noqa: F401  (optional, only needed for Excel exports)
+except ImportError:
+    EXPORT_FORMATS.pop("Excel")
+
+
+def export_key(*filter_state) -> str:
+    """Stable key for a filter combination so an export is only rebuilt when filters change."""
+    return hashlib.sha1(repr(filter_state).encode("utf-8")).hexdigest()[:16]
+
+
+def _flatten(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return "; ".join(str(v) for v in value)
+    return value
+
+
+def _iter_chunks(df: pd.DataFrame, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start : start + chunk_rows].copy()
+        # List-valued columns (e.g. source_list) are flattened so every format can hold them.
+        for col in chunk.select_dtypes(include="object").columns:
+            chunk[col] = chunk[col].map(_flatten)
+        yield chunk
+
+
+def _write_csv(df: pd.DataFrame, path: Path, compress: bool, chunk_rows: int) -> None:
+    opener = gzip.open if compress else open
+    with opener(path, "wt", encoding="utf-8", newline="") as handle:
+        for i, chunk in enumerate(_iter_chunks(df, chunk_rows)):
+            chunk.to_csv(handle, index=False, header=i == 0)
+        if df.empty:
+            df.head(0).to_csv(handle, index=False)
+
+
+def _write_parquet(df: pd.DataFrame, path: Path, chunk_rows: int) -> None:
+    writer = None
+    try:
+        for chunk in _iter_chunks(df, chunk_rows):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        df.head(0).to_parquet(path, index=False)
+
+
+def _write_excel(df: pd.DataFrame, path: Path, chunk_rows: int) -> None:
+    from openpyxl import Workbook
+
+    if len(df) > EXCEL_MAX_ROWS:
+        raise ValueError(f"Excel sheets hold at most {EXCEL_MAX_ROWS:,} rows; narrow the filters or pick CSV/Parquet.")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("donor_events")
+    sheet.append(list(df.columns))
+    for chunk in _iter_chunks(df, chunk_rows):
+        for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(path)
+
+
+def write_export(df: pd.DataFrame, fmt: str, directory: Optional[Path] = None, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Path:
+    """Stream ``df`` to a temporary file in ``directory`` in the chosen format and return its path.
+
+    The caller owns the file; a failed write removes it.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    extension = EXPORT_FORMATS[fmt][0]
+    handle, name = tempfile.mkstemp(suffix=f".{extension}", prefix="donor_events_", dir=directory)
+    os.close(handle)
+    path = Path(name)
+
+    try:
+        if extension == "csv.gz":
+            _write_csv(df, path, compress=True, chunk_rows=chunk_rows)
+        elif extension == "csv":
+            _write_csv(df, path, compress=False, chunk_rows=chunk_rows)
+        elif extension == "parquet":
+            _write_parquet(df, path, chunk_rows)
+        else:
+            _write_excel(df, path, chunk_rows)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
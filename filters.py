@@ -0,0 +1,131 @@
+from dataclasses import dataclass
+from typing import Iterable, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from catchment import catchment_bits
+from cohort import month_index
+from event_index import DRILLDOWN_COLUMNS, DonorFilters, EventIndex, row_mask
+
+# Integer month (see cohort.month_index) that donor_events is sorted by.
+MONTH_INDEX_COLUMN = "month_idx"
+
+# ----------------------------
+# Region mapping
+# ----------------------------
+REGION_GROUPS = {
+    "London": ["EC", "WC", "E", "N", "NW", "SE", "SW", "W"],
+    "South East": ["BN", "BR", "CR", "CT", "DA", "GU", "HP", "KT", "ME", "OX", "PO", "RG", "RH", "SL", "SM", "SO", "TN", "TW"],
+    "South West": ["BA", "BH", "BS", "EX", "GL", "PL", "SN", "SP", "TA", "TQ", "TR"],
+    "East of England": ["AL", "CB", "CM", "CO", "EN", "IP", "LU", "NR", "PE", "SG"],
+    "West Midlands": ["B", "CV", "DY", "HR", "ST", "SY", "TF", "WR", "WS", "WV"],
+    "East Midlands": ["DE", "DN", "LE", "LN", "NG", "NN", "SK", "S"],
+    "North West": ["BB", "BL", "CA", "CH", "CW", "FY", "LA", "L", "M", "OL", "PR", "SK", "WA", "WN"],
+    "Yorkshire & Humber": ["BD", "DN", "HD", "HG", "HU", "HX", "LS", "S", "WF", "YO"],
+    "North East": ["DH", "DL", "NE", "SR", "TS"],
+    "Wales": ["CF", "LD", "LL", "NP", "SA", "SY"],
+    "Scotland": ["AB", "DD", "DG", "EH", "FK", "G", "HS", "IV", "KA", "KW", "KY", "ML", "PA", "PH", "TD", "ZE"],
+    "Northern Ireland": ["BT"],
+}
+# Postcode areas covered by some region; rows elsewhere drop out of every region selection.
+REGION_AREAS = frozenset(area for areas in REGION_GROUPS.values() for area in areas)
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    """Everything the sidebar filters on, as a hashable value usable as a cache key."""
+
+    countries: Tuple[str, ...]
+    postcode_areas: Tuple[str, ...]
+    start_month: str
+    end_month: str
+    donation_range: Tuple[float, float] = (float("-inf"), float("inf"))
+    # None means no catchment restriction; otherwise the catchment names to keep.
+    catchments: Optional[Tuple[str, ...]] = None
+    # Donor type / source / application drill-downs (see event_index.py); only
+    # the dimensions listed restrict anything.
+    donor_filters: DonorFilters = ()
+
+    @classmethod
+    def from_regions(
+        cls,
+        countries: Iterable[str],
+        regions: Iterable[str],
+        start_month: str,
+        end_month: str,
+        donation_range: Tuple[float, float] = (float("-inf"), float("inf")),
+        catchments: Optional[Iterable[str]] = None,
+        donor_filters: Optional[Mapping[str, Iterable[str]]] = None,
+    ) -> "FilterSpec":
+        """Build a spec from UK region names (see REGION_GROUPS) rather than postcode areas."""
+        areas = tuple(dict.fromkeys(area for region in regions for area in REGION_GROUPS[region]))
+        unknown = set(donor_filters or {}) - set(DRILLDOWN_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown drill-down(s) {sorted(unknown)}; expected some of {list(DRILLDOWN_COLUMNS)}")
+        return cls(
+            countries=tuple(countries),
+            postcode_areas=areas,
+            start_month=start_month,
+            end_month=end_month,
+            donation_range=(float(donation_range[0]), float(donation_range[1])),
+            catchments=tuple(catchments) if catchments is not None else None,
+            # Sorted, so the same choices always give an equal (cache-key) spec.
+            donor_filters=tuple(
+                (dimension, tuple(sorted(set(donor_filters[dimension])))) for dimension in DRILLDOWN_COLUMNS if dimension in (donor_filters or {})
+            ),
+        )
+
+    @property
+    def catchment_bits(self) -> Optional[int]:
+        return catchment_bits(self.catchments) if self.catchments is not None else None
+
+
+def month_rows(month_idx: np.ndarray, start_month: str, end_month: str) -> slice:
+    """Row range of a month-sorted ``month_idx`` array inside [start_month, end_month], by binary search."""
+    low, high = month_index(pd.Series([start_month, end_month]))
+    return slice(int(np.searchsorted(month_idx, low, side="left")), int(np.searchsorted(month_idx, high, side="right")))
+
+
+def in_any_region(df: pd.DataFrame) -> pd.DataFrame:
+    """The rows a selection of every country and region keeps, i.e. what the default filters show."""
+    return df[df["country"].notna() & df["postcode_area"].isin(REGION_AREAS)]
+
+
+def apply_filters(df: pd.DataFrame, spec: FilterSpec, index: Optional[EventIndex] = None) -> pd.DataFrame:
+    """Apply a filter spec to any of the processed datasets (missing columns are skipped).
+
+    ``index``, built on this same ``df``, answers the donor drill-downs from its row lists.
+    """
+    # Month-sorted frames are cut to the range first, so the masks below only
+    # touch the months asked for.
+    sorted_months = MONTH_INDEX_COLUMN in df.columns and df[MONTH_INDEX_COLUMN].is_monotonic_increasing
+    months = month_rows(df[MONTH_INDEX_COLUMN].to_numpy(), spec.start_month, spec.end_month) if sorted_months else None
+    hits = index.rows(spec.donor_filters) if spec.donor_filters and index is not None and index.n_rows == len(df) else None
+    if hits is not None:
+        if months is not None:
+            hits = hits[np.searchsorted(hits, months.start) : np.searchsorted(hits, months.stop)]
+        df = df.iloc[hits]
+    elif months is not None:
+        df = df.iloc[months]
+
+    base = df[(df["country"].isin(spec.countries)) & (df["postcode_area"].isin(spec.postcode_areas))].copy()
+
+    # Apply catchment toggle using the precomputed district bitmask
+    bits = spec.catchment_bits
+    if bits is not None and "catchment_mask" in base.columns:
+        base = base[(base["catchment_mask"] & bits) != 0].copy()
+
+    if spec.donor_filters and hits is None:
+        base = base[row_mask(base, spec.donor_filters)]
+
+    # Donation filter
+    if "Donation Amount" in base.columns:
+        low, high = spec.donation_range
+        base = base[(base["Donation Amount"] >= low) & (base["Donation Amount"] <= high)].copy()
+
+    # 📌 NEW: Month range filter
+    if "month" in base.columns and not sorted_months:
+        base = base[(base["month"] >= spec.start_month) & (base["month"] <= spec.end_month)].copy()
+
+    return base
@@ -0,0 +1,98 @@
+from typing import Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in km; inputs broadcast against each other."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def nearest(lat, lon, target_lat, target_lon, chunk_rows: int = 100_000) -> Tuple[np.ndarray, np.ndarray]:
+    """Index of and distance (km) to the nearest target for every point.
+
+    Brute force over an (N x targets) distance block, ``chunk_rows`` points at
+    a time. With a few dozen targets this beats building a tree; points
+    without coordinates get index -1 and distance NaN.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    target_lat = np.asarray(target_lat, dtype=float)
+    target_lon = np.asarray(target_lon, dtype=float)
+    index = np.full(len(lat), -1, dtype=np.int32)
+    distance = np.full(len(lat), np.nan, dtype=np.float32)
+    if not len(target_lat):
+        return index, distance
+
+    for start in range(0, len(lat), chunk_rows):
+        block = slice(start, start + chunk_rows)
+        d = haversine_km(lat[block, None], lon[block, None], target_lat[None, :], target_lon[None, :])
+        valid = ~np.isnan(d).all(axis=1)
+        best = np.argmin(np.where(np.isnan(d), np.inf, d), axis=1)
+        index[block] = np.where(valid, best, -1)
+        distance[block] = np.where(valid, d[np.arange(len(best)), best], np.nan)
+    return index, distance
+
+
+class GridIndex:
+    """Points bucketed into square cells of ``cell_km`` for fixed-radius neighbour queries.
+
+    Queries with ``radius_km <= cell_km`` only need the 3 x 3 block of cells
+    around each query point, so all pairs come out of a few searchsorted calls.
+    Distances use a local flat-earth approximation, which within a few tens of
+    km matches haversine to better than 0.1%.
+    """
+
+    _KEY_STRIDE = 1 << 32
+    # Cells are scaled for the far north of the UK so they are never narrower
+    # than cell_km (only wider) anywhere south of it.
+    _CELL_COS = np.cos(np.radians(61.0))
+
+    def __init__(self, lat, lon, cell_km: float):
+        self.y = np.radians(np.asarray(lat, dtype=float)) * EARTH_RADIUS_KM
+        self.x = np.radians(np.asarray(lon, dtype=float)) * EARTH_RADIUS_KM
+        self.cell_km = cell_km
+        keys = self._keys(self.x, self.y)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def _keys(self, x: np.ndarray, y: np.ndarray, dx: int = 0, dy: int = 0) -> np.ndarray:
+        cx = np.floor(x * self._CELL_COS / self.cell_km).astype(np.int64) + dx
+        cy = np.floor(y / self.cell_km).astype(np.int64) + dy
+        return cx * self._KEY_STRIDE + cy
+
+    def query_pairs(self, lat, lon, radius_km: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(query index, point index, distance km) for every pair within ``radius_km``."""
+        if radius_km > self.cell_km:
+            raise ValueError(f"radius_km ({radius_km}) must not exceed the index cell size ({self.cell_km})")
+        qy = np.radians(np.asarray(lat, dtype=float)) * EARTH_RADIUS_KM
+        qx = np.radians(np.asarray(lon, dtype=float)) * EARTH_RADIUS_KM
+        qcos = np.cos(qy / EARTH_RADIUS_KM)
+        queries, points, distances = [], [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys = self._keys(qx, qy, dx, dy)
+                lo = np.searchsorted(self.sorted_keys, keys, side="left")
+                counts = np.searchsorted(self.sorted_keys, keys, side="right") - lo
+                total = int(counts.sum())
+                if not total:
+                    continue
+                # Expand each query's [lo, lo + count) slice of the sorted points.
+                query_idx = np.repeat(np.arange(len(keys)), counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                point_idx = self.order[np.repeat(lo, counts) + offsets]
+                ex = (self.x[point_idx] - qx[query_idx]) * qcos[query_idx]
+                ey = self.y[point_idx] - qy[query_idx]
+                d2 = ex * ex + ey * ey
+                within = d2 <= radius_km * radius_km
+                queries.append(query_idx[within])
+                points.append(point_idx[within])
+                distances.append(np.sqrt(d2[within]))
+        if not queries:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, np.array([], dtype=float)
+        return np.concatenate(queries), np.concatenate(points), np.concatenate(distances)
@@ -0,0 +1,147 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from patient_areas import patient_records
+
+# Hexagon circumradius in metres per resolution. Coarse cells keep a whole-UK
+# view down to a few thousand polygons; fine cells are roughly a district.
+HEX_RESOLUTIONS: Dict[int, float] = {0: 24_000.0, 1: 8_000.0, 2: 2_500.0}
+
+# Cells live on a pointy-top axial grid laid over an equirectangular projection
+# centred on the UK, which is accurate to a few percent between Cornwall and Shetland.
+_EARTH_RADIUS_M = 6_371_000.0
+_REFERENCE_LAT = np.radians(54.0)
+
+# Cell IDs pack resolution | q | r into one int64 (4 + 24 + 24 bits), which
+# stays below 2**53 so the IDs survive a round trip through JSON/JavaScript.
+_AXIS_BITS = 24
+_AXIS_OFFSET = 1 << (_AXIS_BITS - 1)
+_AXIS_MASK = (1 << _AXIS_BITS) - 1
+NO_CELL = -1
+
+
+def hex_column(resolution: int) -> str:
+    return f"hex_{resolution}"
+
+
+def _project(lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    x = _EARTH_RADIUS_M * np.radians(lon) * np.cos(_REFERENCE_LAT)
+    y = _EARTH_RADIUS_M * np.radians(lat)
+    return x, y
+
+
+def _unproject(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    lat = np.degrees(y / _EARTH_RADIUS_M)
+    lon = np.degrees(x / (_EARTH_RADIUS_M * np.cos(_REFERENCE_LAT)))
+    return lat, lon
+
+
+def cell_ids(lat, lon, resolution: int) -> np.ndarray:
+    """Integer hex cell ID for each coordinate; rows without coordinates get NO_CELL."""
+    size = HEX_RESOLUTIONS[resolution]
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    x, y = _project(np.where(valid, lat, 0.0), np.where(valid, lon, 0.0))
+
+    # Fractional axial coordinates, then cube rounding to the nearest hex centre.
+    qf = (np.sqrt(3) / 3 * x - y / 3) / size
+    rf = (2 / 3 * y) / size
+    sf = -qf - rf
+    q, r, s = np.round(qf), np.round(rf), np.round(sf)
+    dq, dr, ds = np.abs(q - qf), np.abs(r - rf), np.abs(s - sf)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    q = np.where(fix_q, -r - s, q)
+    r = np.where(fix_r, -q - s, r)
+
+    ids = (
+        (np.int64(resolution) << (2 * _AXIS_BITS))
+        | ((q.astype(np.int64) + _AXIS_OFFSET) << _AXIS_BITS)
+        | (r.astype(np.int64) + _AXIS_OFFSET)
+    )
+    return np.where(valid, ids, NO_CELL)
+
+
+def _decode(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    ids = np.asarray(ids, dtype=np.int64)
+    resolution = ids >> (2 * _AXIS_BITS)
+    q = ((ids >> _AXIS_BITS) & _AXIS_MASK) - _AXIS_OFFSET
+    r = (ids & _AXIS_MASK) - _AXIS_OFFSET
+    return resolution, q, r
+
+
+def cell_centres(ids) -> Tuple[np.ndarray, np.ndarray]:
+    """(latitude, longitude) of each cell centre."""
+    resolution, q, r = _decode(ids)
+    size = np.vectorize(HEX_RESOLUTIONS.get, otypes=[float])(resolution) if len(resolution) else np.array([])
+    x = size * (np.sqrt(3) * q + np.sqrt(3) / 2 * r)
+    y = size * (1.5 * r)
+    return _unproject(x, y)
+
+
+def cell_polygons(ids) -> List[List[List[float]]]:
+    """Six [lon, lat] vertices per cell, for a PolygonLayer."""
+    resolution, q, r = _decode(ids)
+    if not len(resolution):
+        return []
+    size = np.vectorize(HEX_RESOLUTIONS.get, otypes=[float])(resolution)
+    cx = size * (np.sqrt(3) * q + np.sqrt(3) / 2 * r)
+    cy = size * (1.5 * r)
+    angles = np.radians(60 * np.arange(6) - 30)
+    lat, lon = _unproject(cx[:, None] + size[:, None] * np.cos(angles), cy[:, None] + size[:, None] * np.sin(angles))
+    return np.stack([lon, lat], axis=-1).round(5).tolist()
+
+
+def add_hex_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Attach one ``hex_<resolution>`` cell ID column per resolution."""
+    for resolution in HEX_RESOLUTIONS:
+        df[hex_column(resolution)] = cell_ids(df["latitude"], df["longitude"], resolution)
+    return df
+
+
+def aggregate_hex(
+    patients: pd.DataFrame,
+    donor_events: pd.DataFrame,
+    shops: pd.DataFrame,
+    resolution: int,
+) -> pd.DataFrame:
+    """Per-cell donation sum, donation count, donor postcodes, patient records and shop count.
+
+    Frames need the ``hex_<resolution>`` column from add_hex_columns, which
+    makes this a handful of integer group-bys however the frames were filtered.
+    """
+    column = hex_column(resolution)
+    patients = patients.assign(patient_count=patient_records(patients))
+    donors = donor_events[donor_events[column] != NO_CELL].groupby(column)
+    cells = pd.concat(
+        [
+            donors["Donation Amount"].sum().rename("donation_sum"),
+            donors["events_in_month"].sum().rename("donation_count"),
+            donors["postcode"].nunique().rename("donor_postcodes"),
+            patients[patients[column] != NO_CELL].groupby(column)["patient_count"].sum(),
+            shops[shops[column] != NO_CELL].groupby(column).size().rename("shop_count"),
+        ],
+        axis=1,
+    )
+    cells = cells.fillna(0).rename_axis("cell_id").reset_index()
+    cells["donation_count"] = cells["donation_count"].astype("int64")
+    for col in ("donor_postcodes", "patient_count", "shop_count"):
+        cells[col] = cells[col].astype("int32")
+    cells.insert(0, "resolution", np.uint8(resolution))
+    return cells
+
+
+def build_hex_aggregates(
+    patients: pd.DataFrame,
+    donor_events: pd.DataFrame,
+    shops: pd.DataFrame,
+    resolutions: Optional[List[int]] = None,
+) -> pd.DataFrame:
+    """All-time aggregates at every resolution in one long table (resolution, cell_id, measures...)."""
+    return pd.concat(
+        [aggregate_hex(patients, donor_events, shops, res) for res in resolutions or list(HEX_RESOLUTIONS)],
+        ignore_index=True,
+    )
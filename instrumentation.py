@@ -0,0 +1,112 @@
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import pandas as pd
+
+LOG_DIR = Path(__file__).parent / "logs"
+LOG_FILE = LOG_DIR / "perf.log"
+
+# tracemalloc is process-wide while Streamlit runs many sessions in one process,
+# so tracing is reference-counted across the spans tracking memory: it stops
+# when the last of them ends, and only if one of them started it.
+_tracing_lock = threading.Lock()
+_tracing_spans = 0
+_started_tracing = False
+
+
+def _begin_tracing() -> bool:
+    """Make sure tracing is on for one more span; True if no other span is tracking memory."""
+    global _tracing_spans, _started_tracing
+    with _tracing_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _tracing_spans += 1
+        return _tracing_spans == 1
+
+
+def _end_tracing() -> None:
+    global _tracing_spans, _started_tracing
+    with _tracing_lock:
+        _tracing_spans -= 1
+        if _tracing_spans == 0 and _started_tracing:
+            # Tracing slows everything down, so it is off whenever no span needs it.
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+@dataclass
+class Span:
+    name: str
+    seconds: float = 0.0
+    rows: Optional[int] = None
+    # Peak allocation above what was already allocated when the span started.
+    # The peak is process-wide, so it also counts spans other sessions run at the same time.
+    peak_mb: Optional[float] = None
+
+
+class Profiler:
+    """Collects timing spans for one script run; a disabled profiler costs next to nothing."""
+
+    def __init__(self, enabled: bool = True, track_memory: bool = False):
+        self.enabled = enabled
+        self.track_memory = enabled and track_memory
+        self.spans: List[Span] = []
+
+    @contextmanager
+    def span(self, name: str, rows: Optional[int] = None) -> Iterator[Span]:
+        """Time the wrapped block; set ``span.rows`` inside it to record an output size."""
+        record = Span(name, rows=rows)
+        if not self.enabled:
+            yield record
+            return
+
+        baseline = 0
+        if self.track_memory:
+            # Resetting the peak under another session's span would hide that span's peak.
+            if _begin_tracing():
+                tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - started
+            if self.track_memory:
+                record.peak_mb = max(tracemalloc.get_traced_memory()[1] - baseline, 0) / 1024**2
+                _end_tracing()
+            self.spans.append(record)
+
+    def total_seconds(self) -> float:
+        return sum(span.seconds for span in self.spans)
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame([asdict(span) for span in self.spans], columns=["name", "seconds", "rows", "peak_mb"])
+
+    def log(self, **context) -> None:
+        """Append this run's spans as one JSON line to the rolling perf log."""
+        if not self.enabled or not self.spans:
+            return
+        entry = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), **context, "spans": [asdict(span) for span in self.spans]}
+        get_perf_logger().info(json.dumps(entry, default=str))
+
+
+def get_perf_logger(path: Path = LOG_FILE) -> logging.Logger:
+    """Logger writing to a size-capped, rotating file (5 x 1 MB)."""
+    logger = logging.getLogger("ellenor.perf")
+    if not logger.handlers:
+        path.parent.mkdir(exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=1_000_000, backupCount=5, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
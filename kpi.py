@@ -0,0 +1,80 @@
+from typing import Dict
+
+import pandas as pd
+
+from event_index import split_joined
+from filters import FilterSpec
+
+# Grain of the precomputed rollup table. Every sidebar filter except the
+# donation amount range and the source / application drill-downs maps onto
+# one of these columns.
+ROLLUP_DIMENSIONS = ["country", "postcode_area", "catchment_mask", "month", "donor_type", "Source"]
+# Drill-downs decided by a rollup column alone: the donor_type label lists
+# every type, but a "Multiple" Source label hides which sources were mixed.
+ROLLUP_DRILLDOWNS = ("donor_type",)
+ROLLUP_MEASURES = ["donation_sum", "donation_count", "donor_postcodes"]
+
+
+def build_rollups(donor_events: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate monthly donor events down to one row per rollup dimension combination."""
+    rollups = (
+        donor_events.groupby(ROLLUP_DIMENSIONS, observed=True, dropna=False, sort=True)
+        .agg(
+            donation_sum=("Donation Amount", "sum"),
+            donation_count=("events_in_month", "sum"),
+            # donor_events holds one row per (postcode, month), so within a
+            # single month the row count is the number of distinct donor postcodes.
+            donor_postcodes=("postcode", "size"),
+        )
+        .reset_index()
+    )
+    for col in ("country", "postcode_area", "donor_type", "Source"):
+        rollups[col] = rollups[col].astype("category")
+    rollups["catchment_mask"] = rollups["catchment_mask"].astype("uint8")
+    return rollups
+
+
+def filter_rollups(rollups: pd.DataFrame, spec: FilterSpec) -> pd.DataFrame:
+    """Apply a filter spec to the rollup table; the donation range and drill-downs outside ROLLUP_DRILLDOWNS cannot be applied at this grain."""
+    keep = (
+        rollups["country"].isin(spec.countries)
+        & rollups["postcode_area"].isin(spec.postcode_areas)
+        & (rollups["month"] >= spec.start_month)
+        & (rollups["month"] <= spec.end_month)
+    )
+    bits = spec.catchment_bits
+    if bits is not None:
+        keep &= (rollups["catchment_mask"] & bits) != 0
+    for dimension, chosen in spec.donor_filters:
+        if dimension == "donor_type":
+            labels = rollups["donor_type"].astype("category").cat.categories
+            keep &= rollups["donor_type"].isin([label for label in labels if set(split_joined(str(label))) & set(chosen)])
+    return rollups[keep]
+
+
+def summarise(rollups: pd.DataFrame) -> Dict[str, object]:
+    """Headline KPIs for the Donation Summary panel."""
+    by_month = rollups.groupby("month", observed=True)[ROLLUP_MEASURES].sum().sort_index()
+    total = float(by_month["donation_sum"].sum())
+    count = int(by_month["donation_count"].sum())
+
+    summary: Dict[str, object] = {
+        "total_donations": total,
+        "donation_count": count,
+        "average_gift": total / count if count else 0.0,
+        "latest_month": None,
+        "active_donors": 0,
+        "latest_total": 0.0,
+        "mom_change": None,
+    }
+    if by_month.empty:
+        return summary
+
+    summary["latest_month"] = by_month.index[-1]
+    summary["active_donors"] = int(by_month["donor_postcodes"].iloc[-1])
+    latest_total = float(by_month["donation_sum"].iloc[-1])
+    summary["latest_total"] = latest_total
+    if len(by_month) > 1 and by_month["donation_sum"].iloc[-2]:
+        previous = float(by_month["donation_sum"].iloc[-2])
+        summary["mom_change"] = (latest_total - previous) / previous * 100
+    return summary
@@ -0,0 +1,533 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pydeck as pdk
+
+from cohort import LIFECYCLE_COLORS
+from hexgrid import cell_centres, cell_polygons
+from penetration import PENETRATION_METRICS
+from shop_catchment import shop_color
+
+# A map spec is plain data: {"layers": [{"type": ..., "data": DataFrame, **props}],
+# "view_state": {...}, "tooltip": {...}}. deck_from_spec turns it into a pydeck Deck.
+MapSpec = Dict[str, Any]
+
+# Compute side of the map explorer: filtering, aggregation and deck building.
+# Nothing in here touches Streamlit, so it can be profiled or reused headless.
+
+
+def _metric_to_color(value, min_value, max_value):
+    if pd.isna(value):
+        return [180, 180, 180, 60]
+    if max_value == min_value:
+        ratio = 0.5
+    else:
+        ratio = (value - min_value) / (max_value - min_value)
+        ratio = max(0.0, min(1.0, float(ratio)))
+    red = int(255 * ratio)
+    blue = int(255 * (1 - ratio))
+    return [red, 80, blue, 160]
+
+
+# ----------------------------------------------------
+# 🎨 FIXED COLOUR MAP FOR DONATION SOURCES
+# ----------------------------------------------------
+DONATION_SOURCE_LABELS = {
+    "LSPSWP": "Lottery Play money",
+    "LSPRDD": "Lottery Play money",
+    "REGSOL": "Regular Giving (campaign solicited)",
+    "REGOLD": "Regular Giving (legacy agreement)",
+    "IMOGEN": "In Memory (general donation)",
+    "LSPLDD": "Lottery Play money",
+    "LSPBBP": "Lottery Play money",
+    "IMOMTR": "Memory Tree",
+    "LOTDON": "Lottery donation",
+    "GDRTKT": "Grand Prize Draw ticket sales",
+    "LOLSOL": "Lights of Love campaign",
+    "CFADON": "Community fundraising donations",
+    "TWIREG": "Twilight registration fee",
+    "APLSOL": "Appeal donations",
+    "TWISPO": "Twilight sponsorship money",
+    "APLXMS": "Christmas Appeal donations",
+}
+
+DONATION_SOURCE_COLORS = {
+    "LSPSWP": [255, 165, 0, 220],  # Lottery Play money
+    "LSPRDD": [255, 140, 0, 220],  # Lottery play (variation)
+    "REGSOL": [0, 128, 255, 220],  # Regular Giving (solicited)
+    "REGOLD": [0, 102, 204, 220],  # Regular Giving (old)
+    "IMOGEN": [255, 105, 180, 220],  # In Memory General
+    "LSPLDD": [255, 165, 0, 220],  # Lottery play money
+    "LSPBBP": [255, 165, 0, 220],  # Lottery play money
+    "IMOMTR": [219, 112, 147, 220],  # Memory Tree
+    "LOTDON": [255, 165, 0, 220],  # Lottery donation
+    "GDRTKT": [50, 205, 50, 220],  # Prize Draw Tickets
+    "LOLSOL": [255, 215, 0, 220],  # Lights of Love
+    "CFADON": [30, 144, 255, 220],  # Community fundraising
+    "TWIREG": [138, 43, 226, 220],  # Twilight registration
+    "APLSOL": [0, 191, 255, 220],  # Appeal donations
+    "TWISPO": [148, 0, 211, 220],  # Twilight sponsorship
+    "APLXMS": [0, 255, 255, 220],  # Christmas Appeal
+}
+
+DEFAULT_SOURCE_COLOR = [200, 200, 200, 220]  # grey fallback
+
+
+def _collect_sources(values):
+    flattened = []
+    for item in values:
+        if isinstance(item, (list, tuple)):
+            flattened.extend(item)
+        elif isinstance(item, np.ndarray):
+            flattened.extend(item.tolist())
+        else:
+            if pd.notna(item) and str(item).strip():
+                flattened.append(str(item).strip())
+    return sorted({code for code in flattened if code})
+
+
+# ---- Aggregation for tooltip ----
+# Group donor events by postcode for the filtered time period
+def _format_source_names(codes):
+    readable = [DONATION_SOURCE_LABELS.get(code, code) for code in codes if pd.notna(code) and str(code).strip()]
+    return ", ".join(readable) if readable else "Unknown"
+
+
+def aggregate_donors_for_map(df: pd.DataFrame) -> pd.DataFrame:
+    """Collapse multiple donation events down to one row per postcode."""
+    if df.empty:
+        return df
+
+    working = df.sort_values("month_dt").copy()
+
+    latest = (
+        working.groupby("postcode", as_index=False)
+        .last()[["postcode", "month", "Donation Amount"]]
+        .rename(
+            columns={
+                "month": "latest_month",
+                "Donation Amount": "latest_donation",
+            }
+        )
+    )
+
+    # Per-postcode attributes precomputed by data_pipeline ride along when present.
+    passthrough = {col: (col, "first") for col in ("nearest_shop", "shop_distance_km") if col in working.columns}
+    grouped = working.groupby("postcode", as_index=False).agg(
+        **passthrough,
+        latitude=("latitude", "first"),
+        longitude=("longitude", "first"),
+        country=("country", "first"),
+        postcode_area=("postcode_area", "first"),
+        donor_type=("donor_type", "last"),
+        source_list=("source_list", _collect_sources),
+        total_donation=("Donation Amount", "sum"),
+        max_donation=("max_single_donation", "max"),
+        total_events=("events_in_month", "sum"),
+    )
+
+    grouped = grouped.merge(latest, on="postcode", how="left")
+    grouped["latest_month"] = grouped["latest_month"].fillna("Unknown")
+    grouped["latest_donation"] = grouped["latest_donation"].fillna(0.0)
+
+    grouped["sources_display"] = grouped["source_list"].apply(_format_source_names)
+    grouped["primary_source"] = grouped["source_list"].apply(lambda vals: vals[0] if len(vals) == 1 else ("Multiple" if vals else "Unknown"))
+
+    grouped["Source"] = grouped["primary_source"]
+    grouped["Donation Amount"] = grouped["total_donation"]
+
+    return grouped.drop(columns=["source_list"])
+
+
+def donor_points_for_map(df_don: pd.DataFrame, timeline_month=None) -> pd.DataFrame:
+    """Timeline filter followed by the one-row-per-postcode aggregation."""
+    if timeline_month is not None:
+        df_don = df_don[df_don["month"] == timeline_month]
+    return aggregate_donors_for_map(df_don)
+
+
+def build_map_spec(
+    df_pat,
+    df_don,
+    df_shop,
+    df_area,
+    timeline_month=None,
+    show_patients=True,
+    show_donors=True,
+    show_shops=True,
+    show_area_layer=False,
+    area_metric=None,
+    area_metric_label="",
+    area_metric_unit="",
+    differentiate_donor_sources=False,
+    donors_aggregated=False,
+    hex_cells=None,
+    penetration=None,
+    penetration_metric="penetration_gap",
+    colour_by_shop=False,
+    proposed_sites=None,
+    site_radius_km=5.0,
+    lifecycle=None,
+    patient_cells=None,
+) -> Optional[MapSpec]:
+    """Prepare layer data and settings for the map; None when nothing is visible.
+
+    Pass ``donors_aggregated=True`` when ``df_don`` already went through
+    donor_points_for_map, e.g. so the caller can time that step on its own.
+    Passing ``hex_cells`` (from hexgrid.aggregate_hex) draws donors as hexagons
+    instead of one point per postcode, and ``penetration`` (from
+    penetration.build_penetration) adds one circle per area coloured by
+    ``penetration_metric``. ``colour_by_shop`` colours patients, donors and
+    shops by nearest shop (the ``nearest_shop`` / ``shop_id`` columns).
+    ``proposed_sites`` (from site_selection.select_sites) are drawn as
+    catchment circles of ``site_radius_km``. ``lifecycle`` (from
+    cohort.lifecycle_status) colours donors as new, active or lapsed.
+    Passing ``patient_cells`` (from patient_areas.patient_cells) draws patients
+    as one circle per sector / MSOA with suppressed, rounded counts instead of
+    one point per patient postcode.
+    """
+    show_hex = hex_cells is not None and show_donors and not hex_cells.empty
+    if show_hex:
+        show_donors = False
+    show_patient_cells = patient_cells is not None and show_patients and not patient_cells.empty
+    if patient_cells is not None:
+        # Never fall back to exact points, even when every cell was suppressed.
+        show_patients = False
+    if not donors_aggregated:
+        df_don = donor_points_for_map(df_don, timeline_month) if show_donors else df_don
+
+    # Work on copies so we don't mutate original dataframes
+    df_pat = df_pat.copy()
+    df_don = df_don.copy()
+    df_shop = df_shop.copy()
+    df_area = df_area.copy()
+
+    # Patients
+    if show_patients and not df_pat.empty:
+        # EMIS postcodes not yet geocoded still count in the area tables, but cannot be drawn.
+        df_pat = df_pat.dropna(subset=["latitude", "longitude"])
+        df_pat["kind"] = "Patient"
+        df_pat["extra"] = ""  # nothing more to show (you can add more if you like)
+        df_pat["color"] = shop_color(df_pat["nearest_shop"], alpha=180) if colour_by_shop else [[255, 0, 0, 180]] * len(df_pat)
+
+    if show_patient_cells:
+        patient_cells = patient_cells.copy()
+        patient_cells["kind"] = "Patients"
+        # One row per area, so the shared tooltip shows the area in place of a postcode.
+        patient_cells["postcode"] = patient_cells["area_label"].astype(str)
+        patient_cells["extra"] = "Patients: about " + patient_cells["patients"].astype(str)
+        patient_cells["radius"] = 150 + 60 * np.sqrt(patient_cells["patients"])
+        patient_cells["color"] = [[255, 0, 0, 140]] * len(patient_cells)
+
+    # Donors
+    if show_donors and not df_don.empty:
+        df_don["kind"] = "Donor"
+        df_don["extra"] = (
+            "Donor Type: "
+            + df_don["donor_type"].astype(str)
+            + "<br/>Sources: "
+            + df_don["sources_display"].astype(str)
+            + "<br/>Total Donation Amount: £"
+            + df_don["total_donation"].round(2).astype(str)
+            + "<br/>Max Single Donation: £"
+            + df_don["max_donation"].round(2).astype(str)
+            + "<br/>Number of Donations: "
+            + df_don["total_events"].astype(int).astype(str)
+            + "<br/>Latest Month: "
+            + df_don["latest_month"].astype(str)
+            + "<br/>Latest Donation: £"
+            + df_don["latest_donation"].round(2).astype(str)
+        )
+        if lifecycle is not None:
+            by_postcode = lifecycle.set_index("postcode")
+            df_don["status"] = df_don["postcode"].map(by_postcode["status"]).fillna("active")
+            df_don["extra"] += (
+                "<br/>Status: "
+                + df_don["status"]
+                + " (first gift "
+                + df_don["postcode"].map(by_postcode["first_month"]).fillna("?").astype(str)
+                + ")"
+            )
+
+    if colour_by_shop and "nearest_shop" in df_don.columns:
+        df_don["color"] = shop_color(df_don["nearest_shop"])
+    elif "status" in df_don.columns:
+        df_don["color"] = df_don["status"].map(LIFECYCLE_COLORS)
+    elif differentiate_donor_sources and "Source" in df_don.columns:
+        # map sources to colours
+        df_don["color"] = df_don["Source"].map(DONATION_SOURCE_COLORS)
+
+        # fallback for unknown or missing sources
+        df_don["color"] = df_don["color"].apply(lambda x: x if isinstance(x, list) else DEFAULT_SOURCE_COLOR)
+    else:
+        # simple default colour (blue)
+        df_don["color"] = [[0, 128, 255, 200]] * len(df_don)
+
+    # Shops
+    if show_shops and not df_shop.empty:
+        df_shop["kind"] = "Shop"
+        df_shop["extra"] = "Name: " + df_shop["name"].astype(str)
+        df_shop["color"] = shop_color(df_shop["shop_id"], alpha=255) if colour_by_shop else [[0, 255, 0, 180]] * len(df_shop)
+
+    if show_area_layer and area_metric and not df_area.empty and area_metric in df_area.columns:
+        df_area = df_area[df_area["latitude"].notna() & df_area["longitude"].notna()].copy()
+        if not df_area.empty:
+            df_area["metric_value"] = pd.to_numeric(df_area[area_metric], errors="coerce")
+            if df_area["metric_value"].notna().sum() == 0:
+                show_area_layer = False
+            else:
+                min_val = float(df_area["metric_value"].min())
+                max_val = float(df_area["metric_value"].max())
+                df_area["color"] = df_area["metric_value"].apply(lambda v: _metric_to_color(v, min_val, max_val))
+                metric_prefix = area_metric_label or area_metric
+                unit_prefix = area_metric_unit if area_metric_unit and area_metric_unit not in ("people", "count") else ""
+                df_area["kind"] = "Area demographics"
+                df_area["extra"] = metric_prefix + ": " + (unit_prefix if unit_prefix and unit_prefix != "%" else "") + df_area["metric_value"].round(2).astype(str)
+                if unit_prefix == "%":
+                    df_area["extra"] = metric_prefix + ": " + df_area["metric_value"].round(2).astype(str) + "%"
+                df_area["extra"] = df_area["extra"] + "<br/>Area: " + df_area.get("area_label", df_area.get("postcode_area", "Unknown")).astype(str)
+                # One row per MSOA, so the shared tooltip shows the MSOA code in place of a postcode.
+                df_area["postcode"] = df_area.get("msoa11", "Unknown")
+                df_area["extra"] = df_area["extra"] + "<br/>Postcodes in area: " + df_area["postcode_count"].astype(str)
+
+    if show_hex:
+        hex_cells = hex_cells[hex_cells["donation_sum"] > 0].copy()
+        show_hex = not hex_cells.empty
+    if show_hex:
+        # Donation totals are heavily skewed, so colour on a log scale.
+        log_sum = np.log1p(hex_cells["donation_sum"].to_numpy())
+        low, high = float(log_sum.min()), float(log_sum.max())
+        hex_cells["color"] = [_metric_to_color(v, low, high) for v in log_sum]
+        hex_cells["polygon"] = cell_polygons(hex_cells["cell_id"].to_numpy())
+        hex_cells["latitude"], hex_cells["longitude"] = cell_centres(hex_cells["cell_id"].to_numpy())
+        hex_cells["kind"] = "Hex cell"
+        hex_cells["postcode"] = hex_cells["cell_id"].astype(str)
+        hex_cells["extra"] = (
+            "Total Donation Amount: £"
+            + hex_cells["donation_sum"].round(2).astype(str)
+            + "<br/>Number of Donations: "
+            + hex_cells["donation_count"].astype(str)
+            + "<br/>Donor Postcodes: "
+            + hex_cells["donor_postcodes"].astype(str)
+            + "<br/>Patients: "
+            + hex_cells["patient_count"].astype(str)
+            + "<br/>Shops: "
+            + hex_cells["shop_count"].astype(str)
+        )
+
+    show_penetration = penetration is not None and penetration_metric in PENETRATION_METRICS
+    if show_penetration:
+        penetration = penetration[penetration["latitude"].notna() & penetration["longitude"].notna() & penetration[penetration_metric].notna()].copy()
+        show_penetration = not penetration.empty
+    if show_penetration:
+        values = penetration[penetration_metric].astype(float)
+        if penetration_metric == "penetration_gap":
+            # Diverging: blue where donations outrun patients, red where patients outrun donations.
+            bound = float(values.abs().max())
+            low, high = -bound, bound
+        else:
+            low, high = float(values.min()), float(values.max())
+        penetration["color"] = [_metric_to_color(v, low, high) for v in values]
+        # Circle area grows with the number of people behind the ratio.
+        penetration["radius"] = 300 + 120 * np.sqrt(penetration["patient_count"] + penetration["donor_postcodes"])
+        label, unit = PENETRATION_METRICS[penetration_metric]
+        value_text = values.round(2).astype(str)
+        value_text = "£" + value_text if unit == "£" else (value_text + "%" if unit == "%" else value_text)
+        penetration["kind"] = "Penetration"
+        penetration["postcode"] = penetration["area"].astype(str)
+        penetration["extra"] = (
+            label
+            + ": "
+            + value_text
+            + "<br/>Patients: "
+            + penetration["patient_count"].astype(str)
+            + "<br/>Donor Postcodes: "
+            + penetration["donor_postcodes"].astype(str)
+            + "<br/>Total Donation Amount: £"
+            + penetration["donation_sum"].round(2).astype(str)
+        )
+
+    show_sites = proposed_sites is not None and not proposed_sites.empty
+    if show_sites:
+        proposed_sites = proposed_sites.copy()
+        proposed_sites["kind"] = "Proposed site #" + proposed_sites["rank"].astype(str)
+        proposed_sites["postcode"] = proposed_sites["label"].astype(str)
+        proposed_sites["extra"] = (
+            "Score: "
+            + proposed_sites["score"].round(2).astype(str)
+            + "<br/>New donor value reached: £"
+            + proposed_sites["donor_value"].round(2).astype(str)
+            + "<br/>New patients reached: "
+            + proposed_sites["patients"].astype(int).astype(str)
+        )
+
+    # Combine coords to find centre (only include visible layers)
+    coord_frames = []
+    if show_patients and not df_pat.empty:
+        coord_frames.append(df_pat[["latitude", "longitude"]])
+    if show_patient_cells:
+        coord_frames.append(patient_cells[["latitude", "longitude"]])
+    if show_donors and not df_don.empty:
+        coord_frames.append(df_don[["latitude", "longitude"]])
+    if show_shops and not df_shop.empty:
+        coord_frames.append(df_shop[["latitude", "longitude"]])
+    if show_area_layer and not df_area.empty and area_metric:
+        coord_frames.append(df_area[["latitude", "longitude"]])
+    if show_hex:
+        coord_frames.append(hex_cells[["latitude", "longitude"]])
+    if show_penetration:
+        coord_frames.append(penetration[["latitude", "longitude"]])
+    if show_sites:
+        coord_frames.append(proposed_sites[["latitude", "longitude"]])
+
+    if not coord_frames:
+        return None
+
+    combined = pd.concat(coord_frames).dropna()
+    if combined.empty:
+        return None
+
+    center = [combined["latitude"].mean(), combined["longitude"].mean()]
+
+    layers: List[Dict[str, Any]] = []
+
+    # Donor hexagons (drawn first so point layers sit on top)
+    if show_hex:
+        layers.append(
+            dict(
+                type="PolygonLayer",
+                data=hex_cells[["polygon", "color", "kind", "postcode", "extra"]],
+                get_polygon="polygon",
+                get_fill_color="color",
+                stroked=False,
+                pickable=True,
+                opacity=0.6,
+            )
+        )
+
+    if show_penetration:
+        layers.append(
+            dict(
+                type="ScatterplotLayer",
+                data=penetration[["latitude", "longitude", "radius", "color", "kind", "postcode", "extra"]],
+                get_position="[longitude, latitude]",
+                get_radius="radius",
+                get_fill_color="color",
+                pickable=True,
+                opacity=0.5,
+            )
+        )
+
+    # Patients
+    if show_patient_cells:
+        layers.append(
+            dict(
+                type="ScatterplotLayer",
+                data=patient_cells[["latitude", "longitude", "radius", "color", "kind", "postcode", "extra"]],
+                get_position="[longitude, latitude]",
+                get_radius="radius",
+                get_fill_color="color",
+                pickable=True,
+                opacity=0.6,
+            )
+        )
+    if show_patients and not df_pat.empty:
+        layers.append(dict(type="ScatterplotLayer", data=df_pat, get_position="[longitude, latitude]", get_radius=80, get_fill_color="color", pickable=True))
+
+    # Donors
+    if show_donors and not df_don.empty:
+        layers.append(dict(type="ScatterplotLayer", data=df_don, get_position="[longitude, latitude]", get_radius=80, get_fill_color="color", pickable=True))
+
+    # Shops
+    if show_shops and not df_shop.empty:
+        layers.append(dict(type="ScatterplotLayer", data=df_shop, get_position="[longitude, latitude]", get_radius=100, get_fill_color="color", pickable=True))
+
+    if show_area_layer and not df_area.empty and area_metric:
+        layers.append(
+            dict(
+                type="ScatterplotLayer",
+                data=df_area,
+                get_position="[longitude, latitude]",
+                get_radius=600,
+                get_fill_color="color",
+                pickable=True,
+                opacity=0.5,
+            )
+        )
+
+    if show_sites:
+        layers.append(
+            dict(
+                type="ScatterplotLayer",
+                data=proposed_sites[["latitude", "longitude", "kind", "postcode", "extra"]],
+                get_position="[longitude, latitude]",
+                get_radius=site_radius_km * 1000,
+                get_fill_color=[160, 32, 240, 40],
+                get_line_color=[160, 32, 240, 220],
+                stroked=True,
+                line_width_min_pixels=2,
+                pickable=True,
+            )
+        )
+
+    # Heatmap (donors)
+    if show_donors and not df_don.empty:
+        layers.append(
+            dict(
+                type="HeatmapLayer",
+                data=df_don,
+                get_position="[longitude, latitude]",
+                get_weight="Donation Amount",
+                radiusPixels=60,
+            )
+        )
+
+    view_state = {
+        "latitude": center[0],
+        "longitude": center[1],
+        "zoom": 6,
+        "pitch": 0,
+    }
+
+    # ---- Global tooltip template (works for all layers) ----
+    tooltip = {"html": "<b>{kind}</b><br/>Postcode: {postcode}<br/>{extra}", "style": {"color": "white", "backgroundColor": "rgba(0, 0, 0, 0.7)"}}
+
+    return {"layers": layers, "view_state": view_state, "tooltip": tooltip}
+
+
+def deck_from_spec(spec: MapSpec, map_style="mapbox://styles/mapbox/satellite-v9", mapbox_token=None) -> pdk.Deck:
+    layers = [pdk.Layer(layer["type"], **{key: value for key, value in layer.items() if key != "type"}) for layer in spec["layers"]]
+    return pdk.Deck(
+        layers=layers,
+        initial_view_state=pdk.ViewState(**spec["view_state"]),
+        map_style=map_style,
+        api_keys={"mapbox": mapbox_token},
+        tooltip=spec["tooltip"],
+        parameters={"clearColor": [1.0, 1.0, 1.0, 1.0]},
+    )
+
+
+def create_pydeck_map(
+    df_pat,
+    df_don,
+    df_shop,
+    df_area,
+    timeline_month=None,
+    map_style="mapbox://styles/mapbox/satellite-v9",
+    mapbox_token=None,
+    **options,
+) -> Optional[pdk.Deck]:
+    """build_map_spec + deck_from_spec; ``options`` are the layer toggles of build_map_spec."""
+    spec = build_map_spec(df_pat, df_don, df_shop, df_area, timeline_month, **options)
+    if spec is None:
+        return None
+    return deck_from_spec(spec, map_style=map_style, mapbox_token=mapbox_token)
+
+
+def area_metric_median(df_area: pd.DataFrame, area_metric: str) -> Optional[float]:
+    """Median of an area metric over the filtered MSOAs, or None when unavailable."""
+    if df_area.empty or area_metric not in df_area.columns:
+        return None
+    values = pd.to_numeric(df_area[area_metric], errors="coerce").dropna()
+    return float(values.median()) if not values.empty else None
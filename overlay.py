@@ -0,0 +1,116 @@
+"""Income & age overlay: a compact static data file plus a small HTML shell that loads it on demand.
+
+    python overlay.py            # rebuild the active version's overlay data from the cached area income
+
+The data file is written next to the app in ``static/``, one per cache version
+(``income_overlay.<version>.json``, or ``income_overlay.json`` for an
+unversioned cache) so sessions on an older version keep their own, and served by
+Streamlit's static file handler (``enableStaticServing``), which gzips it and
+lets the browser cache it. Instead of GeoJSON it holds one column per field:
+MSOA centroids quantised to 1e-4 degrees (~10 m) and delta-encoded, metrics
+rounded to integers. The page only embeds the few-kB shell; the shell fetches
+the data when the overlay is switched on.
+"""
+import argparse
+import gzip
+import json
+import os
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).parent
+OVERLAY_DATA_FILE = BASE_DIR / "static" / "income_overlay.json"
+# Relative to the page URL; Streamlit serves ./static under app/static.
+OVERLAY_DATA_URL = "app/static/income_overlay.json"
+COORD_SCALE = 10_000
+
+
+def overlay_file(version: str = "", base: Path = OVERLAY_DATA_FILE) -> Path:
+    """Overlay data file for a cache version ("" is the unversioned cache)."""
+    return base.with_name(f"{base.stem}.{version}{base.suffix}") if version else base
+
+
+def overlay_url(path: Path) -> str:
+    """URL of a data file in ./static, relative to the page."""
+    return f"app/static/{path.name}"
+
+
+def overlay_metrics(area_income: pd.DataFrame) -> List[str]:
+    """Columns drawn by the overlay: net income plus any age columns."""
+    columns = ["net_income"] if "net_income" in area_income.columns else []
+    return columns + [col for col in area_income.columns if "age" in col.lower() and pd.api.types.is_numeric_dtype(area_income[col])]
+
+
+def build_overlay_data(area_income: pd.DataFrame) -> Dict:
+    """Columnar, quantised overlay payload for the MSOA rows of ``area_income``."""
+    df = area_income.dropna(subset=["latitude", "longitude"])
+    lat = np.round(pd.to_numeric(df["latitude"]).to_numpy(float) * COORD_SCALE).astype(np.int64)
+    lon = np.round(pd.to_numeric(df["longitude"]).to_numpy(float) * COORD_SCALE).astype(np.int64)
+    # Sorting by latitude keeps the deltas small, so most are 1-3 digits.
+    order = np.lexsort((lon, lat))
+    lat, lon = lat[order], lon[order]
+    labels = df["area_label"] if "area_label" in df.columns else df.get("msoa11", pd.Series("", index=df.index))
+    payload = {
+        "scale": COORD_SCALE,
+        "lat": np.diff(lat, prepend=0).tolist(),
+        "lon": np.diff(lon, prepend=0).tolist(),
+        "label": labels.astype(str).to_numpy()[order].tolist(),
+        "metrics": {},
+    }
+    for col in overlay_metrics(df):
+        values = pd.to_numeric(df[col], errors="coerce").to_numpy(float)[order]
+        # null for missing values; integers are plenty for £ and years.
+        payload["metrics"][col] = [None if np.isnan(v) else int(round(v)) for v in values]
+    return payload
+
+
+def write_overlay(area_income: pd.DataFrame, path: Path = OVERLAY_DATA_FILE) -> int:
+    """Write the overlay data file (atomically); returns its size in bytes."""
+    body = json.dumps(build_overlay_data(area_income), separators=(",", ":")).encode("utf-8")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(body)
+    os.replace(tmp, path)
+    return len(body)
+
+
+def overlay_html(data_url: str = OVERLAY_DATA_URL, height: int = 860) -> str:
+    """Self-contained page that fetches ``data_url`` and draws it with deck.gl over a token-free basemap."""
+    return f"""<!DOCTYPE html><html><head><meta charset="utf-8">
+<script src="https://unpkg.com/deck.gl@9.0.38/dist.min.js"></script>
+<script src="https://unpkg.com/maplibre-gl@4.7.1/dist/maplibre-gl.js"></script>
+<link href="https://unpkg.com/maplibre-gl@4.7.1/dist/maplibre-gl.css" rel="stylesheet">
+<style>body{{margin:0;font:13px sans-serif}}#map{{position:absolute;inset:0;height:{height}px}}#ui{{position:absolute;z-index:1;top:8px;left:8px;background:#fff;padding:6px;border-radius:4px}}</style>
+</head><body><div id="ui">Loading overlay…</div><div id="map"></div><script>
+const ui=document.getElementById("ui");
+fetch(new URL({json.dumps(data_url)},document.baseURI)).then(r=>{{if(!r.ok)throw new Error(r.status);return r.json()}}).then(d=>{{
+  let la=0,lo=0;const rows=d.lat.map((v,i)=>{{la+=v;lo+=d.lon[i];return {{lat:la/d.scale,lon:lo/d.scale,label:d.label[i],i}}}});
+  const names=Object.keys(d.metrics);if(!names.length||!rows.length){{ui.textContent="No income or age data.";return}}
+  ui.innerHTML="Colour by: <select id=m>"+names.map(n=>`<option>${{n}}</option>`).join("")+"</select>";
+  const view=new deck.DeckGL({{container:"map",mapStyle:"https://basemaps.cartocdn.com/gl/positron-gl-style/style.json",
+    initialViewState:{{latitude:rows.reduce((s,r)=>s+r.lat,0)/rows.length,longitude:rows.reduce((s,r)=>s+r.lon,0)/rows.length,zoom:8}},controller:true,
+    getTooltip:({{object:o}})=>o&&`${{o.label}}: ${{d.metrics[document.getElementById("m").value][o.i]??"n/a"}}`}});
+  const draw=()=>{{const v=d.metrics[document.getElementById("m").value],ok=v.filter(x=>x!==null),lo=Math.min(...ok),hi=Math.max(...ok);
+    view.setProps({{layers:[new deck.ScatterplotLayer({{id:"o",data:rows,getPosition:r=>[r.lon,r.lat],radiusUnits:"meters",getRadius:600,
+      getFillColor:r=>{{const x=v[r.i];if(x===null)return[160,160,160,80];const t=hi>lo?(x-lo)/(hi-lo):.5;return[255*t,80,255*(1-t),170]}},
+      pickable:true,updateTriggers:{{getFillColor:document.getElementById("m").value}}}})]}})}};
+  document.getElementById("m").onchange=draw;draw();
+}}).catch(e=>{{ui.textContent="Overlay data unavailable ("+e.message+")."}});
+</script></body></html>"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the static income & age overlay data from the cached area income.")
+    parser.add_argument("--output", type=Path, default=None, help="Default: the active cache version's data file.")
+    args = parser.parse_args()
+
+    from data_pipeline import cache_version, load_processed_data
+
+    args.output = args.output or overlay_file(cache_version())
+    area_income = load_processed_data()[4]
+    size = write_overlay(area_income, args.output)
+    body = args.output.read_bytes()
+    print(f"Wrote {args.output} for {len(area_income):,} areas: {size / 1024:,.1f} kB ({len(gzip.compress(body)) / 1024:,.1f} kB gzipped)")
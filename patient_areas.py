@@ -0,0 +1,103 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Areas patients are binned to for the map. Sectors ("DA1 1") come from the
+# postcode itself; MSOAs from the EMIS codes joined to area_income.
+PATIENT_LEVELS = ("sector", "msoa")
+# Areas with fewer patients than this are left off the map, and shown counts
+# are rounded to ROUND_TO, so small numbers cannot be read off or differenced.
+SUPPRESS_BELOW = 5
+ROUND_TO = 5
+
+# Filter keys kept per group, so apply_filters works on the area table as on patients.
+FILTER_KEYS = ["country", "postcode_area", "catchment_mask"]
+PATIENT_AREA_COLUMNS = ["level", "area", "area_label", *FILTER_KEYS, "latitude", "longitude", "patient_postcodes", "patient_count"]
+PATIENT_CELL_COLUMNS = ["area", "area_label", "latitude", "longitude", "patients"]
+
+
+def patient_records(patients: pd.DataFrame) -> np.ndarray:
+    """Patient records per row: the EMIS count, or 1 for caches written before the EMIS ingest (one row per patient)."""
+    if "patient_count" not in patients.columns:
+        return np.ones(len(patients), dtype=np.int64)
+    return patients["patient_count"].to_numpy(np.int64)
+
+
+def postcode_sector(postcode_clean: pd.Series) -> pd.Series:
+    """Outward code plus the inward digit ("DA11XD" → "DA1 1"); missing for malformed postcodes."""
+    clean = postcode_clean.astype(str)
+    sector = clean.str.slice(0, -3) + " " + clean.str.slice(-3, -2)
+    return sector.where(clean.str.match(r"^[A-Z0-9]{2,4}[0-9][A-Z]{2}$"))
+
+
+def _level_rows(df: pd.DataFrame, level: str, area: pd.Series, centroids: Optional[pd.DataFrame]) -> pd.DataFrame:
+    keyed = df.assign(area=area.to_numpy())
+    rows = keyed.groupby(["area", *FILTER_KEYS], sort=True, dropna=False).agg(
+        patient_postcodes=("postcode", "size"),
+        patient_count=("patient_count", "sum"),
+    ).reset_index()
+
+    # One point per area whatever the filter split: the area centroid when
+    # known, else the mean of the area's patients.
+    own = keyed.groupby("area", dropna=False)[["latitude", "longitude"]].mean().reindex(rows["area"])
+    latitude, longitude = own["latitude"].to_numpy(copy=True), own["longitude"].to_numpy(copy=True)
+    labels = rows["area"].astype(object).fillna(f"Unknown {level}").to_numpy()
+    if centroids is not None:
+        hits = centroids.index.get_indexer(rows["area"])
+        found = hits >= 0
+        latitude[found] = centroids["latitude"].to_numpy()[hits[found]]
+        longitude[found] = centroids["longitude"].to_numpy()[hits[found]]
+        if "area_label" in centroids.columns:
+            labels[found] = centroids["area_label"].astype(str).to_numpy()[hits[found]]
+    rows["latitude"], rows["longitude"], rows["area_label"] = latitude, longitude, labels
+    rows["level"] = level
+    return rows
+
+
+def build_patient_areas(patients: pd.DataFrame, area_income: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Patient postcodes and patient records per sector and per MSOA, split by the sidebar filter keys.
+
+    Counts here are exact and stay server-side; patient_cells suppresses them
+    before anything is drawn.
+    """
+    df = patients.assign(patient_count=patient_records(patients))
+
+    levels = [_level_rows(df, "sector", postcode_sector(df["postcode_clean"]), None)]
+    if "msoa11" in df.columns:
+        centroids = None
+        if area_income is not None and "msoa11" in area_income.columns and len(area_income):
+            unique = area_income.drop_duplicates(subset=["msoa11"])
+            centroids = unique.set_index(unique["msoa11"].astype(str))
+        levels.append(_level_rows(df, "msoa", df["msoa11"], centroids))
+
+    areas = pd.concat(levels, ignore_index=True)
+    areas["patient_postcodes"] = areas["patient_postcodes"].astype("int32")
+    areas["patient_count"] = areas["patient_count"].astype("int32")
+    return areas[PATIENT_AREA_COLUMNS]
+
+
+def patient_cells(
+    patient_areas: pd.DataFrame, level: str = "sector", suppress_below: int = SUPPRESS_BELOW, round_to: int = ROUND_TO
+) -> Tuple[pd.DataFrame, int]:
+    """Map-safe patient layer for (already filtered) ``patient_areas`` at ``level``.
+
+    Returns one row per area with at least ``suppress_below`` patients, its
+    count rounded to ``round_to``, plus the number of patients left off
+    (suppressed or without an area), also rounded.
+    """
+    if level not in PATIENT_LEVELS:
+        raise ValueError(f"Unknown patient level {level!r}; expected one of {PATIENT_LEVELS}")
+    rows = patient_areas[patient_areas["level"] == level]
+    cells = rows.groupby("area", sort=True).agg(
+        area_label=("area_label", "first"),
+        latitude=("latitude", "first"),
+        longitude=("longitude", "first"),
+        patients=("patient_count", "sum"),
+    ).reset_index()
+
+    shown = (cells["patients"] >= suppress_below) & cells["latitude"].notna() & cells["longitude"].notna()
+    hidden = int(rows["patient_count"].sum() - cells.loc[shown, "patients"].sum())
+    cells = cells[shown].reset_index(drop=True)
+    cells["patients"] = np.maximum(np.round(cells["patients"] / round_to) * round_to, suppress_below).astype(int)
+    return cells[PATIENT_CELL_COLUMNS], int(round(hidden / round_to) * round_to)
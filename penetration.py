@@ -0,0 +1,153 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from catchment import extract_district
+from patient_areas import patient_records
+
+# Area levels penetration can be computed at. Districts come from the postcode
+# itself; MSOAs need the postcode → msoa_id lookup written by data_pipeline.
+AREA_LEVELS = ("district", "msoa")
+
+# Metric column → (label, unit) for the sidebar and tooltips.
+PENETRATION_METRICS: Dict[str, Tuple[str, str]] = {
+    "donors_per_patient": ("Donor postcodes per patient", ""),
+    "donation_per_patient": ("Donations per patient", "£"),
+    "income_adjusted_rate": ("Donations per donor postcode per £1k income", "£"),
+    "penetration_gap": ("Patient share minus donation share", "%"),
+}
+
+
+def _area_codes(df: pd.DataFrame, level: str, vocabulary: pd.Index, postcode_msoa: Optional[pd.DataFrame]) -> np.ndarray:
+    """Integer area key per row (-1 when the row cannot be placed)."""
+    if level == "district":
+        return vocabulary.get_indexer(df["postcode_district"].astype(object))
+    if "msoa_id" in df.columns:
+        # Patients from the EMIS export carry their MSOA already (-1 is never in the vocabulary).
+        return vocabulary.get_indexer(df["msoa_id"].to_numpy())
+    if "postcode_id" in df.columns and "postcode_id" in postcode_msoa.columns:
+        # Both sides carry the postcode store's integer IDs: a dense ID → row array is the join.
+        ids, lookup_ids = df["postcode_id"].to_numpy(), postcode_msoa["postcode_id"].to_numpy()
+        by_id = np.full(max(ids.max(initial=-1), lookup_ids.max(initial=-1)) + 1, -1, dtype=np.intp)
+        by_id[lookup_ids[lookup_ids >= 0]] = np.flatnonzero(lookup_ids >= 0)
+        hits = np.where(ids >= 0, by_id[np.maximum(ids, 0)] if len(by_id) else -1, -1)
+    else:
+        hits = pd.Index(postcode_msoa["postcode_clean"]).get_indexer(df["postcode_clean"])
+    codes = np.full(len(df), -1, dtype=np.intp)
+    found = hits >= 0
+    codes[found] = vocabulary.get_indexer(postcode_msoa["msoa_id"].to_numpy()[hits[found]])
+    return codes
+
+
+def _bincount(codes: np.ndarray, size: int, weights=None) -> np.ndarray:
+    keep = codes >= 0
+    return np.bincount(codes[keep], weights=None if weights is None else np.asarray(weights)[keep], minlength=size)
+
+
+def _district_income(area_income: pd.DataFrame, postcode_msoa: pd.DataFrame, vocabulary: pd.Index) -> np.ndarray:
+    """Mean MSOA income over each district's postcodes (NaN where unknown)."""
+    income = np.full(len(vocabulary), np.nan)
+    if postcode_msoa.empty or "net_income" not in area_income.columns:
+        return income
+    by_msoa = pd.Series(pd.to_numeric(area_income["net_income"], errors="coerce").to_numpy(), index=area_income["msoa_id"])
+    per_postcode = by_msoa.reindex(postcode_msoa["msoa_id"]).to_numpy()
+    codes = vocabulary.get_indexer(extract_district(postcode_msoa["postcode_clean"]).astype(object))
+    known = (codes >= 0) & ~np.isnan(per_postcode)
+    totals = np.bincount(codes[known], weights=per_postcode[known], minlength=len(vocabulary))
+    counts = np.bincount(codes[known], minlength=len(vocabulary))
+    income[counts > 0] = totals[counts > 0] / counts[counts > 0]
+    return income
+
+
+def build_penetration(
+    patients: pd.DataFrame,
+    donor_events: pd.DataFrame,
+    area_income: pd.DataFrame,
+    postcode_msoa: Optional[pd.DataFrame] = None,
+    level: str = "district",
+) -> pd.DataFrame:
+    """Patients, donors, donations and income per area with penetration ratios.
+
+    Every input is mapped to one integer area key and counted with bincount,
+    so this stays cheap enough to rerun on filtered frames. ``penetration_gap``
+    is an area's share of patients minus its share of donations (in points):
+    positive where we serve patients but raise comparatively little.
+    """
+    if level not in AREA_LEVELS:
+        raise ValueError(f"Unknown area level {level!r}; expected one of {AREA_LEVELS}")
+    if postcode_msoa is None:
+        postcode_msoa = pd.DataFrame({"postcode_clean": pd.Series(dtype=str), "msoa_id": pd.Series(dtype="int32")})
+
+    if level == "district":
+        vocabulary = pd.Index(
+            sorted(set(patients["postcode_district"].dropna().astype(str)) | set(donor_events["postcode_district"].dropna().astype(str)))
+        )
+        labels = vocabulary.to_numpy()
+    else:
+        vocabulary = pd.Index(area_income["msoa_id"].to_numpy())
+        labels = area_income["msoa11"].to_numpy()
+    size = len(vocabulary)
+
+    patient_codes = _area_codes(patients, level, vocabulary, postcode_msoa)
+    donor_codes = _area_codes(donor_events, level, vocabulary, postcode_msoa)
+
+    # Distinct donor postcodes per area: de-duplicate (area, postcode) pairs first.
+    postcode_ids = pd.factorize(donor_events["postcode"])[0]
+    pairs = np.unique(np.stack([donor_codes, postcode_ids]), axis=1) if len(donor_codes) else np.empty((2, 0), dtype=np.int64)
+
+    table = pd.DataFrame(
+        {
+            "area_key": np.arange(size, dtype=np.int32),
+            "area": labels,
+            "patient_count": _bincount(patient_codes, size, patient_records(patients)).astype(np.int32),
+            "donor_postcodes": _bincount(pairs[0], size).astype(np.int32),
+            "donation_count": _bincount(donor_codes, size, donor_events["events_in_month"]).astype(np.int64),
+            "donation_sum": _bincount(donor_codes, size, donor_events["Donation Amount"]),
+        }
+    )
+
+    if level == "district":
+        # Centroid of every patient and donor row in the district.
+        all_codes = np.concatenate([patient_codes, donor_codes])
+        lat = np.concatenate([patients["latitude"].to_numpy(float), donor_events["latitude"].to_numpy(float)])
+        lon = np.concatenate([patients["longitude"].to_numpy(float), donor_events["longitude"].to_numpy(float)])
+        located = (all_codes >= 0) & ~np.isnan(lat) & ~np.isnan(lon)
+        counts = np.bincount(all_codes[located], minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            table["latitude"] = np.bincount(all_codes[located], weights=lat[located], minlength=size) / counts
+            table["longitude"] = np.bincount(all_codes[located], weights=lon[located], minlength=size) / counts
+        table["net_income"] = _district_income(area_income, postcode_msoa, vocabulary)
+    else:
+        table["latitude"] = area_income["latitude"].to_numpy(float)
+        table["longitude"] = area_income["longitude"].to_numpy(float)
+        table["net_income"] = pd.to_numeric(area_income["net_income"], errors="coerce").to_numpy() if "net_income" in area_income.columns else np.nan
+
+    table = table[(table["patient_count"] > 0) | (table["donor_postcodes"] > 0)].reset_index(drop=True)
+
+    patients_total = table["patient_count"].sum()
+    donations_total = table["donation_sum"].sum()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        patients_per = table["patient_count"].where(table["patient_count"] > 0)
+        table["donors_per_patient"] = table["donor_postcodes"] / patients_per
+        table["donation_per_patient"] = table["donation_sum"] / patients_per
+        per_donor = table["donation_sum"] / table["donor_postcodes"].where(table["donor_postcodes"] > 0)
+        table["income_adjusted_rate"] = per_donor / table["net_income"] * 1000
+        patient_share = table["patient_count"] / patients_total if patients_total else 0.0
+        donation_share = table["donation_sum"] / donations_total if donations_total else 0.0
+        table["penetration_gap"] = (patient_share - donation_share) * 100
+    table.insert(0, "level", level)
+    return table
+
+
+def build_all_penetration(
+    patients: pd.DataFrame,
+    donor_events: pd.DataFrame,
+    area_income: pd.DataFrame,
+    postcode_msoa: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """Penetration at every area level in one long table, for the build-time cache."""
+    return pd.concat(
+        [build_penetration(patients, donor_events, area_income, postcode_msoa, level) for level in AREA_LEVELS],
+        ignore_index=True,
+    )
@@ -0,0 +1,168 @@
+"""Canonical postcode geocode table shared by patients, donors, shops and income.
+
+    python postcodes.py                 # seed data_cache/postcodes.parquet from every geocoded CSV we have
+    python postcodes.py --summary       # row counts and coverage only
+
+Each distinct postcode (upper case, spaces removed) is stored once with a
+stable integer ``postcode_id`` equal to its row number, so joining a dataset
+to its coordinates is an array take rather than a string merge. Rows are only
+ever appended; a later source can fill a field an earlier one left blank but
+never overwrite it.
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).parent
+STORE_FILE = BASE_DIR / "data_cache" / "postcodes.parquet"
+GEOCODE_COLUMNS = ["latitude", "longitude", "admin_district", "admin_county", "country"]
+STORE_COLUMNS = ["postcode_id", "postcode_clean", "postcode", *GEOCODE_COLUMNS]
+
+# Every file that carries postcodes.io results, most trusted first.
+SEED_FILES = [
+    BASE_DIR / "postcode_coordinates.csv",
+    BASE_DIR / "shops_geocoded.csv",
+    BASE_DIR / "donation_events_geocoded.csv",
+    BASE_DIR / "archive" / "postcode_cache.csv",
+    *sorted((BASE_DIR / "archive").glob("donor_postcode_coordinates*.csv")),
+    BASE_DIR / "archive" / "donor_events_geocoded.csv",
+]
+
+
+def clean_postcodes(values: Iterable) -> pd.Series:
+    """Upper-case, whitespace-free postcodes; blanks and "NAN" become missing."""
+    cleaned = pd.Series(values, dtype=object).astype(str).str.upper().str.replace(r"\s+", "", regex=True)
+    return cleaned.mask(cleaned.isin(["", "NAN", "NONE", "<NA>"]))
+
+
+class PostcodeStore:
+    def __init__(self, table: Optional[pd.DataFrame] = None):
+        if table is None:
+            table = pd.DataFrame({col: pd.Series(dtype=float if col in ("latitude", "longitude") else object) for col in STORE_COLUMNS})
+            table["postcode_id"] = table["postcode_id"].astype("int32")
+        self.table = table.reset_index(drop=True)
+        self._index = pd.Index(self.table["postcode_clean"])
+
+    @classmethod
+    def load(cls, path: Path = STORE_FILE) -> "PostcodeStore":
+        return cls(pd.read_parquet(path)) if path.exists() else cls()
+
+    def save(self, path: Path = STORE_FILE) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            self.table.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def ids(self, postcodes: Iterable) -> np.ndarray:
+        """``postcode_id`` per value (-1 where unknown or blank)."""
+        return self._index.get_indexer(clean_postcodes(postcodes)).astype(np.int32)
+
+    def missing(self, postcodes: Iterable) -> np.ndarray:
+        """Distinct cleaned postcodes that have no row yet."""
+        cleaned = clean_postcodes(postcodes).dropna().unique()
+        return cleaned[self._index.get_indexer(cleaned) < 0]
+
+    def geocode(self, ids: np.ndarray) -> pd.DataFrame:
+        """GEOCODE_COLUMNS for ``ids``, row-aligned; unknown ids give missing values."""
+        ids = np.asarray(ids)
+        if not len(self):
+            return pd.DataFrame({col: np.full(len(ids), np.nan) for col in GEOCODE_COLUMNS})
+        rows = self.table[GEOCODE_COLUMNS].take(np.where(ids >= 0, ids, 0)).reset_index(drop=True)
+        return rows.mask(np.repeat((ids < 0)[:, None], len(GEOCODE_COLUMNS), axis=1))
+
+    def add(self, rows: pd.DataFrame, postcode_column: str = "postcode") -> int:
+        """Register geocoded ``rows``; returns how many new postcodes were stored.
+
+        Rows without coordinates are skipped so the postcode is looked up again next time.
+        """
+        incoming = rows.assign(postcode_clean=clean_postcodes(rows[postcode_column]).to_numpy())
+        incoming = incoming[incoming["postcode_clean"].notna()]
+        for col in GEOCODE_COLUMNS:
+            if col not in incoming.columns:
+                incoming[col] = np.nan
+        incoming["latitude"] = pd.to_numeric(incoming["latitude"], errors="coerce")
+        incoming["longitude"] = pd.to_numeric(incoming["longitude"], errors="coerce")
+        incoming = incoming.dropna(subset=["latitude", "longitude"]).drop_duplicates(subset=["postcode_clean"])
+        for col in ("admin_district", "admin_county", "country"):
+            incoming[col] = incoming[col].where(incoming[col].notna() & (incoming[col].astype(str).str.strip() != ""))
+
+        hits = self._index.get_indexer(incoming["postcode_clean"])
+        known = incoming[hits >= 0]
+        if len(known):
+            # Fill fields an earlier source left blank (e.g. income rows have no district).
+            at = hits[hits >= 0]
+            for col in GEOCODE_COLUMNS:
+                current = self.table[col].to_numpy(dtype=object if col not in ("latitude", "longitude") else float).copy()
+                gaps = pd.isna(current[at])
+                if gaps.any():
+                    current[at[gaps]] = known[col].to_numpy()[gaps]
+                    self.table[col] = current
+
+        new = incoming[hits < 0]
+        if len(new):
+            appended = pd.DataFrame(
+                {
+                    "postcode_id": np.arange(len(self), len(self) + len(new), dtype=np.int32),
+                    "postcode_clean": new["postcode_clean"].to_numpy(),
+                    "postcode": new[postcode_column].astype(str).str.strip().str.upper().to_numpy(),
+                    **{col: new[col].to_numpy() for col in GEOCODE_COLUMNS},
+                }
+            )
+            self.table = pd.concat([self.table, appended], ignore_index=True) if len(self) else appended
+            self._index = pd.Index(self.table["postcode_clean"])
+        return len(new)
+
+    def geocode_missing(self, postcodes: Iterable, fetch: Callable[[str], Optional[dict]], delay: float = 0.08) -> int:
+        """Look up every unknown postcode with ``fetch`` (one call each); returns how many were found."""
+        found = []
+        todo = self.missing(postcodes)
+        for i, postcode in enumerate(todo):
+            if i % 50 == 0 and i:
+                print(f"   Progress: {i}/{len(todo)} ({i * 100 // len(todo)}%)")
+            result = fetch(postcode)
+            if result:
+                found.append(result)
+            time.sleep(delay)
+        return self.add(pd.DataFrame(found)) if found else 0
+
+
+def seed_store(store: PostcodeStore, files: Iterable[Path] = SEED_FILES) -> int:
+    """Add every geocoded postcode in ``files`` (CSVs with a postcode column plus coordinates)."""
+    added = 0
+    for path in files:
+        if not path.exists():
+            continue
+        header = pd.read_csv(path, nrows=0).columns
+        postcode_column = next((col for col in header if col.lower() in ("postcode", "post code", "postal code")), None)
+        if postcode_column is None or "latitude" not in header:
+            continue
+        frame = pd.read_csv(path, usecols=[postcode_column, *(col for col in GEOCODE_COLUMNS if col in header)])
+        added += store.add(frame, postcode_column)
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the canonical postcode geocode table from the geocoded CSVs.")
+    parser.add_argument("--store", type=Path, default=STORE_FILE)
+    parser.add_argument("--summary", action="store_true", help="Only report what the store holds.")
+    args = parser.parse_args()
+
+    store = PostcodeStore.load(args.store)
+    if not args.summary:
+        before = len(store)
+        added = seed_store(store)
+        store.save(args.store)
+        print(f"Added {added:,} postcodes ({before:,} already stored)")
+    filled = store.table[GEOCODE_COLUMNS].notna().mean().round(3).to_dict()
+    print(f"{len(store):,} postcodes in {args.store}; share with each field: {filled}")
@@ -0,0 +1,357 @@
+"""Local HTTP API over the processed datasets (asyncio, no extra dependencies).
+
+    python query_api.py --port 8765
+    curl 'http://127.0.0.1:8765/donors/by-postcode?start=2024-01&end=2024-12&catchment=East'
+    curl 'http://127.0.0.1:8765/donors?region=South%20East&source=REGSOL&format=arrow' > donors.arrow
+
+Endpoints: /health, /summary, /patients, /shops, /shops/rollups, /donors,
+/donors/by-postcode, /donors/by-month, /donors/trend, /hex, /penetration.
+Query parameters (all optional, repeatable where it makes sense): start, end
+(YYYY-MM), country, region, catchment, donor_type, source, application,
+min_amount, max_amount, resolution (/hex only), level (/penetration only:
+district or msoa), max_km (/shops/rollups only), metric and by
+(/donors/trend only, see timeseries.py) and format (json or arrow).
+
+Responses are cached per normalised query and HTTP/1.1 connections are kept
+alive, so dashboards polling the same view cost one dictionary lookup. When a
+rebuild switches the active cache version (data_pipeline.build_cache_version)
+the next request reloads the datasets from it and drops the cached responses. For
+several concurrent users, compute_backend.py serves the same endpoints from a
+pool of worker processes sharing one copy of the data.
+"""
+import argparse
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import pyarrow as pa
+
+from data_pipeline import (
+    active_cache_dir,
+    load_donation_tensor,
+    load_event_index,
+    load_hex_aggregates,
+    load_kpi_rollups,
+    load_penetration,
+    load_postcode_msoa,
+    load_processed_data,
+)
+from event_index import DRILLDOWN_COLUMNS, EventIndex
+from filters import REGION_AREAS, REGION_GROUPS, FilterSpec, apply_filters
+from hexgrid import HEX_RESOLUTIONS, aggregate_hex
+from kpi import ROLLUP_DRILLDOWNS, build_rollups, filter_rollups, summarise
+from map_compute import aggregate_donors_for_map
+from penetration import AREA_LEVELS, build_penetration
+from shop_catchment import shop_rollups
+from timeseries import BREAKDOWNS, TENSOR_METRICS, DonationTensor
+
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+JSON_MIME = "application/json"
+MAX_HEADER_BYTES = 16 * 1024
+
+Response = Tuple[int, str, bytes]
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _frame_to_arrow(df: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _frame_to_json(df: pd.DataFrame) -> bytes:
+    df = df.copy()
+    for col in df.select_dtypes(include="object").columns:
+        if len(df) and not isinstance(df[col].iloc[0], (str, type(None))):
+            df[col] = df[col].map(lambda v: list(v) if hasattr(v, "__iter__") else v)
+    return df.to_json(orient="records", date_format="iso").encode("utf-8")
+
+
+class QueryService:
+    """Answers queries from one in-memory copy of the processed datasets."""
+
+    def __init__(
+        self, datasets=None, rollups: Optional[pd.DataFrame] = None, cache_size: int = 256, directory: Optional[Path] = None
+    ):
+        # Tables not passed in, and those loaded lazily, all come from this one cache version.
+        self.directory = directory or active_cache_dir()
+        # Only a service that loaded its own datasets can reload them when the version changes.
+        self.follows_cache = datasets is None
+        self._load(datasets, rollups)
+        self.cache: "OrderedDict[str, Response]" = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, datasets=None, rollups: Optional[pd.DataFrame] = None) -> None:
+        self.patients, _, self.donor_events, self.shops, self.area_income = datasets or load_processed_data(directory=self.directory)
+        self.rollups = rollups if rollups is not None else load_kpi_rollups(self.directory)
+        # Row positions only line up with the cached index when the datasets came from the cache here.
+        self.event_index = load_event_index(self.directory) if datasets is None else EventIndex.build(self.donor_events)
+        self.hex_aggregates: Optional[pd.DataFrame] = None
+        self.penetration: Optional[pd.DataFrame] = None
+        self.tensor: Optional[DonationTensor] = None
+        self.postcode_msoa: Optional[pd.DataFrame] = None
+        self.months = sorted(self.donor_events["month"].unique())
+        frames = (self.patients, self.donor_events, self.shops, self.area_income)
+        self.countries = sorted(set().union(*(df["country"].dropna() for df in frames)))
+        amounts = self.donor_events["Donation Amount"]
+        self.amount_range = (float(amounts.min()), float(amounts.max())) if len(amounts) else (0.0, 0.0)
+
+    def reload(self) -> None:
+        """Load the active cache version and drop every response computed from the previous one."""
+        self.directory = active_cache_dir()
+        self._load()
+        with self.cache_lock:
+            self.cache.clear()
+
+    def _spec(self, params: Dict[str, List[str]]) -> FilterSpec:
+        regions = [r for r in params.get("region", list(REGION_GROUPS)) if r]
+        unknown = [r for r in regions if r not in REGION_GROUPS]
+        if unknown:
+            raise BadRequest(f"Unknown region(s): {unknown}")
+        try:
+            donation_range = (float(params.get("min_amount", ["-inf"])[0]), float(params.get("max_amount", ["inf"])[0]))
+        except ValueError as exc:
+            raise BadRequest(f"Invalid amount: {exc}") from exc
+        return FilterSpec.from_regions(
+            params.get("country", self.countries),
+            regions,
+            params.get("start", [self.months[0]])[0],
+            params.get("end", [self.months[-1]])[0],
+            donation_range,
+            catchments=params.get("catchment"),
+            # A postcode-month matches a drill-down if any of its values is requested.
+            donor_filters={dimension: params[dimension] for dimension in DRILLDOWN_COLUMNS if dimension in params},
+        )
+
+    def _unfiltered(self, spec: FilterSpec) -> bool:
+        """Whether ``spec`` keeps every row of every region, so the tables precomputed at build time answer it.
+
+        Clients such as backend_client always send the month range (and the app
+        the amount bounds), so this compares what the spec covers rather than
+        which parameters were sent.
+        """
+        return (
+            set(self.countries) <= set(spec.countries)
+            and REGION_AREAS <= set(spec.postcode_areas)
+            and spec.start_month <= self.months[0]
+            and spec.end_month >= self.months[-1]
+            and not self._amount_restricted(spec)
+            and spec.catchments is None
+            and not spec.donor_filters
+        )
+
+    def _amount_restricted(self, spec: FilterSpec) -> bool:
+        """Whether the amount bounds drop any postcode-month (bounds at or past the data's range do not)."""
+        low, high = spec.donation_range
+        return low > self.amount_range[0] or high < self.amount_range[1]
+
+    def _donors(self, spec: FilterSpec) -> pd.DataFrame:
+        return apply_filters(self.donor_events, spec, self.event_index)
+
+    def _hex(self, spec: FilterSpec, params: Dict[str, List[str]]) -> pd.DataFrame:
+        try:
+            resolution = int(params.pop("resolution", [min(HEX_RESOLUTIONS)])[0])
+        except ValueError as exc:
+            raise BadRequest(f"Invalid resolution: {exc}") from exc
+        if resolution not in HEX_RESOLUTIONS:
+            raise BadRequest(f"Unknown resolution {resolution}; expected one of {list(HEX_RESOLUTIONS)}")
+        if self._unfiltered(spec):
+            # Default views come straight from the table precomputed at build time.
+            if self.hex_aggregates is None:
+                self.hex_aggregates = load_hex_aggregates(self.directory)
+            return self.hex_aggregates[self.hex_aggregates["resolution"] == resolution]
+        return aggregate_hex(apply_filters(self.patients, spec), self._donors(spec), apply_filters(self.shops, spec), resolution)
+
+    def _penetration(self, spec: FilterSpec, params: Dict[str, List[str]]) -> pd.DataFrame:
+        level = params.pop("level", ["district"])[0]
+        if level not in AREA_LEVELS:
+            raise BadRequest(f"Unknown level {level!r}; expected one of {list(AREA_LEVELS)}")
+        if self._unfiltered(spec):
+            if self.penetration is None:
+                self.penetration = load_penetration(self.directory)
+            return self.penetration[self.penetration["level"] == level]
+        if self.postcode_msoa is None:
+            self.postcode_msoa = load_postcode_msoa(self.directory)
+        return build_penetration(
+            apply_filters(self.patients, spec), self._donors(spec), apply_filters(self.area_income, spec), self.postcode_msoa, level
+        )
+
+    def _trend(self, spec: FilterSpec, params: Dict[str, List[str]]) -> pd.DataFrame:
+        metric = params.pop("metric", [TENSOR_METRICS[0]])[0]
+        by = params.pop("by", ["total"])[0]
+        if metric not in TENSOR_METRICS:
+            raise BadRequest(f"Unknown metric {metric!r}; expected one of {list(TENSOR_METRICS)}")
+        if by not in BREAKDOWNS:
+            raise BadRequest(f"Unknown breakdown {by!r}; expected one of {list(BREAKDOWNS)}")
+        if self._amount_restricted(spec) or spec.donor_filters:
+            # Amount bounds and drill-downs are per row, so only unrestricted events can use the cached tensor.
+            tensor = DonationTensor.build(self._donors(spec))
+        else:
+            if self.tensor is None:
+                self.tensor = load_donation_tensor(self.directory)
+            tensor = self.tensor
+        return tensor.series(spec, metric, by=by).reset_index()
+
+    def _compute(self, path: str, params: Dict[str, List[str]]) -> object:
+        if path == "/health":
+            return {
+                "status": "ok",
+                "cache_dir": str(self.directory),
+                "cache_entries": len(self.cache),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+        spec = self._spec(params)
+        if path == "/hex":
+            return self._hex(spec, params)
+        if path == "/penetration":
+            return self._penetration(spec, params)
+        if path == "/patients":
+            return apply_filters(self.patients, spec)
+        if path == "/shops":
+            return apply_filters(self.shops, spec)
+        if path == "/shops/rollups":
+            try:
+                max_km = float(params.pop("max_km", ["0"])[0])
+            except ValueError as exc:
+                raise BadRequest(f"Invalid max_km: {exc}") from exc
+            # Every shop is listed; the filters only decide which patients and donors count.
+            return shop_rollups(apply_filters(self.patients, spec), self._donors(spec), self.shops, max_km=max_km or None)
+        if path == "/donors":
+            return self._donors(spec)
+        if path == "/donors/by-postcode":
+            return aggregate_donors_for_map(self._donors(spec))
+        if path == "/donors/by-month":
+            donors = self._donors(spec)
+            return (
+                donors.groupby("month", as_index=False)
+                .agg(donation_sum=("Donation Amount", "sum"), donation_count=("events_in_month", "sum"), donor_postcodes=("postcode", "nunique"))
+                .sort_values("month")
+            )
+        if path == "/donors/trend":
+            return self._trend(spec, params)
+        if path == "/summary":
+            if self._amount_restricted(spec) or any(dimension not in ROLLUP_DRILLDOWNS for dimension, _ in spec.donor_filters):
+                return summarise(build_rollups(self._donors(spec)))
+            return summarise(filter_rollups(self.rollups, spec))
+        raise KeyError(path)
+
+    def respond(self, path: str, params: Dict[str, List[str]], fmt: str) -> Response:
+        """Compute and serialise one query, bypassing the cache."""
+        try:
+            result = self._compute(path, params)
+        except KeyError:
+            return 404, JSON_MIME, json.dumps({"error": f"Unknown endpoint {path}"}).encode()
+        except BadRequest as exc:
+            return 400, JSON_MIME, json.dumps({"error": str(exc)}).encode()
+
+        if isinstance(result, pd.DataFrame):
+            return (200, ARROW_MIME, _frame_to_arrow(result)) if fmt == "arrow" else (200, JSON_MIME, _frame_to_json(result))
+        return 200, JSON_MIME, json.dumps(result, default=str).encode("utf-8")
+
+    def handle(self, target: str) -> Response:
+        url = urlsplit(target)
+        # A blank value (``country=``) selects nothing rather than falling back to everything.
+        params = parse_qs(url.query, keep_blank_values=True)
+        fmt = params.pop("format", ["json"])[0]
+        key = url.path + "?" + "&".join(f"{k}={','.join(sorted(v))}" for k, v in sorted(params.items())) + f"#{fmt}"
+
+        if self.follows_cache and active_cache_dir() != self.directory:
+            with self.reload_lock:
+                # Another request may have reloaded while this one waited.
+                if active_cache_dir() != self.directory:
+                    self.reload()
+        directory = self.directory
+
+        cacheable = url.path != "/health"
+        with self.cache_lock:
+            if cacheable and key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            self.misses += cacheable
+
+        response = self.respond(url.path, params, fmt)
+        # A response computed from the previous version must not outlive the reload.
+        if cacheable and response[0] == 200 and self.directory == directory:
+            with self.cache_lock:
+                self.cache[key] = response
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return response
+
+
+async def _handle_connection(service: QueryService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except asyncio.LimitOverrunError:
+                writer.write(b"HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                break
+
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ", 2)
+            except ValueError:
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                break
+            headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in lines[1:] if line)}
+            if headers.get("content-length"):
+                await reader.readexactly(int(headers["content-length"]))
+
+            if method != "GET":
+                status, mime, body = 405, JSON_MIME, b'{"error": "Only GET is supported"}'
+            else:
+                # Pandas work runs in a thread so other connections keep being served.
+                status, mime, body = await loop.run_in_executor(None, service.handle, target)
+
+            keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+            reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}.get(status, "")
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: {mime}\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                + body
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int, service: QueryService) -> None:
+    server = await asyncio.start_server(lambda r, w: _handle_connection(service, r, w), host, port, limit=MAX_HEADER_BYTES)
+    print(f"Serving on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve filtered/aggregated donor and patient data over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-size", type=int, default=256, help="Number of responses kept in the LRU cache.")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, QueryService(cache_size=args.cache_size)))
+    except KeyboardInterrupt:
+        pass
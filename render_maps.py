@@ -0,0 +1,161 @@
+"""Render standalone pydeck HTML maps from the cached datasets, without Streamlit.
+
+    python render_maps.py --start 2022-01 --end 2025-03 --name patient_map
+    python render_maps.py --specs reports.json --workers 4
+
+A specs file is a JSON list of objects with any of: name, countries, regions,
+start_month, end_month, donation_range, catchments, per_month, map_style,
+patient_level ("sector", "msoa" or null for exact postcodes; default
+"sector"), donor_filters (e.g. {"donor_type": ["Company"], "source": ["REGSOL"]};
+see event_index.py) and layer toggles (show_patients, show_donors, show_shops,
+differentiate_donor_sources). Missing filters default to "everything".
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from data_pipeline import load_event_index, load_patient_areas, load_processed_data
+from filters import REGION_GROUPS, FilterSpec, apply_filters
+from map_compute import build_map_spec, deck_from_spec
+from patient_areas import patient_cells
+
+BASE_DIR = Path(__file__).parent
+SECRETS_FILE = BASE_DIR / ".streamlit" / "secrets.toml"
+DEFAULT_OUTPUT_DIR = BASE_DIR / "reports"
+DEFAULT_MAP_STYLE = "mapbox://styles/mapbox/light-v11"
+LAYER_OPTIONS = ("show_patients", "show_donors", "show_shops", "differentiate_donor_sources")
+
+# Loaded once per process. With the "fork" start method the workers inherit
+# the parent's copy, so the Parquet files are read exactly once.
+_DATASETS = None
+_PATIENT_AREAS = None
+_EVENT_INDEX = None
+
+
+def _datasets():
+    global _DATASETS, _PATIENT_AREAS, _EVENT_INDEX
+    if _DATASETS is None:
+        _DATASETS = load_processed_data()
+        _PATIENT_AREAS = load_patient_areas()
+        _EVENT_INDEX = load_event_index()
+    return _DATASETS
+
+
+def mapbox_token() -> Optional[str]:
+    """MAPBOX_TOKEN from the environment, falling back to the Streamlit secrets file."""
+    if os.environ.get("MAPBOX_TOKEN"):
+        return os.environ["MAPBOX_TOKEN"]
+    if SECRETS_FILE.exists():
+        import tomllib
+
+        with SECRETS_FILE.open("rb") as handle:
+            return tomllib.load(handle).get("MAPBOX_TOKEN", {}).get("MAPBOX_TOKEN")
+    return None
+
+
+def build_jobs(specs: List[Dict], output_dir: Path) -> List[Tuple[Path, FilterSpec, Optional[str], Dict]]:
+    """Expand report specs into (output file, filter spec, timeline month, options) jobs."""
+    donor_events = _datasets()[2]
+    all_months = sorted(donor_events["month"].unique())
+    all_countries = sorted(set().union(*(set(df["country"].dropna()) for df in _datasets() if "country" in df.columns)))
+
+    jobs = []
+    for i, raw in enumerate(specs):
+        name = raw.get("name", f"map_{i + 1}")
+        spec = FilterSpec.from_regions(
+            raw.get("countries", all_countries),
+            raw.get("regions", list(REGION_GROUPS)),
+            raw.get("start_month", all_months[0]),
+            raw.get("end_month", all_months[-1]),
+            tuple(raw.get("donation_range", (float("-inf"), float("inf")))),
+            catchments=raw.get("catchments"),
+            donor_filters=raw.get("donor_filters"),
+        )
+        options = {key: raw[key] for key in LAYER_OPTIONS if key in raw}
+        options["map_style"] = raw.get("map_style", DEFAULT_MAP_STYLE)
+        # Reports get shared, so patients are aggregated unless a spec asks for exact points.
+        options["patient_level"] = raw.get("patient_level", "sector")
+
+        if raw.get("per_month"):
+            months = [m for m in all_months if spec.start_month <= m <= spec.end_month]
+            jobs.extend((output_dir / f"{name}_{month}.html", spec, month, options) for month in months)
+        else:
+            jobs.append((output_dir / f"{name}.html", spec, None, options))
+    return jobs
+
+
+def render(job: Tuple[Path, FilterSpec, Optional[str], Dict], token: Optional[str]) -> Tuple[str, Optional[int]]:
+    """Render one job to HTML; returns (path, donor rows drawn) or (path, None) when nothing matched."""
+    output, spec, timeline_month, options = job
+    patients, _, donor_events, shops, area_income = _datasets()
+    options = dict(options)
+    map_style = options.pop("map_style")
+    patient_level = options.pop("patient_level")
+    if patient_level is not None and options.get("show_patients", True):
+        options["patient_cells"] = patient_cells(apply_filters(_PATIENT_AREAS, spec), patient_level)[0]
+
+    donors = apply_filters(donor_events, spec, _EVENT_INDEX)
+    map_spec = build_map_spec(
+        apply_filters(patients, spec),
+        donors,
+        apply_filters(shops, spec),
+        apply_filters(area_income, spec),
+        timeline_month,
+        **options,
+    )
+    if map_spec is None:
+        return str(output), None
+    deck = deck_from_spec(map_spec, map_style=map_style, mapbox_token=token)
+    deck.to_html(str(output), open_browser=False, notebook_display=False)
+    drawn = int((donors["month"] == timeline_month).sum()) if timeline_month is not None else len(donors)
+    return str(output), drawn
+
+
+def render_all(specs: List[Dict], output_dir: Path, workers: int) -> List[Tuple[str, Optional[int]]]:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    jobs = build_jobs(specs, output_dir)
+    token = mapbox_token()
+    if workers <= 1 or len(jobs) == 1:
+        return [render(job, token) for job in jobs]
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_datasets) as pool:
+        return list(pool.map(render, jobs, [token] * len(jobs)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render standalone HTML maps from the processed datasets.")
+    parser.add_argument("--specs", type=Path, help="JSON file with a list of report specs.")
+    parser.add_argument("--name", default="ellenor_map", help="Output name when no specs file is given.")
+    parser.add_argument("--start", dest="start_month", help="First month (YYYY-MM).")
+    parser.add_argument("--end", dest="end_month", help="Last month (YYYY-MM).")
+    parser.add_argument("--region", dest="regions", action="append", help="UK region to include (repeatable).")
+    parser.add_argument("--catchment", dest="catchments", action="append", help="Restrict to a catchment (repeatable).")
+    parser.add_argument("--per-month", action="store_true", help="Write one map per month in the range.")
+    parser.add_argument("--output-dir", type=Path, default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if args.specs:
+        report_specs = json.loads(args.specs.read_text())
+    else:
+        cli_spec = {"name": args.name, "per_month": args.per_month}
+        for key in ("start_month", "end_month", "regions", "catchments"):
+            if getattr(args, key):
+                cli_spec[key] = getattr(args, key)
+        report_specs = [cli_spec]
+
+    started = time.perf_counter()
+    _datasets()
+    results = render_all(report_specs, args.output_dir, args.workers)
+    for path, rows in results:
+        print(f"{path}: {'no data for these filters' if rows is None else f'{rows:,} donor rows'}")
+    print(f"Rendered {len(results)} map(s) in {time.perf_counter() - started:.1f}s")
+    sys.exit(0 if results else 1)
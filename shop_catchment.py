@@ -0,0 +1,91 @@
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from geo import nearest
+from patient_areas import patient_records
+
+NO_SHOP = -1
+
+# Categorical palette (tab20) for colouring points by their nearest shop.
+SHOP_PALETTE: List[List[int]] = [
+    [31, 119, 180], [255, 127, 14], [44, 160, 44], [214, 39, 40], [148, 103, 189],
+    [140, 86, 75], [227, 119, 194], [127, 127, 127], [188, 189, 34], [23, 190, 207],
+    [174, 199, 232], [255, 187, 120], [152, 223, 138], [255, 152, 150], [197, 176, 213],
+    [196, 156, 148], [247, 182, 210], [199, 199, 199], [219, 219, 141], [158, 218, 229],
+]
+
+
+def shop_color(shop_ids, alpha: int = 200) -> List[List[int]]:
+    """RGBA per shop ID; rows without a shop are grey."""
+    return [SHOP_PALETTE[i % len(SHOP_PALETTE)] + [alpha] if i >= 0 else [180, 180, 180, 120] for i in np.asarray(shop_ids)]
+
+
+def add_shop_ids(shops: pd.DataFrame) -> pd.DataFrame:
+    """Give every shop a stable integer ``shop_id`` (its row position)."""
+    shops["shop_id"] = np.arange(len(shops), dtype=np.int16)
+    return shops
+
+
+def add_nearest_shop_columns(df: pd.DataFrame, shops: pd.DataFrame) -> pd.DataFrame:
+    """Attach ``nearest_shop`` (shop_id) and ``shop_distance_km`` to every row with coordinates."""
+    # Donor events repeat each postcode once per month: search once per postcode.
+    codes, _ = pd.factorize(df["postcode"]) if "postcode" in df.columns else (np.arange(len(df)), None)
+    first = np.unique(codes, return_index=True)[1] if len(codes) else np.array([], dtype=np.intp)
+    index, distance = nearest(df["latitude"].to_numpy()[first], df["longitude"].to_numpy()[first], shops["latitude"], shops["longitude"])
+    index, distance = index[codes], distance[codes]
+    # Map row positions back to shop IDs; a trailing NO_SHOP slot absorbs index -1.
+    shop_ids = np.append(shops["shop_id"].to_numpy(np.int16), np.int16(NO_SHOP))
+    df["nearest_shop"] = shop_ids[index]
+    df["shop_distance_km"] = distance
+    return df
+
+
+def with_hypothetical_shop(shops: pd.DataFrame, name: str, latitude: float, longitude: float, postcode: str = "") -> pd.DataFrame:
+    """Copy of ``shops`` with one extra shop appended under the next free shop_id."""
+    next_id = int(shops["shop_id"].max()) + 1 if len(shops) else 0
+    extra = pd.DataFrame(
+        {"shop_id": [np.int16(next_id)], "name": [name], "postcode": [postcode], "latitude": [latitude], "longitude": [longitude], "hypothetical": [True]}
+    )
+    if "hypothetical" not in shops.columns:
+        shops = shops.assign(hypothetical=False)
+    return pd.concat([shops, extra], ignore_index=True)
+
+
+def shop_rollups(patients: pd.DataFrame, donor_events: pd.DataFrame, shops: pd.DataFrame, max_km: Optional[float] = None) -> pd.DataFrame:
+    """Patients, donor postcodes and donations attributed to each shop.
+
+    Rows need the ``nearest_shop`` column; with ``max_km`` only rows within
+    that distance of their shop are counted.
+    """
+    size = int(shops["shop_id"].max()) + 1 if len(shops) else 0
+
+    def _codes(df: pd.DataFrame) -> np.ndarray:
+        codes = df["nearest_shop"].to_numpy(np.int64)
+        if max_km is not None:
+            codes = np.where(df["shop_distance_km"].to_numpy() <= max_km, codes, NO_SHOP)
+        return codes
+
+    patient_codes = _codes(patients)
+    donor_codes = _codes(donor_events)
+    keep_p, keep_d = patient_codes >= 0, donor_codes >= 0
+
+    # One donor postcode may appear in many months; count it once per shop.
+    postcode_ids = pd.factorize(donor_events["postcode"])[0]
+    pairs = np.unique(np.stack([donor_codes[keep_d], postcode_ids[keep_d]]), axis=1) if keep_d.any() else np.empty((2, 0), dtype=np.int64)
+
+    rollups = pd.DataFrame(
+        {
+            "shop_id": np.arange(size, dtype=np.int16),
+            "patient_count": np.bincount(patient_codes[keep_p], weights=patient_records(patients)[keep_p], minlength=size).astype(np.int32),
+            "donor_postcodes": np.bincount(pairs[0], minlength=size).astype(np.int32),
+            "donation_count": np.bincount(donor_codes[keep_d], weights=donor_events["events_in_month"].to_numpy()[keep_d], minlength=size).astype(np.int64),
+            "donation_sum": np.bincount(donor_codes[keep_d], weights=donor_events["Donation Amount"].to_numpy()[keep_d], minlength=size),
+        }
+    )
+    distances = donor_events.loc[keep_d, ["nearest_shop", "shop_distance_km"]].groupby("nearest_shop")["shop_distance_km"].median()
+    rollups["median_donor_km"] = rollups["shop_id"].map(distances).astype(float)
+
+    columns = [col for col in ("shop_id", "name", "postcode", "hypothetical") if col in shops.columns]
+    return shops[columns].merge(rollups, on="shop_id", how="left").sort_values("donation_sum", ascending=False, ignore_index=True)
@@ -0,0 +1,118 @@
+import heapq
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from geo import GridIndex
+from patient_areas import patient_records
+
+# Relative weight of each kind of demand in a site's score. Each kind is
+# normalised to a share of its own total first, so the weights are comparable.
+DEFAULT_WEIGHTS: Dict[str, float] = {"donor_value": 1.0, "patients": 1.0, "income": 0.0}
+
+
+def build_demand(donor_events: pd.DataFrame, patients: pd.DataFrame, area_income: pd.DataFrame) -> pd.DataFrame:
+    """One row per demand point (donor postcode, patient postcode or MSOA) with its raw quantities."""
+    donors = donor_events.groupby("postcode", observed=True).agg(
+        latitude=("latitude", "first"), longitude=("longitude", "first"), donor_value=("Donation Amount", "sum")
+    )
+    people = (
+        patients.assign(patient_count=patient_records(patients))
+        .groupby("postcode", observed=True)
+        .agg(latitude=("latitude", "first"), longitude=("longitude", "first"), patients=("patient_count", "sum"))
+    )
+    frames = [donors.reset_index(drop=True), people.reset_index(drop=True)]
+    if "net_income" in area_income.columns and not area_income.empty:
+        frames.append(area_income[["latitude", "longitude"]].assign(income=pd.to_numeric(area_income["net_income"], errors="coerce")))
+    demand = pd.concat(frames, ignore_index=True)
+    for col in DEFAULT_WEIGHTS:
+        demand[col] = demand[col].fillna(0.0).astype(float) if col in demand.columns else 0.0
+    return demand.dropna(subset=["latitude", "longitude"]).reset_index(drop=True)
+
+
+def select_sites(
+    candidates: pd.DataFrame,
+    demand: pd.DataFrame,
+    shops: pd.DataFrame,
+    radius_km: float = 5.0,
+    n_sites: int = 5,
+    weights: Optional[Dict[str, float]] = None,
+    chunk_rows: int = 10_000,
+    batch_size: int = 256,
+) -> pd.DataFrame:
+    """Greedy max-coverage: the ``n_sites`` candidates that together reach the most uncovered demand.
+
+    Demand within ``radius_km`` of an existing shop counts as covered. Each
+    pick adds the candidate with the largest marginal gain, using lazy
+    evaluation (CELF): gains only shrink as coverage grows, so a stale gain
+    is an upper bound and most candidates are never re-scored.
+
+    Demand points are bucketed once in a GridIndex; all neighbourhood lookups
+    (initial scores, re-scoring, coverage updates) are vectorised queries on it.
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    columns = ["rank", "label", "latitude", "longitude", "score", "donor_value", "patients", "income"]
+    if candidates.empty or demand.empty or not n_sites:
+        return pd.DataFrame(columns=columns)
+
+    # Score = weighted percentage of each kind of demand captured.
+    value = np.zeros(len(demand))
+    for col in DEFAULT_WEIGHTS:
+        total = float(demand[col].sum())
+        if total and weights[col]:
+            value += weights[col] * 100 * demand[col].to_numpy() / total
+
+    index = GridIndex(demand["latitude"], demand["longitude"], cell_km=radius_km)
+    covered = np.zeros(len(demand), dtype=bool)
+    if not shops.empty:
+        covered[index.query_pairs(shops["latitude"], shops["longitude"], radius_km)[1]] = True
+
+    cand_lat = candidates["latitude"].to_numpy(float)
+    cand_lon = candidates["longitude"].to_numpy(float)
+    remaining = np.where(covered, 0.0, value)
+    gains = np.zeros(len(candidates))
+    for start in range(0, len(candidates), chunk_rows):
+        block = slice(start, start + chunk_rows)
+        query_idx, point_idx, _ = index.query_pairs(cand_lat[block], cand_lon[block], radius_km)
+        gains[block] = np.bincount(query_idx, weights=remaining[point_idx], minlength=len(cand_lat[block]))
+
+    # Heap entries are (-gain, candidate, round the gain was computed in). A gain
+    # from the current round is exact; older ones are upper bounds that get
+    # re-scored a batch at a time when they reach the top.
+    heap = [(-gain, i, 0) for i, gain in enumerate(gains) if gain > 0]
+    heapq.heapify(heap)
+    picks = []
+    while heap and len(picks) < n_sites:
+        if heap[0][2] == len(picks):
+            gain, i, _ = heapq.heappop(heap)
+            reach = index.query_pairs(cand_lat[i : i + 1], cand_lon[i : i + 1], radius_km)[1]
+            reach = reach[~covered[reach]]
+            covered[reach] = True
+            picks.append((i, -gain, *(float(demand[col].to_numpy()[reach].sum()) for col in DEFAULT_WEIGHTS)))
+            continue
+        stale = np.array([heapq.heappop(heap)[1] for _ in range(min(batch_size, len(heap)))])
+        query_idx, point_idx, _ = index.query_pairs(cand_lat[stale], cand_lon[stale], radius_km)
+        fresh = np.bincount(query_idx, weights=np.where(covered[point_idx], 0.0, value[point_idx]), minlength=len(stale))
+        for i, gain in zip(stale, fresh):
+            if gain > 0:
+                heapq.heappush(heap, (-gain, int(i), len(picks)))
+
+    labels = candidates["label"] if "label" in candidates.columns else candidates.index.astype(str)
+    return pd.DataFrame(
+        [
+            (rank, labels.iloc[i], cand_lat[i], cand_lon[i], gain, donor_value, patients, income)
+            for rank, (i, gain, donor_value, patients, income) in enumerate(picks, start=1)
+        ],
+        columns=columns,
+    )
+
+
+def candidate_sites(area_income: pd.DataFrame, *fallbacks: pd.DataFrame) -> pd.DataFrame:
+    """Candidate locations: MSOA centroids, or distinct postcodes of ``fallbacks`` when there is no income data."""
+    if not area_income.empty:
+        label = area_income["area_label"].astype(str) if "area_label" in area_income.columns else area_income["msoa11"].astype(str)
+        return pd.DataFrame({"label": label.to_numpy(), "latitude": area_income["latitude"].to_numpy(), "longitude": area_income["longitude"].to_numpy()})
+    frames = [df[["postcode", "latitude", "longitude"]] for df in fallbacks]
+    postcodes = pd.concat(frames).dropna().drop_duplicates(subset=["postcode"])
+    return postcodes.rename(columns={"postcode": "label"}).reset_index(drop=True)
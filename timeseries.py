@@ -0,0 +1,175 @@
+"""Donation time series from a dense area x month x source tensor.
+
+The tensor is built once per cache version (see data_pipeline.write_cache), so
+trend, rolling, year-on-year and seasonal views are array slices and sums
+rather than groupbys over donor_events.
+"""
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from cohort import month_index, month_label
+from filters import REGION_GROUPS, FilterSpec
+
+TENSOR_METRICS = ("donation_sum", "donation_count", "donor_postcodes")
+# Key columns of the "area" axis: together they decide every non-amount filter.
+AREA_KEY_COLUMNS = ("country", "postcode_area", "catchment_mask")
+BREAKDOWNS = ("total", "source", "region", "postcode_area")
+
+
+class DonationTensor:
+    """Dense (metric x area x month x source) array of donor_events, built once.
+
+    The area axis is every distinct (country, postcode area, catchment mask),
+    so country, region and catchment filters become a boolean mask over it and
+    the month range a slice; amount filters are per row and need a rebuild
+    from the filtered events. Sources are the ``Source`` label (one per
+    postcode-month, "Multiple" when mixed), so summing over them never double
+    counts. ``donor_postcodes`` is distinct postcodes per month; summed over
+    months it counts donor-months.
+    """
+
+    def __init__(self, values: np.ndarray, areas: pd.DataFrame, first_month: int, sources: np.ndarray):
+        self.values = values
+        self.areas = areas
+        self.first_month = first_month
+        self.sources = sources
+        self.months = month_label(np.arange(first_month, first_month + values.shape[2]))
+
+    @classmethod
+    def build(cls, donor_events: pd.DataFrame) -> "DonationTensor":
+        keys = donor_events[list(AREA_KEY_COLUMNS)].astype({"country": str, "postcode_area": str, "catchment_mask": np.uint8})
+        groups = keys.groupby(list(AREA_KEY_COLUMNS), sort=True)
+        area_codes = groups.ngroup().to_numpy()
+        areas = groups.size().index.to_frame(index=False)
+        source_codes, sources = pd.factorize(donor_events["Source"].astype(str), sort=True)
+        months = month_index(donor_events["month"]) if len(donor_events) else np.array([0], dtype=np.int32)
+        first = int(months.min())
+        shape = (len(areas), int(months.max()) - first + 1, len(sources))
+
+        # One flat bincount per metric over the raveled (area, month, source) cell index.
+        cells = np.ravel_multi_index((area_codes, months - first, source_codes), shape) if len(donor_events) else np.array([], dtype=np.intp)
+        size = int(np.prod(shape))
+        values = np.stack(
+            [
+                np.bincount(cells, weights=donor_events["Donation Amount"].to_numpy(float), minlength=size),
+                np.bincount(cells, weights=donor_events["events_in_month"].to_numpy(float), minlength=size),
+                np.bincount(cells, minlength=size).astype(float),
+            ]
+        ).reshape((len(TENSOR_METRICS), *shape))
+        return cls(values, areas, first, np.asarray(sources, dtype=str))
+
+    def save(self, path: Path) -> None:
+        # Through a file handle: given a path, numpy appends ".npz" to names without it.
+        with open(path, "wb") as handle:
+            self._savez(handle)
+
+    def _savez(self, handle) -> None:
+        np.savez_compressed(
+            handle,
+            values=self.values,
+            first_month=self.first_month,
+            sources=self.sources,
+            **{f"area_{col}": self.areas[col].to_numpy(dtype=str if col != "catchment_mask" else np.uint8) for col in AREA_KEY_COLUMNS},
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "DonationTensor":
+        with np.load(path) as data:
+            areas = pd.DataFrame({col: data[f"area_{col}"] for col in AREA_KEY_COLUMNS})
+            return cls(data["values"], areas, int(data["first_month"]), data["sources"])
+
+    # ----------------------------
+    # Queries
+    # ----------------------------
+    def _area_mask(self, spec: FilterSpec) -> np.ndarray:
+        mask = self.areas["country"].isin(spec.countries).to_numpy() & self.areas["postcode_area"].isin(spec.postcode_areas).to_numpy()
+        bits = spec.catchment_bits
+        if bits is not None:
+            mask &= (self.areas["catchment_mask"].to_numpy(np.uint8) & bits) != 0
+        return mask
+
+    def _month_slice(self, spec: FilterSpec) -> slice:
+        start = int(month_index(pd.Series([spec.start_month]))[0]) - self.first_month
+        end = int(month_index(pd.Series([spec.end_month]))[0]) - self.first_month + 1
+        return slice(max(start, 0), max(min(end, len(self.months)), 0))
+
+    def series(self, spec: FilterSpec, metric: str = "donation_sum", by: str = "total", sources: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Monthly ``metric`` under ``spec`` as a month-indexed frame with one column per ``by`` group."""
+        if by not in BREAKDOWNS:
+            raise ValueError(f"Unknown breakdown {by!r}; expected one of {BREAKDOWNS}")
+        months = self._month_slice(spec)
+        area_mask = self._area_mask(spec)
+        source_mask = np.isin(self.sources, list(sources)) if sources is not None else np.ones(len(self.sources), dtype=bool)
+        block = self.values[TENSOR_METRICS.index(metric), :, months][:, :, source_mask]  # (area, month, source)
+        index = pd.Index(self.months[months], name="month")
+
+        if by == "total":
+            return pd.DataFrame({"total": block[area_mask].sum(axis=(0, 2))}, index=index)
+        if by == "source":
+            return pd.DataFrame(block[area_mask].sum(axis=0), index=index, columns=self.sources[source_mask])
+        per_area = block.sum(axis=2)  # (area, month)
+        if by == "postcode_area":
+            grouped = pd.DataFrame(per_area[area_mask]).groupby(self.areas["postcode_area"].to_numpy()[area_mask]).sum()
+            return grouped.T.set_axis(index, axis=0)
+        # Regions overlap, so each one is its own masked sum.
+        areas = self.areas["postcode_area"].to_numpy()
+        columns: Dict[str, np.ndarray] = {
+            region: per_area[area_mask & np.isin(areas, members)].sum(axis=0) for region, members in REGION_GROUPS.items() if region in _regions_of(spec)
+        }
+        return pd.DataFrame(columns, index=index)
+
+
+def _regions_of(spec: FilterSpec) -> set:
+    """Regions with at least one postcode area in ``spec``."""
+    chosen = set(spec.postcode_areas)
+    return {region for region, members in REGION_GROUPS.items() if chosen.intersection(members)}
+
+
+# ----------------------------
+# Derived series (all operate on month-indexed frames from DonationTensor.series)
+# ----------------------------
+def rolling_sum(frame: pd.DataFrame, window: int = 12) -> pd.DataFrame:
+    """Trailing ``window``-month sums via a cumulative sum; the first ``window - 1`` months are NaN."""
+    values = frame.to_numpy(float)
+    totals = np.cumsum(np.vstack([np.zeros((1, values.shape[1])), values]), axis=0)
+    rolled = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        rolled[window - 1 :] = totals[window:] - totals[:-window]
+    return pd.DataFrame(rolled, index=frame.index, columns=frame.columns)
+
+
+def yoy_change(frame: pd.DataFrame, lag: int = 12) -> pd.DataFrame:
+    """Percentage change against the same month ``lag`` months earlier (NaN without a comparable month)."""
+    values = frame.to_numpy(float)
+    change = np.full(values.shape, np.nan)
+    if len(values) > lag:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change[lag:] = np.where(values[:-lag] != 0, (values[lag:] / values[:-lag] - 1) * 100, np.nan)
+    return pd.DataFrame(change, index=frame.index, columns=frame.columns)
+
+
+def seasonal_decomposition(series: pd.Series, period: int = 12) -> pd.DataFrame:
+    """Classical additive decomposition: centred moving-average trend, mean seasonal profile, residual."""
+    values = series.to_numpy(float)
+    n = len(values)
+    trend = np.full(n, np.nan)
+    if n >= period + 1:
+        # 2 x period centred moving average (half weights at both ends for an even period).
+        weights = np.r_[0.5, np.ones(period - 1), 0.5] / period if period % 2 == 0 else np.ones(period) / period
+        half = len(weights) // 2
+        trend[half : n - half] = np.convolve(values, weights, mode="valid")
+
+    # Average the detrended values by position in the cycle, then centre the profile on zero.
+    detrended = values - trend
+    # Calendar month for monthly series, so a range starting mid-year still lines up.
+    phase = month_index(pd.Series(series.index)) % period if period == 12 else np.arange(n) % period
+    known = ~np.isnan(detrended)
+    sums = np.bincount(phase[known], weights=detrended[known], minlength=period)
+    counts = np.bincount(phase[known], minlength=period)
+    profile = np.divide(sums, counts, out=np.zeros(period), where=counts > 0)
+    profile -= profile[counts > 0].mean() if counts.any() else 0.0
+    seasonal = profile[phase]
+    return pd.DataFrame({"observed": values, "trend": trend, "seasonal": seasonal, "residual": values - trend - seasonal}, index=series.index)